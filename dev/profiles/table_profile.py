@@ -1,5 +1,6 @@
 import sys
 import cProfile
+from timeit import repeat
 
 from wikitextparser import *
 
@@ -18,3 +19,15 @@ profiler.disable()
 with open('table_profile_results.txt', 'w', encoding='utf8') as f:
     sys.stdout = f
     profiler.print_stats(sort='tottime')
+sys.stdout = sys.__stdout__
+
+
+# The time per row of Table.data() should stay about the same as the number
+# of rows grows. A new Table is used for each run to avoid its caches.
+ROW = '|-\n| a || colspan="2" | b\n| rowspan="2" | c || d\n'
+print('rows\tdata() ms\tus/row')
+for rows in (500, 1000, 2000, 4000, 8000):
+    tables = iter([Table('{|\n' + ROW * rows + '|}') for _ in range(3)])
+    seconds = min(repeat(lambda: next(tables).data(), number=1, repeat=3))
+    print('{}\t{:.1f}\t\t{:.1f}'.format(
+        rows, seconds * 1e3, seconds * 1e6 / rows))
@@ -32,6 +32,7 @@ setup(
     ],
     extras_require={
         'dev': ['path.py', 'coverage', 'twine'],
+        'numpy': ['numpy'],
     },
     zip_safe=True,
     classifiers=[
@@ -79,6 +79,15 @@ class TestArgument(TestCase):
         ae(' b ', a1.value)
         ae('2', a1.name)
 
+    def test_equal_sign_in_a_heading_does_not_make_keyword_args(self):
+        ae = self.assertEqual
+        p = parse('{{t|\n== h ==\n|b|c=d|e}}')
+        arguments = p.templates[0].arguments
+        ae([a.name for a in arguments], ['1', '2', 'c', '3'])
+        # the numbers found without the template after an edit elsewhere
+        p.insert(0, ' ')
+        ae([a.name for a in arguments], ['1', '2', 'c', '3'])
+
     def test_setting_positionality(self):
         ae = self.assertEqual
         a = Argument("|1=v")
@@ -126,6 +135,28 @@ class TestArgument(TestCase):
         # ignored. (?)
         ae(Argument('| *a\n*b').get_lists()[0].items, ['b'])
 
+    def test_plain_value_and_name_assignment(self):
+        ae = self.assertEqual
+        p = parse('{{t|a|b=c|{{d}}}}[[l]]')
+        t = p.templates[0]
+        a0, a1, a2 = t.arguments
+        a0.value = 'xyz'
+        ae(a0.name, '1')
+        a1.name = 'bb'
+        a1.value = ''
+        ae(a2.name, '2')
+        ae(t.string, '{{t|xyz|bb=|{{d}}}}')
+        ae(p.wikilinks[0].string, '[[l]]')
+        ae(t.arguments[1].name, 'bb')
+        # Values that are not plain text are parsed as usual.
+        a0.value = '{{e}}'
+        ae(t.templates[1].string, '{{e}}')
+        a0.value = 'f'
+        ae([tl.string for tl in p.templates], ['{{t|f|bb=|{{d}}}}', '{{d}}'])
+        a0.value = 'g=h'
+        ae((a0.name, a0.value), ('g', 'h'))
+        ae(t.arguments[2].name, '1')
+
 
 if __name__ == '__main__':
     main()
@@ -3,7 +3,7 @@
 
 from unittest import TestCase, main
 
-from wikitextparser import Parameter
+from wikitextparser import Parameter, parse
 
 
 class ParameterTest(TestCase):
@@ -106,6 +106,15 @@ class ParameterTest(TestCase):
         ae(p.string, '{{{2<!-- |comment| -->}}}')
         ae(p.pipe, '')
 
+    def test_control_characters_in_a_wikilink_target(self):
+        ae = self.assertEqual
+        w = parse('[[{{{p|x}}}]]')
+        w.parameters[0].default = 'x\ty'
+        ae(w.wikilinks, [])
+        w = parse('[[{{{p|x}}}]]')
+        w.parameters[0].name = 'q\x00'
+        ae(w.wikilinks, [])
+
 
 if __name__ == '__main__':
     main()
@@ -65,6 +65,22 @@ class TestParserFunction(TestCase):
         self.assertEqual(len(
             ParserFunction("{{text|a<s |>b</s>c}}").arguments), 1)
 
+    def test_argument_spans_are_removed_with_the_arguments(self):
+        ae = self.assertEqual
+        wt = WikiText('{{#a:b}}{{#c:d}}')
+        a, c = wt.parser_functions
+        a_arg = a.arguments[0]
+        ae(len(c.arguments), 1)
+        type_to_spans = wt._type_to_spans
+        wt.insert(0, 'x')
+        self.assertIn(id(a._span), type_to_spans)
+        self.assertNotIn(id(c._span), type_to_spans)
+        ae(a_arg.string, ':b')
+        del a_arg
+        wt.insert(0, 'x')
+        self.assertNotIn(id(a._span), type_to_spans)
+        ae(a.arguments[0].value, 'b')
+
 
 if __name__ == '__main__':
     main()
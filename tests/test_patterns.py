@@ -0,0 +1,52 @@
+"""Test the functionalities of _patterns.py."""
+
+
+from unittest import main, TestCase
+
+from wikitextparser import parse, pattern_cache_info, set_pattern_cache_size
+# noinspection PyProtectedMember
+from wikitextparser._patterns import compiled_pattern
+
+
+class PatternCache(TestCase):
+
+    def tearDown(self):
+        set_pattern_cache_size()
+
+    def test_repeated_patterns_are_compiled_once(self):
+        ae = self.assertEqual
+        parsed = parse('<s>a</s>\n#b\n##c\n')
+        parsed.get_tags('s')
+        # Standard patterns like \# are looked up in the list tree instead.
+        parsed.get_lists('#')
+        hits, misses = pattern_cache_info()[:2]
+        for _ in range(3):
+            parsed.get_tags('s')
+            lst = parsed.get_lists('#')[0]
+            lst.sublists()
+        info = pattern_cache_info()
+        # start_tag, end_tag, and list for each iteration; sublists adds
+        # #\#, #\*, and #[:;]
+        ae(info.hits - hits, 3 * 3 + 2 * 3)
+        ae(info.misses - misses, 3)
+        ae(info.maxsize, 256)
+
+    def test_least_recently_used_pattern_is_dropped(self):
+        ae = self.assertEqual
+        set_pattern_cache_size(2)
+        self.assertLessEqual(pattern_cache_info().currsize, 2)
+        a = compiled_pattern('list', b'a')
+        compiled_pattern('list', b'b')
+        self.assertIs(compiled_pattern('list', b'a'), a)
+        compiled_pattern('list', b'c')  # drops b
+        misses = pattern_cache_info().misses
+        self.assertIs(compiled_pattern('list', b'a'), a)
+        compiled_pattern('list', b'b')
+        ae(pattern_cache_info().misses, misses + 1)
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, set_pattern_cache_size, 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,16 @@
 ﻿"""Test the functionalities of spans.py."""
 
 
+from random import Random
 from unittest import expectedFailure, main, TestCase
 
 # noinspection PyProtectedMember
-from wikitextparser._spans import PF_TL_FINDITER, parse_to_spans
+from wikitextparser._spans import (
+    PF_TL_FINDITER, TypeToSpans, pack_spans, parse_to_packed_spans,
+    parse_to_spans, set_span_engine)
 from wikitextparser import WikiText, parse
+# noinspection PyProtectedMember
+from wikitextparser._wikitext import _shrink_spans
 
 
 def bytearray_parse_to_spans(bytes_: bytes):
@@ -397,9 +402,131 @@ class Spans(TestCase):
         ae(bpts(b'[[a[[a{{#if:||}}]]]]')['WikiLink'][1], [3, 18])
 
 
+class StackEngineSpans(Spans):
+    """Run the span tests using the stack engine."""
+
+    def setUp(self):
+        set_span_engine('stack')
+
+    def tearDown(self):
+        set_span_engine('regex')
+
+
+def engine_parse_to_spans(bytes_: bytes, engine: str):
+    set_span_engine(engine)
+    try:
+        byte_array = bytearray(bytes_)
+        return parse_to_spans(byte_array), byte_array
+    finally:
+        set_span_engine('regex')
+
+
+class SpanEngines(TestCase):
+    """Compare the stack engine with the regex engine."""
+
+    def assertSameSpans(self, bytes_: bytes):
+        self.assertEqual(
+            engine_parse_to_spans(bytes_, 'regex'),
+            engine_parse_to_spans(bytes_, 'stack'), bytes_)
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, set_span_engine, 'x')
+
+    def test_param_vs_template(self):
+        self.assertSameSpans(b'{{{{{a}}}}}')
+        self.assertSameSpans(b'{{{{{{a}}}}}}')
+        self.assertSameSpans(b'{{{{|a}}}}')
+        # The template inside the wikilink is found first.
+        self.assertSameSpans(b'{{{[[d|{{}}]]}}}')
+
+    def test_wikilink_masked_by_template(self):
+        self.assertSameSpans(b'{{a|[[File:x|[[b]]]]}}')
+        self.assertSameSpans(b'{{t|[[{{PAGENAME}}]]}}')
+        self.assertSameSpans(
+            b'{{|{{|{{}}}}[[a[[{{{}}}{{t}}|{{|{{|{{}}}}}}]]]]}}')
+
+    def test_wikilink_in_param(self):
+        self.assertSameSpans(b'{{{a|[[b|c]]}}}')
+        self.assertSameSpans(b'{{{a|[[b|c]d]]}}}')
+        self.assertSameSpans(b'{{{a|[[|]]}}}')
+
+    def test_crossing_constructs(self):
+        self.assertSameSpans(b'{{a|[[b}}|c]]')
+        self.assertSameSpans(b'[[a|{{b]]}}')
+        self.assertSameSpans(b'{{a|[[b}}')
+
+    def test_deeply_nested_wikilinks_in_templates(self):
+        # The states of each construct used to be rebuilt from scratch for
+        # every round, which took minutes for this input.
+        n = 200
+        self.assertSameSpans(('{{a|[[b|' * n + 'x' + ']]}}' * n).encode())
+
+    def test_random_input(self):
+        pieces = (
+            '{', '}', '[', ']', '{{', '}}', '[[', ']]', '{{{', '}}}', '|',
+            'a', ' ', '_', '#if:', '<b>', '</b>', '<!--', '-->', '<ref>',
+            '</ref>', '\n', 'http://', '[[a|', '{{t|', '<span title="', '">')
+        random = Random(0)
+        for _ in range(2000):
+            self.assertSameSpans(''.join(
+                random.choice(pieces) for _ in range(random.randint(0, 30))
+            ).encode())
+
+
 # todo: check all {{text}} tests and make sure they are treated as if they do
 #  not exist
 
 
+class PackedSpans(TestCase):
+
+    """Test the TypeToSpans class and the packed spans."""
+
+    def test_packed_spans_match_parse_to_spans(self):
+        string = b'{{a|[[b]]}}<!--c-->{{{d}}}<ref>{{#if:e}}</ref>'
+        type_to_spans = TypeToSpans(parse_to_packed_spans(bytearray(string)))
+        self.assertEqual(dict(type_to_spans.items()), bpts(string))
+
+    def test_lookup_unpacks_only_that_type(self):
+        type_to_spans = TypeToSpans(
+            {'Template': pack_spans([[5, 9], [0, 12]]), 'WikiLink': []})
+        self.assertEqual(type_to_spans['Template'], [[0, 12], [5, 9]])
+        self.assertIs(type_to_spans['Template'], type_to_spans['Template'])
+        self.assertEqual(list(dict.keys(type_to_spans)), ['Template'])
+        self.assertIn('WikiLink', type_to_spans)
+        self.assertEqual(len(type_to_spans), 2)
+        self.assertRaises(KeyError, type_to_spans.__getitem__, 'Comment')
+
+    def test_setitem_replaces_packed_spans(self):
+        type_to_spans = TypeToSpans({'Template': pack_spans([[0, 5]])})
+        type_to_spans['Template'] = []
+        self.assertEqual(type_to_spans.setdefault('Template', None), [])
+        self.assertEqual(dict(type_to_spans.items()), {'Template': []})
+
+    def test_subspans_copy(self):
+        type_to_spans = TypeToSpans(
+            {'Template': pack_spans([[0, 20], [2, 7], [8, 14], [9, 21]])})
+        wikilinks = type_to_spans.setdefault('WikiLink', [[3, 6], [10, 12]])
+        copy = type_to_spans.subspans_copy(2, 14)
+        self.assertEqual(dict(copy.items()), {
+            'Template': [[0, 5], [6, 12]], 'WikiLink': [[1, 4], [8, 10]]})
+        self.assertEqual(list(dict.keys(type_to_spans)), ['WikiLink'])
+        self.assertEqual(wikilinks, [[3, 6], [10, 12]])
+
+    def test_updates_are_deferred_for_packed_types(self):
+        ae = self.assertEqual
+        type_to_spans = TypeToSpans(
+            parse_to_packed_spans(bytearray(b'{{a}}[[b]]<!--c-->[[d]]')))
+        type_to_spans['Template']  # unpacks the Template spans only
+        type_to_spans.update_spans(_shrink_spans, 5, 10)
+        ae(list(type_to_spans._packed), [
+            'Comment', 'ExtensionTag', 'Parameter', 'ParserFunction',
+            'WikiLink'])
+        ae(type_to_spans['Template'], [[0, 5]])
+        ae(type_to_spans['Comment'], [[5, 13]])
+        ae(type_to_spans['WikiLink'], [[13, 18]])
+        type_to_spans.unpack()
+        ae(type_to_spans._deferred, [])
+
+
 if __name__ == '__main__':
     main()
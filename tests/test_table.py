@@ -12,7 +12,7 @@
 
 from unittest import TestCase, main
 
-from wikitextparser import Table, WikiText
+from wikitextparser import Table, WikiText, set_table_span_limits
 
 
 class Data(TestCase):
@@ -323,6 +323,109 @@ class Data(TestCase):
             '|align="center" rowspan="1"|B\n'
             '|}').data(), [['A”', 'B']])
 
+    def test_cached_attrs_are_updated_after_edits(self):
+        t = Table('{|\n|colspan=2|a\n|-\n|b||c\n|}')
+        self.assertEqual(t.data(), [['a', 'a'], ['b', 'c']])
+        self.assertEqual(t.data(), [['a', 'a'], ['b', 'c']])
+        t[11:12] = '1'
+        self.assertEqual(t.data(), [['a', None], ['b', 'c']])
+
+
+class IterRows(TestCase):
+
+    def test_values_and_cells(self):
+        ae = self.assertEqual
+        t = Table('{|\n|rowspan=2|a||b\n|-\n|c\n|-\n|d||e||f\n|}')
+        rows = t.iter_rows()
+        ae(next(rows), ['a', 'b'])
+        ae(list(rows), [['a', 'c'], ['d', 'e', 'f']])
+        ae(
+            [[c.value for c in r] for r in t.iter_rows(cells=True)],
+            [['a', 'b'], ['a', 'c'], ['d', 'e', 'f']])
+        ae(
+            list(t.iter_rows(span=False, strip=False)),
+            [['a', 'b'], ['c'], ['d', 'e', 'f']])
+
+    def test_rows_after_the_last_row_of_cells(self):
+        t = Table('{|\n|rowspan=3|a||b\n|-\n|c\n|}')
+        self.assertEqual(
+            list(t.iter_rows()), [['a', 'b'], ['a', 'c'], ['a', None]])
+        self.assertEqual(list(t.iter_rows()), t.data())
+
+
+class SpanLimits(TestCase):
+
+    def test_huge_spans_are_clamped(self):
+        ae = self.assertEqual
+        t = Table('{|\n|rowspan=100000 colspan=5000|a\n|-\n|b\n|}')
+        rows = t.iter_rows()
+        ae(len(next(rows)), 1000)
+        ae(next(rows)[-1], 'b')
+        set_table_span_limits(colspan=3, rowspan=3)
+        try:
+            ae(t.data(), [
+                ['a', 'a', 'a', None],
+                ['a', 'a', 'a', 'b'],
+                ['a', 'a', 'a', None]])
+        finally:
+            set_table_span_limits()
+        self.assertRaises(ValueError, set_table_span_limits, 0)
+
+    def test_the_number_of_cells_is_bounded(self):
+        ae = self.assertEqual
+        t = Table('{|\n|rowspan=100000 colspan=5000|a\n|-\n|b\n|}')
+        self.assertLessEqual(sum(len(r) for r in t.iter_rows()), 1000000)
+        set_table_span_limits(colspan=3, rowspan=1000, cells=12)
+        try:
+            ae(t.data(), [
+                ['a', 'a', 'a', None],
+                ['a', 'a', 'a', 'b'],
+                ['a', 'a', 'a', None]])
+        finally:
+            set_table_span_limits()
+        self.assertRaises(ValueError, set_table_span_limits, cells=0)
+
+    def test_negative_spans_are_ignored(self):
+        self.assertEqual(Table(
+            '{|\n|colspan=-2 rowspan=-1|a||b\n|-\n|c\n|}').data(),
+            [['a', 'b'], ['c', None]])
+
+
+class Columns(TestCase):
+
+    table = Table(
+        '{|\n!name!!age!!x\n|-\n|a||1||\n|-\n|b||2.5||3\n|-\n'
+        '|colspan=2|c\n|}')
+
+    def test_columns(self):
+        self.assertEqual(self.table.columns(), [
+            ['name', 'a', 'b', 'c'],
+            ['age', '1', '2.5', 'c'],
+            ['x', '', '3', None]])
+        self.assertEqual(self.table.columns(span=False), [
+            ['name', 'a', 'b', 'c'],
+            ['age', '1', '2.5', None],
+            ['x', '', '3', None]])
+
+    def test_to_columns(self):
+        ae = self.assertEqual
+        ae(self.table.to_columns(), {
+            'name': ['a', 'b', 'c'],
+            'age': ['1', '2.5', 'c'],
+            'x': ['', '3', None]})
+        ae(self.table.to_columns(None)[1], ['age', '1', '2.5', 'c'])
+        ae(Table('{|\n!a!!a!!\n|-\n|1||2||3\n|}').to_columns(), {
+            'a': ['1'], 1: ['2'], 2: ['3']})
+
+    def test_numeric(self):
+        columns = self.table.to_columns(numeric=True)
+        self.assertEqual(columns['age'], ['1', '2.5', 'c'])
+        x = columns['x']
+        self.assertNotIsInstance(x, list)
+        self.assertNotEqual(x[0], x[0])  # NaN
+        self.assertEqual(x[1], 3.0)
+        self.assertNotEqual(x[2], x[2])
+
 
 class Caption(TestCase):
 
@@ -461,6 +564,20 @@ class Cells(TestCase):
         self.assertEqual(len(Table(
             '{|class=wikitable\n|a=b|c\n|}').cells(span=False)), 1)
 
+    def test_repeated_calls_reuse_the_cell_spans(self):
+        ae = self.assertEqual
+        t = Table('{|\n|a||b\n|-\n|c||d\n|}')
+        cells = t.cells()
+        spans = t._type_to_spans[id(t._span)]
+        ae(spans, [[2, 5], [5, 8], [11, 14], [14, 17]])
+        t.cells(0, 1).value = 'B'
+        ae(spans, [[2, 5], [5, 8], [11, 14], [14, 17]])
+        t.insert(2, '\n|x||y\n|-')
+        new_cells = t.cells()
+        ae(spans, [[2, 5], [5, 8], [11, 14], [14, 17], [20, 23], [23, 26]])
+        self.assertIs(new_cells[1][0]._span, cells[0][0]._span)
+        ae(new_cells[1][1].value, 'B')
+
 
 if __name__ == '__main__':
     main()
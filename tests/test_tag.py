@@ -127,6 +127,12 @@ class TagTest(TestCase):
         c2 = t.parsed_contents
         ae(len(c2._type_to_spans['WikiLink']), 1)
 
+    def test_parsed_contents_after_edit(self):
+        t = Tag('<t>c</t>')
+        self.assertEqual(t.parsed_contents.string, 'c')
+        t.contents = 'cd'
+        self.assertEqual(t.parsed_contents.string, 'cd')
+
     def test_parsed_content_offset(self):
         self.assertEqual(
             parse('t<b>1</b>t').get_tags()[0].parsed_contents.string, '1')
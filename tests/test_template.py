@@ -1,9 +1,13 @@
 ﻿"""Test the ExternalLink class."""
 
 
+from random import Random
 from unittest import main, TestCase, expectedFailure
+from weakref import ref
 
-from wikitextparser import Template
+from wikitextparser import Template, normal_name, parse
+# noinspection PyProtectedMember
+from wikitextparser._template import _normal_name
 
 
 class TestTemplate(TestCase):
@@ -62,6 +66,21 @@ class TestTemplate(TestCase):
         ae('t', Template('{{ : t |a}}').normal_name())
         ae('A B', Template('{{A___B}}').normal_name())
 
+    def test_normal_name_function(self):
+        ae = self.assertEqual
+        ae('T 1', normal_name(
+            ' eN : tEmPlAtE : <!-- c --> t_1 # b ', code='en',
+            capitalize=True))
+        ae('u', normal_name('الگو:u', ['الگو']))
+        ae('U', normal_name(' u ', capitalize=True))
+        hits = _normal_name.cache_info().hits
+        first = Template('{{cached_' + 'name}}').normal_name()
+        second = normal_name('cached_' + 'name')
+        self.assertIs(first, second)
+        ae(_normal_name.cache_info().hits, hits + 1)
+        # Cached results are interned.
+        self.assertIs(normal_name('a  b'), normal_name('a b'))
+
     def test_keyword_and_positional_args(self):
         self.assertEqual(
             '1', Template("{{t|kw=a|1=|pa|kw2=a|pa2}}").arguments[2].name)
@@ -289,6 +308,76 @@ class SetArg(TestCase):
         t.set_arg(None, 'v')
         self.assertEqual('{{t|v}}', t.string)
 
+    def test_spacing_ties_go_to_the_earliest_argument(self):
+        t = Template('{{T|3={{z}}| a =x}}')
+        t.set_arg('b', ' y ')
+        self.assertEqual('{{T|3={{z}}| a =x|b= y}}', t.string)
+
+
+class SetArgs(TestCase):
+
+    def test_update_and_add_with_the_spacing_of_set_arg(self):
+        t = Template('{{t\n  | p1   = v1\n  | p22  = v2\n}}')
+        t.set_args({'p22': 'x', 'z': 'z', 'p1': 'y', 'zz': 'zz'})
+        self.assertEqual(
+            '{{t\n  | p1   = y\n  | p22  = x\n  | z    = z\n'
+            '  | zz   = zz\n}}', t.string)
+
+    def test_is_applied_in_one_edit(self):
+        t = Template('{{t|a=1|b=2}}')
+        version = t._lststr.version
+        t.set_args({'b': '3', 'a': '4', 'c': '5', '': '6'})
+        self.assertEqual('{{t|a=4|b=3|c=5|6}}', t.string)
+        self.assertEqual(t._lststr.version, version + 1)
+
+    def test_no_args_and_no_spacing(self):
+        ae = self.assertEqual
+        t = Template('{{t}}')
+        t.set_args({'a': 'b', 'c': 'd'})
+        ae('{{t|a=b|c=d}}', t.string)
+        t.set_args({'a': ' e ', 'f': 'g'}, preserve_spacing=False)
+        ae('{{t|a= e |c=d|f=g}}', t.string)
+        t.set_args({})
+        ae('{{t|a= e |c=d|f=g}}', t.string)
+
+    def test_new_args_are_spaced_like_the_previous_new_ones(self):
+        t = Template('{{T\n}}')
+        t.set_args({'a': '1', 'b': '2'})
+        self.assertEqual('{{T\n|a=1\n|b=2}}', t.string)
+
+    def test_special_characters(self):
+        t = Template('{{t|a=1}}')
+        t.set_args({'b': '2|c=3', 'c': '4', 'd=': '5'})
+        self.assertEqual('{{t|a=1|b=2|c=4|d==5}}', t.string)
+
+    def test_same_as_set_arg_calls(self):
+        r = Random(0)
+        choice = r.choice
+        spaces = ('', ' ', '  ', '\n', '\n ', '\t')
+        for _ in range(500):
+            text = '{{t' + choice(spaces)
+            for _ in range(r.randrange(6)):
+                if r.random() < .3:
+                    text += '|' + choice(spaces) + 'x' + choice(spaces)
+                else:
+                    text += (
+                        '|' + choice(spaces) + choice('abc123') +
+                        choice(spaces) + '=' + choice(spaces) +
+                        choice(('', 'v', '{{v}}')) + choice(spaces))
+            text += '}}'
+            mapping = {
+                choice(spaces) + choice(('', 'a', 'd', 'ef', '3', '4')) +
+                choice(spaces): choice(spaces) + choice(('', 'w', 'w w')) +
+                choice(spaces) for _ in range(r.randrange(1, 5))}
+            preserve_spacing = r.random() < .7
+            expected = Template(text)
+            for name, value in mapping.items():
+                expected.set_arg(
+                    name, value, preserve_spacing=preserve_spacing)
+            t = Template(text)
+            t.set_args(mapping, preserve_spacing=preserve_spacing)
+            self.assertEqual(expected.string, t.string, (text, mapping))
+
 
 class TestDelArg(TestCase):
 
@@ -298,5 +387,56 @@ class TestDelArg(TestCase):
         self.assertEqual('{{t| a | d }}', t.string)
 
 
+class ArgsIndex(TestCase):
+
+    def test_repeated_lookups_use_the_same_spans(self):
+        ae = self.assertEqual
+        t = Template('{{t| a = 1 |b=2| a =3|4}}')
+        a = t.get_arg('a')
+        ae(a.value, '3')
+        self.assertIs(t.get_arg(' a ')._span, a._span)
+        self.assertIs(t.get_arg('1')._span, t.arguments[-1]._span)
+        self.assertIsNone(t.get_arg('c'))
+        self.assertTrue(t.has_arg('b', ' 2 '))
+        self.assertFalse(t.has_arg('1', ' 4'))
+
+    def test_index_is_updated_after_edits(self):
+        ae = self.assertEqual
+        t = Template('{{t|a=1|b=2}}')
+        t.get_arg('a').name = 'c'
+        self.assertIsNone(t.get_arg('a'))
+        ae(t.get_arg('c').value, '1')
+        t.set_arg('a', '3')
+        ae(t.string, '{{t|c=1|b=2|a=3}}')
+        t.del_arg('b')
+        ae(t.string, '{{t|c=1|a=3}}')
+        self.assertFalse(t.has_arg('b'))
+
+    def test_index_does_not_keep_arguments_alive(self):
+        t = Template('{{t|a=1}}')
+        a = ref(t.get_arg('a'))
+        self.assertIsNone(a())
+
+    def test_edits_outside_the_template_keep_its_index(self):
+        ae = self.assertEqual
+        p = parse('{{t|a=1|b=2}}')
+        t = p.templates[0]
+        t.get_arg('b')
+        index = t._args_index_cache
+        p.insert(0, 'x')
+        ae(t.get_arg('a').value, '1')
+        self.assertIs(t._args_index_cache, index)
+        t.insert(2, 'x')
+        ae(t.get_arg('a').value, '1')
+        self.assertIsNot(t._args_index_cache, index)
+
+    def test_names_are_indexed_from_the_last_argument(self):
+        t = Template('{{t|a=1|b=2|3|c=4}}')
+        self.assertEqual(t.get_arg('b').value, '2')
+        self.assertEqual(
+            t._args_index_cache[6], {'c': [3], '1': [2], 'b': [1]})
+        self.assertEqual(t.get_arg('1').value, '3')
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,108 @@
+﻿"""Test the functionalities of _text_buffer.py."""
+
+
+from random import Random
+from unittest import main, TestCase
+
+# noinspection PyProtectedMember
+from wikitextparser._text_buffer import PieceTable, set_text_buffer
+from wikitextparser import WikiText
+
+
+class TestPieceTable(TestCase):
+
+    """Test the PieceTable class."""
+
+    def test_replace_and_slice(self):
+        ae = self.assertEqual
+        pt = PieceTable('abcdef')
+        pt.replace(2, 4, 'XYZ')
+        ae(pt.slice(0, 3), 'abX')
+        ae(pt.slice(1, 7), 'bXYZef')
+        ae(pt.slice(5, 5), '')
+        pt.replace(0, 7, '')
+        ae(pt.slice(0, 10), '')
+        ae(pt[0], '')
+
+    def test_getitem_joins_the_pieces(self):
+        a, b, c = 'a' * 300, 'b' * 300, 'c' * 300
+        pt = PieceTable(a + b + c)
+        pt.replace(300, 300, '-')
+        pt.replace(601, 601, '-')
+        self.assertEqual(len(pt._pieces), 5)
+        self.assertEqual(pt[0], a + '-' + b + '-' + c)
+        self.assertEqual(pt._pieces, [a + '-' + b + '-' + c])
+
+    def test_short_pieces_are_merged(self):
+        pt = PieceTable('abc')
+        for _ in range(10):
+            pt.replace(0, 0, 'x')
+        self.assertEqual(pt._pieces, ['xxxxxxxxxxabc'])
+        pt = PieceTable('a' * 300)
+        pt.replace(1, 1, 'x')
+        pt.replace(2, 2, 'x')
+        self.assertEqual(pt._pieces, ['axx', 'a' * 299])
+
+    def test_random_edits_match_str(self):
+        random = Random(0)
+        string = 'abcdefghij' * 100
+        pt = PieceTable(string)
+        for _ in range(300):
+            start = random.randint(0, len(string))
+            stop = random.randint(start, len(string))
+            value = 'x' * random.randint(0, 5)
+            string = string[:start] + value + string[stop:]
+            pt.replace(start, stop, value)
+            s = random.randint(0, len(string))
+            e = random.randint(s, len(string))
+            self.assertEqual(pt.slice(s, e), string[s:e])
+        self.assertEqual(pt[0], string)
+
+    def test_indices_out_of_the_string_are_sliced_like_str(self):
+        ae = self.assertEqual
+        pt = PieceTable('')
+        pt.replace(-1, -1, 'x')
+        ae(pt[0], 'x')
+        pt = PieceTable('abc')
+        pt.replace(1, 1, 'x')
+        pt.replace(2, 9, 'y')
+        ae(pt[0], 'axy')
+        pt.replace(-1, -1, 'z')
+        ae(pt[0], 'axzy')
+
+    def test_version_is_increased_on_edits(self):
+        ae = self.assertEqual
+        pt = PieceTable('abc')
+        ae(pt.version, 0)
+        pt.replace(1, 2, 'x')
+        ae(pt.version, 1)
+        pt[0]  # joining the pieces is not an edit
+        pt.slice(0, 2)
+        ae(pt.version, 1)
+        pt[0] = 'd'
+        ae(pt.version, 2)
+
+
+class SetTextBuffer(TestCase):
+
+    def test_string_buffer(self):
+        set_text_buffer('string')
+        try:
+            wt = WikiText('{{a|b}}')
+            self.assertIsInstance(wt._lststr, list)
+            argument = wt.templates[0].arguments[0]
+            argument.value = 'c'
+            self.assertEqual(wt._lststr.version, 1)
+            self.assertEqual(wt.string, '{{a|c}}')
+            self.assertEqual(argument.name, '1')
+            argument.value = 'd='
+            self.assertEqual(argument.name, 'd')
+        finally:
+            set_text_buffer('piece_table')
+
+    def test_unknown_buffer(self):
+        self.assertRaises(ValueError, set_text_buffer, 'rope')
+
+
+if __name__ == '__main__':
+    main()
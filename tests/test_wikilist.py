@@ -143,6 +143,30 @@ class WikiListTest(TestCase):
         wl.templates[0].name = 'ttt'
         self.assertEqual(wl.string, '*a {{ttt}}')
 
+    def test_sublists_are_looked_up_in_the_list_tree(self):
+        ae = self.assertEqual
+        parsed = parse('#a\n#*b\n#*#c\n;d\n:e\n##f\n')
+        ol, dl, ol2 = parsed.get_lists()
+        ae(dl.pattern, '[:;]')
+        ae(dl.items, ['d', 'e'])
+        ul, = ol.sublists()
+        ae(ul.string, '#*b\n#*#c\n')
+        ae(ul._list_node_cache[1], parsed._list_tree[0].children[0])
+        ae(ul.sublists()[0].string, '#*#c\n')
+        ae(ol2.level, 1)
+        ae(ol2.items, ['#f'])
+        ae(
+            [l.string for l in parsed.get_lists(r'\#\*\#')], ['#*#c\n'])
+
+    def test_list_tree_is_updated_after_edits(self):
+        ae = self.assertEqual
+        parsed = parse('*a\n**b\n')
+        ul = parsed.get_lists()[0]
+        ul.insert(3, '*#c\n')
+        ae(ul.string, '*a\n*#c\n**b\n')
+        ae([l.string for l in ul.sublists()], ['*#c\n', '**b\n'])
+        ae([l.string for l in parsed.get_lists()], ['*a\n*#c\n**b\n'])
+
 
 if __name__ == '__main__':
     main()
@@ -4,7 +4,7 @@ from unittest import expectedFailure, main, TestCase
 
 from wikitextparser import WikiText, parse, Template, ParserFunction
 # noinspection PyProtectedMember
-from wikitextparser._wikitext import WS
+from wikitextparser._wikitext import WS, _spans_shadow
 
 
 class TestWikiText(TestCase):
@@ -164,11 +164,19 @@ class ShrinkSpanUpdate(TestCase):
         self.assertEqual('|d=', arg.string)
 
     def test_rmstart_s_rmstop_e(self):
+        wt = WikiText('{{t| {{t2|<!--c-->}} }}')
+        c = wt.comments[0]
+        wt._shrink_update(3, 14)
+        self.assertEqual(c._span, [3, 7])
+
+    def test_removing_comment_start_closes_the_comment(self):
         wt = WikiText('{{t| {{t2|<!--c-->}} }}')
         c = wt.comments[0]
         t = wt.templates[0]
         t[3:14] = ''
-        self.assertEqual(c.string, 'c-->')
+        self.assertEqual(c.string, '')
+        self.assertEqual(wt.comments, [])
+        self.assertEqual(t.string, '{{tc-->}} }}')
 
     def test_shrink_more_than_one_subspan(self):
         ae = self.assertEqual
@@ -180,6 +188,31 @@ class ShrinkSpanUpdate(TestCase):
         ae(wls[1].string, '')
         ae(wls[2].string, '')
 
+    def test_deleting_the_whole_string_keeps_the_root(self):
+        ae = self.assertEqual
+        wt = WikiText('a{{b}}')
+        t = wt.templates[0]
+        del wt[0:6]
+        ae(t.string, '')
+        ae(wt._span, [0, 0])
+        wt.insert(0, 'x{{y}}')
+        ae(wt.string, 'x{{y}}')
+        ae(wt.templates[0].string, '{{y}}')
+        with wt.batch():
+            del wt[:]
+        ae(wt._span, [0, 0])
+        wt.insert(0, 'z')
+        ae(wt.string, 'z')
+
+    def test_setting_the_string_to_empty_and_then_to_new(self):
+        ae = self.assertEqual
+        wt = WikiText('{{a}}')
+        wt.string = ''
+        ae(wt.string, '')
+        wt.string = 'new {{b}}'
+        ae(wt.string, 'new {{b}}')
+        ae(wt.templates[0].string, '{{b}}')
+
 
 class CloseSubSpans(TestCase):
 
@@ -501,6 +534,27 @@ class Tables(TestCase):
         ae('{|class=wikitable\n|b\n|}', table1.string)
         ae(1, table1.nesting_level)
 
+    def test_colon_indented_nested_table(self):
+        ae = self.assertEqual
+        p = parse('{|\n|a\n:{|\n|b\n|}\n|}')
+        ae([t.string for t in p.tables], [p.string, '{|\n|b\n|}'])
+        ae([t.nesting_level for t in p.tables], [0, 1])
+        ae(len(p.get_tables()), 1)
+
+    def test_unclosed_table_does_not_nest(self):
+        p = parse('{|\n|a\n{|\n|b\n|}\ntext')
+        tables = p.get_tables()
+        self.assertEqual([t.string for t in tables], ['{|\n|b\n|}'])
+        self.assertEqual(tables[0].nesting_level, 0)
+
+    def test_nesting_level_after_edit(self):
+        p = parse('{|\n|a\n|}')
+        table = p.tables[0]
+        p.insert(0, '{|\n|\n')
+        p.insert(len(p.string), '\n|}')
+        self.assertEqual(p.tables[1].nesting_level, 1)
+        self.assertEqual(table.nesting_level, 1)
+
     def test_tables_in_different_sections(self):
         s = '{|\n| a\n|}\n\n= s =\n{|\n| b\n|}\n'
         p = parse(s).sections[1]
@@ -1147,6 +1201,34 @@ class GetSection(TestCase):
         ae(h1.string, '= h1 =\n')
         ae(h.string, '= h =\nend')
 
+    def test_section_tree_is_cached_until_an_edit(self):
+        ae = self.assertEqual
+        wt = parse('== a ==\n=== b ===\n')
+        lead, a, b = tree = wt._section_tree
+        self.assertIs(wt._section_tree, tree)
+        self.assertIs(b.parent, a)
+        ae(a.children, [b])
+        ae(a.subsections_end, 18)
+        ae(a.end, 8)
+        wt.insert(8, '== c ==\n')
+        ae([s.string for s in wt.get_sections()], [
+            '', '== a ==\n', '== c ==\n=== b ===\n', '=== b ===\n'])
+
+
+class Toc(TestCase):
+
+    def test_toc(self):
+        ae = self.assertEqual
+        wt = parse('lead\n= a =\n== b ==\n=== c ===\n== d ==\n=e=\nend')
+        ae(wt.toc(), [
+            (1, ' a '), (2, ' b '), (3, ' c '), (2, ' d '), (1, 'e')])
+        ae(parse('no heading').toc(), [])
+
+    def test_toc_of_a_section(self):
+        section = parse('= a =\n== b <!-- c --> ==\n').sections[1]
+        self.assertEqual(
+            section.toc(), [(1, ' a '), (2, ' b <!-- c --> ')])
+
 
 class WikiList(TestCase):
 
@@ -1252,6 +1334,25 @@ class Tags(TestCase):
         self.assertEqual(
             WikiText('<s></s><s></s>').get_tags()[0]._span, [0, 7])
 
+    def test_end_tag_in_the_attrs_of_its_start_tag(self):
+        b, = parse('<b title="</b>">x</b>').get_tags()
+        self.assertEqual(b.string, '<b title="</b>">x</b>')
+
+    def test_end_tag_inside_another_end_tag(self):
+        # The unnamed result used to differ from get_tags('b').
+        parsed = parse('<i><b></i </b>>')
+        ae = self.assertEqual
+        ae([t.string for t in parsed.get_tags()], [
+            '<i><b></i </b>', '<b></i </b>'])
+        ae(parsed.get_tags('b')[0].string, '<b></i </b>')
+
+    def test_unclosed_and_self_closing_tags_in_nested_tags(self):
+        ae = self.assertEqual
+        parsed = parse('<s><b><i><br/>a</b><b>b</s>')
+        ae([t.string for t in parsed.get_tags()], [
+            '<s><b><i><br/>a</b><b>b</s>', '<b><i><br/>a</b>', '<i>',
+            '<br/>', '<b>'])
+
 
 class Ancestors(TestCase):
 
@@ -1276,5 +1377,176 @@ class Ancestors(TestCase):
         self.assertEqual(b.ancestors(), [])
 
 
+class Shadow(TestCase):
+
+    """Test that shadows built from spans match the parsed shadows."""
+
+    def test_nested_spans(self):
+        ae = self.assertEqual
+        wt = WikiText(
+            '{{a|b=<!--c-->{{d|[[e|f]]}}|{{{g|<nowiki>}}</nowiki>}}}'
+            '<span a="|">h</span>}}')
+        template = wt.templates[0]
+        ae(template._shadow, bytearray(
+            b'{{a|b=        XXXXXXXXXXXXX|PPPgP___________________PPP'
+            b'<span a=" ">h</span>}}'))
+        ae(template._shadow, _spans_shadow(
+            template.string, 'Template', template._span, wt._type_to_spans))
+
+    def test_node_inside_an_extension_tag(self):
+        # The nowiki tag inside ref has no span, parsing is needed.
+        template = WikiText('<ref>{{a|<nowiki>b</nowiki>}}</ref>').templates[0]
+        self.assertIsNone(_spans_shadow(
+            template.string, 'Template', template._span,
+            template._type_to_spans))
+        self.assertEqual(
+            template._shadow, bytearray(b'{{a|__________________}}'))
+
+
+class LazyParsing(TestCase):
+
+    """Test the lazy parameter of WikiText."""
+
+    def test_only_required_stages_are_run(self):
+        ae = self.assertEqual
+        wt = WikiText('<!--c--><ref>{{a}}</ref>[[b]]', lazy=True)
+        type_to_spans = wt._type_to_spans
+        ae(wt.comments[0].string, '<!--c-->')
+        ae(type_to_spans._stage, 1)
+        ae(wt.get_tags()[0].string, '<ref>{{a}}</ref>')
+        ae(type_to_spans._stage, 2)
+        ae(wt.wikilinks[0].string, '[[b]]')
+        ae(wt.templates[0].string, '{{a}}')
+
+    def test_same_spans_as_eager_parsing(self):
+        string = '{{a|<!--{{b}}-->[[c|{{{d}}}]]}}<poem>{{#e:}}</poem>'
+        self.assertEqual(
+            dict(WikiText(string, lazy=True)._type_to_spans.items()),
+            dict(WikiText(string)._type_to_spans.items()))
+
+    def test_edit_before_parsing(self):
+        wt = WikiText('{{a}}[[b]]', lazy=True)
+        wt.insert(0, '{{c}}')
+        self.assertEqual(
+            [t.string for t in wt.templates], ['{{c}}', '{{a}}'])
+        self.assertEqual(wt.wikilinks[0].string, '[[b]]')
+
+
+class Reparse(TestCase):
+
+    """Test that the spans around an edit are updated."""
+
+    def test_inserting_closing_braces_splits_a_template(self):
+        ae = self.assertEqual
+        wt = WikiText('{{a|b {{c}} d}}')
+        wt.insert(6, '}}')
+        ae([t.string for t in wt.templates], ['{{a|b }}', '{{c}}'])
+
+    def test_inserting_opening_brackets_merges_a_wikilink(self):
+        wt = WikiText('a b]] {{c}}')
+        wt.insert(0, '[[')
+        self.assertEqual(wt.wikilinks[0].string, '[[a b]]')
+        self.assertEqual(wt.templates[0].string, '{{c}}')
+
+    def test_edit_inside_an_argument_keeps_the_outer_nodes(self):
+        ae = self.assertEqual
+        wt = WikiText('x {{a|{{b}}|[[c]]}} y')
+        a = wt.templates[0]
+        c = wt.wikilinks[0]
+        a.arguments[0].value = '{{d}}'
+        self.assertIs(wt.templates[0]._span, a._span)
+        self.assertIs(wt.wikilinks[0]._span, c._span)
+        ae(a.string, '{{a|{{d}}|[[c]]}}')
+        ae([t.string for t in wt.templates], ['{{a|{{d}}|[[c]]}}', '{{d}}'])
+
+    def test_deleting_a_comment_start(self):
+        wt = WikiText('<!--{{a}}-->{{b}}')
+        del wt[:4]
+        self.assertEqual(
+            [t.string for t in wt.templates], ['{{a}}', '{{b}}'])
+        self.assertEqual(wt.comments, [])
+
+    def test_replacing_a_template_with_a_wikilink(self):
+        ae = self.assertEqual
+        wt = WikiText('x {{a}}')
+        t = wt.templates[0]
+        t.string = '[[b]]'
+        ae(wt.templates, [])
+        ae(wt.wikilinks[0].string, '[[b]]')
+        ae(t.string, '')
+
+    def test_deleting_a_closing_brace_of_a_template(self):
+        wt = WikiText('{{a|b}} {{c}}')
+        t = wt.templates[0]
+        del t[6]
+        self.assertEqual(wt.string, '{{a|b} {{c}}')
+        self.assertEqual([t.string for t in wt.templates], ['{{c}}'])
+        self.assertEqual(t.string, '')
+
+    def test_closing_a_comment_from_inside(self):
+        ae = self.assertEqual
+        wt = WikiText('a <!--b--> {{c}}')
+        c = wt.comments[0]
+        c[4:6] = '-->{{c'
+        ae(wt.string, 'a <!---->{{c-> {{c}}')
+        ae([c.string for c in wt.comments], ['<!---->'])
+        ae([t.string for t in wt.templates], ['{{c}}'])
+
+    def test_a_node_with_intact_delimiters_is_kept(self):
+        wt = WikiText('[[a|b]]')
+        wl = wt.wikilinks[0]
+        del wl.title
+        self.assertEqual(wl.string, '[[|b]]')
+        self.assertEqual(wt.wikilinks[0]._span, wl._span)
+
+
+class Batch(TestCase):
+
+    """Test the WikiText.batch method."""
+
+    def test_edits_are_applied_at_exit(self):
+        ae = self.assertEqual
+        wt = WikiText('{{a|b}} [[c]] {{d}}')
+        a, d = wt.templates
+        c = wt.wikilinks[0]
+        with wt.batch():
+            a.name = 'aa'
+            d.insert(2, 'x')
+            wt.insert(0, '{{e}}')
+            ae(wt.string, '{{a|b}} [[c]] {{d}}')
+        ae(wt.string, '{{e}}{{aa|b}} [[c]] {{xd}}')
+        ae(a.string, '{{aa|b}}')
+        ae(c.string, '[[c]]')
+        ae(d.string, '{{xd}}')
+        ae([t.string for t in wt.templates], ['{{e}}', '{{aa|b}}', '{{xd}}'])
+
+    def test_deletions(self):
+        wt = WikiText('{{t|a=1|b=2|a=3}}')
+        t = wt.templates[0]
+        with wt.batch():
+            for arg in t.arguments[:2]:
+                del arg[:]
+        self.assertEqual(t.string, '{{t|a=3}}')
+        self.assertEqual(t.arguments[0].value, '3')
+
+    def test_overlapping_edits(self):
+        wt = WikiText('abcd')
+        with self.assertRaises(ValueError):
+            with wt.batch():
+                wt[0:2] = 'x'
+                wt[1:3] = 'y'
+        self.assertEqual(wt.string, 'abcd')
+
+    def test_exception_discards_the_edits(self):
+        wt = WikiText('abcd')
+        with self.assertRaises(KeyError):
+            with wt.batch():
+                wt[0:2] = 'x'
+                raise KeyError
+        self.assertEqual(wt.string, 'abcd')
+        wt[0:2] = 'x'
+        self.assertEqual(wt.string, 'xcd')
+
+
 if __name__ == '__main__':
     main()
@@ -8,12 +8,14 @@ from ._wikilink import WikiLink
 from ._section import Section
 from ._comment import Comment
 from . import _wikitext
-from ._table import Table
-from ._template import Template
+from ._table import Table, set_table_span_limits
+from ._template import Template, normal_name
 from ._parser_function import ParserFunction
 from ._tag import Tag
 from ._wikilist import WikiList
-from ._wikilist import LIST_PATTERN_FORMAT as _LIST_PATTERN_FORMAT
+from ._spans import set_span_engine
+from ._text_buffer import set_text_buffer
+from ._patterns import pattern_cache_info, set_pattern_cache_size
 
 
 _wikitext.ExternalLink = ExternalLink
@@ -25,7 +27,6 @@ _wikitext.Parameter = Parameter
 _wikitext.Table = Table
 _wikitext.Section = Section
 _wikitext.WikiList = WikiList
-_wikitext.LIST_PATTERN_FORMAT = _LIST_PATTERN_FORMAT
 _wikitext.Tag = _wikitext.ExtensionTag = Tag
 
 WikiText = _wikitext.WikiText
@@ -21,15 +21,18 @@ class Argument(SubWikiText):
     See https://www.mediawiki.org/wiki/Help:Templates for more information.
     """
 
+    # (version, position) of a positional argument, set by `arguments`
+    _position_cache = None, None
+
     @property
     def _shadow_match(self):
-        cached_shadow_match, cache_string = getattr(
+        cached_shadow_match, cache_version = getattr(
             self, '_shadow_match_cache', (None, None))
-        self_string = str(self)
-        if cache_string == self_string:
+        version = self._lststr.version
+        if cache_version == version:
             return cached_shadow_match
         shadow_match = ARG_SHADOW_FULLMATCH(self._shadow)
-        self._shadow_match_cache = shadow_match, self_string
+        self._shadow_match_cache = shadow_match, version
         return shadow_match
 
     @property
@@ -39,37 +42,40 @@ class Argument(SubWikiText):
         getter: return the position as a string, for positional arguments.
         setter: convert it to keyword argument if positional.
         """
-        lststr0 = self._lststr[0]
+        lststr = self._lststr
         ss = self._span[0]
         shadow_match = self._shadow_match
         if shadow_match['eq']:
             s, e = shadow_match.span('pre_eq')
-            return lststr0[ss + s:ss + e]
+            return lststr.slice(ss + s, ss + e)
         # positional argument
+        cached_version, position = self._position_cache
+        if cached_version == lststr.version:
+            return str(position)
         position = 1
-        # Todo: if we had the index of self._span, we could only look-up
-        # the head of the self._type_to_spans.
         for s, e in self._type_to_spans[self._type]:
             if ss <= s:
                 break
-            arg_str = lststr0[s:e]
+            arg_str = lststr.slice(s, e)
             if '=' in arg_str:
                 # The argument may is still be positional if the equal sign is
-                # inside an atomic sub-spans.
+                # inside an atomic sub-spans or a section heading.
                 byte_array = bytearray(arg_str, 'ascii', 'replace')
                 parse_to_spans(byte_array)  # Remove sub-spans from byte_array
-                if b'=' in byte_array:
+                if ARG_SHADOW_FULLMATCH(byte_array)['eq']:
                     # This is a keyword argument.
                     continue
             # This is a preceding positional argument.
             position += 1
+        self._position_cache = lststr.version, position
         return str(position)
 
     @name.setter
     def name(self, newname: str) -> None:
         oldname = self.name
         if self._shadow_match['eq']:
-            self[1:1 + len(oldname)] = newname
+            if not self._set_plain_text(1, 1 + len(oldname), newname):
+                self[1:1 + len(oldname)] = newname
         else:
             self[0:1] = '|' + newname + '='
 
@@ -120,10 +126,17 @@ class Argument(SubWikiText):
     @value.setter
     def value(self, newvalue: str) -> None:
         shadow_match = self._shadow_match
-        if shadow_match['eq']:
-            self[shadow_match.start('post_eq'):] = newvalue
-        else:
-            self[1:] = newvalue
+        start = shadow_match.start('post_eq') if shadow_match['eq'] else 1
+        ss, se = self._span
+        lststr = self._lststr
+        cached_version, position = self._position_cache
+        # The value is between `=`, `|`, or `:` and the end of self.
+        if self._set_plain_text(start, se - ss, newvalue):
+            if cached_version == lststr.version - 1:
+                # A plain value does not change the position.
+                self._position_cache = lststr.version, position
+            return
+        self[start:] = newvalue
 
     @property
     def _lists_shadow_ss(self):
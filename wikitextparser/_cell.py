@@ -156,13 +156,13 @@ class Cell(SubWikiTextWithAttrs):
         super().__init__(string, _type_to_spans, _span, _type)
         self._header = header
         if _match:
-            string = self.string
-            self._match_cache = _match, string
+            version = self._lststr.version
+            self._match_cache = _match, version
             if _attrs_match:
-                self._attrs_match_cache = _attrs_match, string
+                self._attrs_match_cache = _attrs_match, version
             else:
                 self._attrs_match_cache = \
-                    ATTRS_MATCH(_match['attrs']), string
+                    ATTRS_MATCH(_match['attrs']), version
         else:
             self._attrs_match_cache = self._match_cache = None, None
 
@@ -174,9 +174,9 @@ class Cell(SubWikiTextWithAttrs):
         may be something other than zero if the match is cached from the
         parent object (the initial value).
         """
-        cache_match, cache_string = self._match_cache
-        string = self.string
-        if cache_string == string:
+        cache_match, cache_version = self._match_cache
+        version = self._lststr.version
+        if cache_version == version:
             return cache_match
         shadow = self._shadow
         if shadow[0] == 10:  # ord('\n')
@@ -186,7 +186,7 @@ class Cell(SubWikiTextWithAttrs):
             m = INLINE_HAEDER_CELL_MATCH(shadow)
         else:
             m = INLINE_NONHAEDER_CELL_MATCH(shadow)
-        self._match_cache = m, string
+        self._match_cache = m, version
         self._attrs_match_cache = None, None
         return m
 
@@ -212,13 +212,13 @@ class Cell(SubWikiTextWithAttrs):
     @property
     def _attrs_match(self):
         """Return the match object for attributes."""
-        cache, cache_string = self._attrs_match_cache
-        string = self.string
-        if cache_string == string:
+        cache, cache_version = self._attrs_match_cache
+        version = self._lststr.version
+        if cache_version == version:
             return cache
         s, e = self._match.span('attrs')
         attrs_match = ATTRS_MATCH(self._shadow, s, e)
-        self._attrs_match_cache = attrs_match, string
+        self._attrs_match_cache = attrs_match, version
         return attrs_match
 
     def set_attr(self, attr_name: str, attr_value: str) -> None:
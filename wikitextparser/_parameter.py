@@ -27,9 +27,12 @@ class Parameter(SubWikiText):
     def name(self, newname: str) -> None:
         pipe = self._shadow.find(124)
         if pipe == -1:
-            self[3:-3] = newname
+            ss, se = self._span
+            if not self._set_plain_text(3, se - ss - 3, newname):
+                self[3:-3] = newname
             return
-        self[3:pipe] = newname
+        if not self._set_plain_text(3, pipe, newname):
+            self[3:pipe] = newname
 
     @property
     def pipe(self) -> str:
@@ -63,7 +66,9 @@ class Parameter(SubWikiText):
         if pipe == -1:
             self.insert(-3, '|' + newdefault)
             return
-        self[pipe + 1:-3] = newdefault
+        ss, se = self._span
+        if not self._set_plain_text(pipe + 1, se - ss - 3, newdefault):
+            self[pipe + 1:-3] = newdefault
 
     @default.deleter
     def default(self) -> None:
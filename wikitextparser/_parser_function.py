@@ -1,11 +1,11 @@
 """Define the ParserFunction class."""
 from bisect import insort, bisect_right
-from typing import List
+from typing import Iterable, List, Tuple
 
 import regex
 
 from ._wikitext import SubWikiText
-from ._argument import Argument
+from ._argument import Argument, ARG_SHADOW_FULLMATCH
 from ._wikilist import WikiList
 
 
@@ -38,15 +38,27 @@ class SubWikiTextWithArgs(SubWikiText):
         split_spans = self._name_args_matcher(shadow, 2, -2).spans('arg')
         if not split_spans:
             return []
-        arguments = []
-        arguments_append = arguments.append
-        type_to_spans = self._type_to_spans
-        ss, se = span = self._span
-        type_ = id(span)
-        lststr = self._lststr
-        string = lststr[0]
-        arg_spans = type_to_spans.setdefault(type_, [])
+        matches, positions = _arg_matches_and_positions(shadow, split_spans)
+        arguments = self._new_arguments(
+            shadow, split_spans, self._add_arg_spans(split_spans), matches,
+            positions, range(len(split_spans)))
+        # Let the fast setters of the arguments keep this shadow up to date.
+        self._type_to_spans._shadow_memo = (
+            self._span, self._lststr.version, shadow)
+        return arguments
+
+    def _add_arg_spans(
+        self, split_spans: List[Tuple[int, int]]
+    ) -> List[List[int]]:
+        """Return the spans of the arguments, add them to type_to_spans.
+
+        The positions of positional arguments are recomputed from these spans
+        after edits, therefore all of them are added.
+        """
+        ss = self._span[0]
+        arg_spans = self._type_to_spans.setdefault(id(self._span), [])
         span_tuple_to_span_get = {(s[0], s[1]): s for s in arg_spans}.get
+        spans = []
         for arg_self_start, arg_self_end in split_spans:
             s, e = arg_span = [ss + arg_self_start, ss + arg_self_end]
             old_span = span_tuple_to_span_get((s, e))
@@ -54,10 +66,38 @@ class SubWikiTextWithArgs(SubWikiText):
                 insort(arg_spans, arg_span)
             else:
                 arg_span = old_span
-            arg = Argument(lststr, type_to_spans, arg_span, type_)
-            arg._shadow_cache = (
-                string[s:e], shadow[arg_self_start:arg_self_end])
+            spans.append(arg_span)
+        return spans
+
+    def _new_arguments(
+        self, shadow: bytearray, split_spans: List[Tuple[int, int]],
+        spans: List[List[int]], matches: list, positions: List[int],
+        indices: Iterable[int],
+    ) -> List[Argument]:
+        """Return the arguments at the given indices of split_spans.
+
+        spans are the result of _add_arg_spans. See
+        _arg_matches_and_positions for matches and positions.
+        """
+        type_to_spans = self._type_to_spans
+        span = self._span
+        type_ = id(span)
+        lststr = self._lststr
+        version = lststr.version
+        arguments = []
+        arguments_append = arguments.append
+        for i in indices:
+            arg = Argument(lststr, type_to_spans, spans[i], type_)
+            arg_self_start, arg_self_end = split_spans[i]
+            arg._shadow_cache = version, shadow[arg_self_start:arg_self_end]
+            shadow_match = matches[i]
+            if shadow_match is not None:
+                arg._shadow_match_cache = shadow_match, version
+            position = positions[i]
+            if position:
+                arg._position_cache = version, position
             arguments_append(arg)
+        type_to_spans.hold_child_spans(type_, span, arguments)
         return arguments
 
     def get_lists(self, pattern: str = None) -> List[WikiList]:
@@ -87,6 +127,32 @@ class SubWikiTextWithArgs(SubWikiText):
         self[2:2 + len(self.name)] = newname
 
 
+def _arg_matches_and_positions(
+    shadow: bytearray, split_spans: List[Tuple[int, int]]
+) -> Tuple[list, List[int]]:
+    """Return the shadow matches and the positions of the arguments.
+
+    The shadow match is None for the arguments that have no `=` in their
+    shadow. The position of keyword arguments is 0.
+    """
+    matches = []
+    positions = []
+    position = 1
+    for s, e in split_spans:
+        arg_shadow = shadow[s:e]
+        if b'=' in arg_shadow:
+            shadow_match = ARG_SHADOW_FULLMATCH(arg_shadow)
+            matches.append(shadow_match)
+            if shadow_match['eq']:
+                positions.append(0)
+                continue
+        else:
+            matches.append(None)
+        positions.append(position)
+        position += 1
+    return matches, positions
+
+
 class ParserFunction(SubWikiTextWithArgs):
 
     """Create a new ParserFunction object."""
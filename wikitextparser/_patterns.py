@@ -0,0 +1,73 @@
+"""Define a registry for the patterns that are compiled at runtime.
+
+Patterns that depend on an argument, e.g. the name in ``get_tags(name)`` or
+the pattern of a list, are compiled once and kept in a bounded LRU registry
+instead of relying on the small internal cache of the regex module.
+"""
+
+from collections import namedtuple, OrderedDict
+from typing import Any, Dict, Tuple
+
+from regex import compile as regex_compile
+
+
+PatternCacheInfo = namedtuple(
+    'PatternCacheInfo', 'hits misses maxsize currsize')
+
+# kind -> (format, flags); `{pattern}` in format is replaced by the pattern
+_kinds = {}  # type: Dict[str, Tuple[bytes, int]]
+_compiled = OrderedDict()  # type: Dict[Tuple[str, bytes], Any]
+_maxsize = 256
+_hits = 0
+_misses = 0
+
+
+def add_pattern_kind(kind: str, format_: bytes, flags: int = 0) -> None:
+    """Register a kind of patterns that can be passed to compiled_pattern.
+
+    `{pattern}` in format_ will be replaced by the pattern.
+    """
+    _kinds[kind] = format_, flags
+
+
+def compiled_pattern(kind: str, pattern: bytes) -> Any:
+    """Return the compiled pattern of the given kind.
+
+    Use the registry if the (kind, pattern) pair has been compiled before.
+    """
+    global _hits, _misses
+    key = kind, pattern
+    try:
+        compiled = _compiled[key]
+    except KeyError:
+        _misses += 1
+        format_, flags = _kinds[kind]
+        compiled = _compiled[key] = regex_compile(
+            format_.replace(b'{pattern}', pattern), flags)
+        if len(_compiled) > _maxsize:
+            _compiled.popitem(last=False)
+        return compiled
+    _hits += 1
+    _compiled.move_to_end(key)
+    return compiled
+
+
+def pattern_cache_info() -> PatternCacheInfo:
+    """Return the hits, misses, maxsize, and current size of the registry.
+
+    A hit is a call to compiled_pattern that did not need to compile.
+    """
+    return PatternCacheInfo(_hits, _misses, _maxsize, len(_compiled))
+
+
+def set_pattern_cache_size(maxsize: int = 256) -> None:
+    """Set the maximum number of compiled patterns that are kept.
+
+    The least recently used patterns are dropped if there are more.
+    """
+    global _maxsize
+    if maxsize < 1:
+        raise ValueError('maxsize should be positive')
+    _maxsize = maxsize
+    while len(_compiled) > maxsize:
+        _compiled.popitem(last=False)
@@ -17,12 +17,12 @@ class Section(SubWikiText):
 
     @property
     def _header_match(self):
-        cached_match, cached_shadow = self._header_match_cache
-        shadow = self._shadow
-        if cached_shadow == shadow:
+        cached_match, cached_version = self._header_match_cache
+        version = self._lststr.version
+        if cached_version == version:
             return cached_match
-        m = HEADER_MATCH(shadow)
-        self._header_match_cache = m, shadow
+        m = HEADER_MATCH(self._shadow)
+        self._header_match_cache = m, version
         return m
 
     @property
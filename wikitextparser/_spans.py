@@ -1,6 +1,11 @@
 ﻿"""Define the functions required for parsing wikitext into spans."""
+from array import array
+from bisect import bisect_left, bisect_right
 from functools import partial
-from typing import Dict, List, Callable, Optional
+from itertools import chain
+from typing import (
+    Callable, Dict, Iterable, Iterator, List, Optional, Tuple)
+from weakref import ref
 
 from regex import VERBOSE, IGNORECASE
 from regex import compile as regex_compile
@@ -18,9 +23,11 @@ VALID_TITLE_CHARS_PATTERN = rb'[^\x00-\x1f\|\{\}\[\]<>\n]++'
 # According to https://www.mediawiki.org/wiki/Help:Magic_words
 # See also:
 # https://translatewiki.net/wiki/MediaWiki:Sp-translate-data-MagicWords/fa
-PARAMS_FINDITER = regex_compile(
-    rb'\{\{\{(?>[^{}]*+|}(?!})|{(?!{))*+\}\}\}').finditer
-PF_TL_FINDITER = regex_compile(
+PARAMS = regex_compile(
+    rb'\{\{\{(?>[^{}]*+|}(?!})|{(?!{))*+\}\}\}')
+PARAMS_FINDITER = PARAMS.finditer
+PARAMS_MATCH = PARAMS.match
+PF_TL = regex_compile(
     rb'\{\{'
     rb'(?>'
     # parser function
@@ -40,7 +47,9 @@ PF_TL_FINDITER = regex_compile(
     rb'\s*+'
     rb'(?:\|(?>[^{}]++|{(?!{)|}(?!}))*+)?+'  # args
     rb'\}\}'
-    rb')').finditer
+    rb')')
+PF_TL_FINDITER = PF_TL.finditer
+PF_TL_MATCH = PF_TL.match
 # External links
 INVALID_EXTLINK_CHARS = rb' \t\n<>\[\]"'
 VALID_EXTLINK_CHARS = rb'[^' + INVALID_EXTLINK_CHARS + rb']++'
@@ -59,7 +68,7 @@ BARE_EXTERNAL_LINK = (
     BARE_EXTERNAL_LINK_SCHEMES + EXTERNAL_LINK_URL_TAIL)
 # Wikilinks
 # https://www.mediawiki.org/wiki/Help:Links#Internal_links
-WIKILINK_FINDITER = regex_compile(
+WIKILINK = regex_compile(
     rb'''
     (?<!\[)\[\[
     (?!\ *+''' + BARE_EXTERNAL_LINK + rb')'
@@ -80,7 +89,9 @@ WIKILINK_FINDITER = regex_compile(
         \]\]
     )
     ''',
-    IGNORECASE | VERBOSE).finditer
+    IGNORECASE | VERBOSE)
+WIKILINK_FINDITER = WIKILINK.finditer
+WIKILINK_MATCH = WIKILINK.match
 
 # these characters iterfere with detection of (args|tls|wlinks|wlists)
 blank_sensitive_chars = partial(regex_compile(br'[\|\{\}\n]').sub, br' ')
@@ -119,6 +130,66 @@ EXTENSION_TAGS_FINDITER = regex_compile(
 COMMENT_PATTERN = r'<!--[\s\S]*?-->'
 COMMENT_FINDITER = regex_compile(COMMENT_PATTERN.encode()).finditer
 
+# Edits that do not touch any of these delimiters can not merge or split the
+# spans found by parse_to_spans. See WikiText._reparse.
+DELIMITER_CHARS_SEARCH = regex_compile(r'[{}\[\]<>]').search
+COMMENT_DELIMITERS_FINDITER = regex_compile(r'<!--|-->').finditer
+TAG_NAME_END_SEARCH = regex_compile(r'</?\w*+\Z').search
+TAG_EXTENSIONS_PATTERN = regex_pattern(
+    _parsable_tag_extensions | _unparsable_tag_extensions).encode()
+OPENERS_FINDITER = regex_compile(
+    rb'\{\{++|\[\[++|<!--|<(?:' + TAG_EXTENSIONS_PATTERN + rb')\b',
+    IGNORECASE).finditer
+CLOSERS_FINDITER = regex_compile(
+    rb'\}\}++|\]\]++|-->|</(?:' + TAG_EXTENSIONS_PATTERN + rb')\s*+>',
+    IGNORECASE).finditer
+
+
+def find_loose_delimiters(
+    byte_array: bytearray, type_to_spans: Dict[str, List[List[int]]]
+) -> List[List[List[int]]]:
+    """Return the [openers, closers] that are not part of any span.
+
+    byte_array is the unmasked string that type_to_spans was found in. The
+    delimiters that are inside other spans are included, e.g. the `[[` in
+    `{{a|[[b}}`, but not the ones inside comments and extension tags.
+    """
+    byte_array = bytearray(byte_array)
+    for s, e in type_to_spans['Comment']:
+        byte_array[s:e] = b' ' * (e - s)
+    for s, e in type_to_spans['ExtensionTag']:
+        byte_array[s:e] = b'_' * (e - s)
+    opener_lengths = {}  # type: Dict[int, int]
+    closer_lengths = {}  # type: Dict[int, int]
+    for type_, length in (
+        ('Parameter', 3), ('ParserFunction', 2), ('Template', 2),
+        ('WikiLink', 2),
+    ):
+        for s, e in type_to_spans[type_]:
+            opener_lengths[s] = length
+            closer_lengths[e] = length
+    openers = []  # type: List[List[int]]
+    for match in OPENERS_FINDITER(byte_array):
+        ms, me = match.span()
+        p = ms
+        while p < me and p in opener_lengths:
+            p += opener_lengths[p]
+        if p != me:
+            openers.append([ms, me])
+    closers = []  # type: List[List[int]]
+    for match in CLOSERS_FINDITER(byte_array):
+        ms, me = match.span()
+        p = me
+        while p > ms and p in closer_lengths:
+            p -= closer_lengths[p]
+        if p != ms:
+            closers.append([ms, me])
+    return [openers, closers]
+
+
+UNPARSABLE_TAG_MATCH = regex_compile(
+    rb'<' + UNPARSABLE_TAG_EXTENSIONS_PATTERN + rb'\b', IGNORECASE).match
+
 # HTML tags
 # Tags:
 # https://infra.spec.whatwg.org/#ascii-whitespace
@@ -191,10 +262,78 @@ def parse_to_spans(byte_array: bytearray) -> Dict[str, List[List[int]]]:
         'WikiLink': wikilink_spans,
     }
     """
+    return {
+        type_: sorted(spans)
+        for type_, spans in _find_spans(byte_array).items()}
+
+
+def parse_to_packed_spans(byte_array: bytearray) -> Dict[str, array]:
+    """Return the result of parse_to_spans with each type packed."""
+    return {
+        type_: pack_spans(spans)
+        for type_, spans in _find_spans(byte_array).items()}
+
+
+def parse_to_packed_spans_and_loose(
+    byte_array: bytearray
+) -> Tuple[Dict[str, array], List[List[List[int]]]]:
+    """Return parse_to_packed_spans(byte_array) and its loose delimiters.
+
+    See find_loose_delimiters.
+    """
+    string = bytes(byte_array)
+    type_to_spans = _find_spans(byte_array)
+    return {
+        type_: pack_spans(spans) for type_, spans in type_to_spans.items()
+    }, find_loose_delimiters(string, type_to_spans)
+
+
+def _find_spans(byte_array: bytearray) -> Dict[str, List[List[int]]]:
+    """Return the unsorted spans of parse_to_spans."""
+    type_to_spans = {}  # type: Dict[str, List[List[int]]]
+    parsable_tags = []  # type: List[Tuple[int, int, bytearray]]
+    for _, stage in SPAN_STAGES:
+        type_to_spans.update(stage(byte_array, parsable_tags))
+    return type_to_spans
+
+
+def _comment_stage(
+    byte_array: bytearray, parsable_tags: list
+) -> Dict[str, List[List[int]]]:
+    """Find HTML <!-- comments --> and replace them with spaces."""
     comment_spans = []  # type: List[List[int]]
     cms_append = comment_spans.append
+    for match in COMMENT_FINDITER(byte_array):
+        ms, me = match.span()
+        cms_append([ms, me])
+        byte_array[ms:me] = b' ' * (me - ms)
+    return {'Comment': comment_spans}
+
+
+def _extension_tag_stage(
+    byte_array: bytearray, parsable_tags: list
+) -> Dict[str, List[List[int]]]:
+    """Find <extension tags> and replace them with underscores.
+
+    The original contents of parsable tags are kept in parsable_tags for
+    _pm_pf_tl_stage.
+    """
     extension_tag_spans = []  # type: List[List[int]]
     ets_append = extension_tag_spans.append
+    parsable_tags_append = parsable_tags.append
+    for match in EXTENSION_TAGS_FINDITER(byte_array):
+        ms, me = match.span()
+        ets_append([ms, me])
+        if match[2]:  # parsable tag extension group
+            parsable_tags_append((ms, me, byte_array[ms:me]))
+        byte_array[ms:me] = b'_' * (me - ms)
+    return {'ExtensionTag': extension_tag_spans}
+
+
+def _pm_pf_tl_stage(
+    byte_array: bytearray, parsable_tags: list
+) -> Dict[str, List[List[int]]]:
+    """Find parameters, parser functions, templates, and wikilinks."""
     wikilink_spans = []  # type: List[List[int]]
     wls_append = wikilink_spans.append
     parameter_spans = []  # type: List[List[int]]
@@ -203,31 +342,250 @@ def parse_to_spans(byte_array: bytearray) -> Dict[str, List[List[int]]]:
     pfs_append = parser_function_spans.append
     template_spans = []  # type: List[List[int]]
     tls_append = template_spans.append
-    # HTML <!-- comments -->
-    for match in COMMENT_FINDITER(byte_array):
-        ms, me = match.span()
-        cms_append([ms, me])
-        byte_array[ms:me] = b' ' * (me - ms)
-    # <extension tags>
-    for match in EXTENSION_TAGS_FINDITER(byte_array):
-        ms, me = match.span()
-        ets_append([ms, me])
-        if match[2]:  # parsable tag extension group
-            parse_pm_pf_tl(
-                byte_array, ms, me,
-                pms_append, pfs_append, tls_append, wls_append)
+    for ms, me, contents in parsable_tags:
+        byte_array[ms:me] = contents
+        _parse_pm_pf_tl(
+            byte_array, ms, me,
+            pms_append, pfs_append, tls_append, wls_append)
         byte_array[ms:me] = b'_' * (me - ms)
-    parse_pm_pf_tl(
+    _parse_pm_pf_tl(
         byte_array, 0, None,
         pms_append, pfs_append,
         tls_append, wls_append)
     return {
-        'Comment': sorted(comment_spans),
-        'ExtensionTag': sorted(extension_tag_spans),
-        'Parameter': sorted(parameter_spans),
-        'ParserFunction': sorted(parser_function_spans),
-        'Template': sorted(template_spans),
-        'WikiLink': sorted(wikilink_spans)}
+        'Parameter': parameter_spans,
+        'ParserFunction': parser_function_spans,
+        'Template': template_spans,
+        'WikiLink': wikilink_spans}
+
+
+# Each stage masks the spans it finds, therefore the types of a stage can
+# only be found after running all of the previous stages.
+SPAN_STAGES = (
+    (('Comment',), _comment_stage),
+    (('ExtensionTag',), _extension_tag_stage),
+    (('Parameter', 'ParserFunction', 'Template', 'WikiLink'), _pm_pf_tl_stage),
+)
+
+
+# A packed span is the integer (start << 32 | end). Packed spans sort in the
+# same order as [start, end] lists.
+_END_MASK = 0xFFFFFFFF
+
+
+def pack_spans(spans: Iterable[List[int]]) -> array:
+    """Return the given spans packed and sorted in an array."""
+    return array('q', sorted([s << 32 | e for s, e in spans]))
+
+
+def unpack_spans(packed: array) -> List[List[int]]:
+    """Return the packed spans as a sorted list of [start, end] lists."""
+    return [[p >> 32, p & _END_MASK] for p in packed]
+
+
+class TypeToSpans(dict):
+
+    """Map each span type to its sorted list of [start, end] spans.
+
+    The spans of a type are kept packed (see pack_spans) until the type is
+    looked up for the first time. Iterating over the types or their spans
+    unpacks all of them.
+
+    If a byte_array is given, the SPAN_STAGES are run on it one by one and
+    only when one of their types is looked up.
+
+    Edits are applied to the packed spans lazily, see update_spans.
+    """
+
+    __slots__ = (
+        '_packed', '_byte_array', '_stage', '_parsable_tags', '_deferred',
+        '_edits', '_holders', '_released', '_shadow_memo', '_loose', '_root')
+
+    def __init__(
+        self, packed: Dict[str, array] = None, byte_array: bytearray = None
+    ) -> None:
+        super().__init__()
+        self._packed = {} if packed is None else packed
+        self._byte_array = byte_array
+        self._stage = 0
+        self._parsable_tags = []  # type: List[Tuple[int, int, bytearray]]
+        self._deferred = []  # type: List[Tuple[Callable, tuple]]
+        # The edits recorded by WikiText.batch, None outside of a batch.
+        self._edits = None  # type: Optional[list]
+        # See hold_child_spans.
+        self._holders = {}  # type: Dict[int, Tuple[List[int], set]]
+        self._released = []  # type: List[int]
+        # The (span, version, shadow) of the last parent of arguments.
+        self._shadow_memo = None  # type: Optional[tuple]
+        # The [openers, closers] of find_loose_delimiters, None if unknown.
+        self._loose = None  # type: Optional[List[List[List[int]]]]
+        # The span of the root node. It is emptied instead of being closed
+        # when its whole string is removed, see _shrink_spans.
+        self._root = None  # type: Optional[List[int]]
+
+    def __missing__(self, type_: str) -> List[List[int]]:
+        while self._pending(type_):
+            self._run_stage()
+        packed = self._packed
+        spans = unpack_spans(packed.pop(type_))
+        for func, args in self._deferred:
+            func((spans,), *args)
+        if not packed and self._byte_array is None:
+            self._deferred = []
+        dict.__setitem__(self, type_, spans)
+        return spans
+
+    def __setitem__(self, type_: str, spans: List[List[int]]) -> None:
+        self._packed.pop(type_, None)
+        dict.__setitem__(self, type_, spans)
+
+    def __contains__(self, type_) -> bool:
+        return (
+            dict.__contains__(self, type_) or type_ in self._packed
+            or self._pending(type_))
+
+    def __iter__(self):
+        self.unpack()
+        return dict.__iter__(self)
+
+    def __len__(self) -> int:
+        length = dict.__len__(self) + len(self._packed)
+        if self._byte_array is not None:
+            for types, _ in SPAN_STAGES[self._stage:]:
+                length += len(types)
+        return length
+
+    def _pending(self, type_: str) -> bool:
+        """Return True if type_ will be found by one of the next stages."""
+        if self._byte_array is None:
+            return False
+        for types, _ in SPAN_STAGES[self._stage:]:
+            if type_ in types:
+                return True
+        return False
+
+    def _run_stage(self) -> None:
+        """Run the next stage of SPAN_STAGES and pack its spans."""
+        _, stage = SPAN_STAGES[self._stage]
+        packed = self._packed
+        for type_, spans in stage(
+            self._byte_array, self._parsable_tags
+        ).items():
+            packed[type_] = pack_spans(spans)
+        self._stage += 1
+        if self._stage == len(SPAN_STAGES):
+            self._byte_array = self._parsable_tags = None
+
+    def get(self, type_: str, default=None):
+        return self[type_] if type_ in self else default
+
+    def setdefault(self, type_: str, default=None):
+        if not dict.__contains__(self, type_) and type_ in self:
+            return self[type_]
+        return dict.setdefault(self, type_, default)
+
+    def keys(self):
+        self.unpack()
+        return dict.keys(self)
+
+    def values(self):
+        self.unpack()
+        return dict.values(self)
+
+    def items(self):
+        self.unpack()
+        return dict.items(self)
+
+    def update_spans(self, func: Callable, *args) -> None:
+        """Call func(spans_lists, *args) on the spans of every type.
+
+        The loose delimiters, if known, are updated the same way.
+
+        The call is deferred for packed types and pending stages. Deferred
+        calls are replayed, in order, when the type is unpacked.
+        """
+        if self._released:
+            self._remove_released()
+        loose = self._loose
+        func(
+            dict.values(self) if loose is None else
+            chain(dict.values(self), loose), *args)
+        if self._packed or self._byte_array is not None:
+            self._deferred.append((func, args))
+
+    def hold_child_spans(
+        self, key: int, parent_span: List[int], children: Iterable
+    ) -> None:
+        """Keep self[key] only while any of its child nodes is alive.
+
+        The spans of arguments and cells are stored under the id of their
+        parent's span. They are removed after the last node that uses them
+        is garbage collected, so that they don't need to be updated on the
+        later edits. parent_span is kept alive until then so that its id
+        is not reused.
+        """
+        holder = self._holders.get(key)
+        if holder is None:
+            holder = self._holders[key] = parent_span, set()
+        refs = holder[1]
+        callback = partial(self._release, key)
+        for child in children:
+            refs.add(ref(child, callback))
+        if not refs:
+            self._released.append(key)
+
+    def _release(self, key: int, child_ref: ref) -> None:
+        holder = self._holders.get(key)
+        if holder is None:
+            return
+        refs = holder[1]
+        refs.discard(child_ref)
+        if not refs:
+            # Removing the key here could change the size of self while it
+            # is being iterated.
+            self._released.append(key)
+
+    def _remove_released(self) -> None:
+        holders = self._holders
+        for key in self._released:
+            holder = holders.get(key)
+            if holder is not None and not holder[1]:
+                del holders[key]
+                dict.pop(self, key, None)
+        self._released = []
+
+    def unpack(self) -> None:
+        """Run the remaining stages and convert all packed spans to lists."""
+        while self._byte_array is not None:
+            self._run_stage()
+        for type_ in list(self._packed):
+            self[type_]
+
+    def subspans_copy(self, start: int, end: int) -> 'TypeToSpans':
+        """Return a packed copy of the spans within [start, end].
+
+        The copied spans are shifted to be relative to start. None of the
+        spans of self is unpacked or modified unless there are deferred
+        updates.
+        """
+        if self._deferred:
+            self.unpack()
+        while self._byte_array is not None:
+            self._run_stage()
+        packed = {}
+        shift = (start << 32) + start
+        low, high = start << 32, (end + 1) << 32
+        for type_, keys in self._packed.items():
+            packed[type_] = array('q', [
+                k - shift for k in
+                keys[bisect_left(keys, low):bisect_left(keys, high)]
+                if k & _END_MASK <= end])
+        for type_, spans in dict.items(self):
+            packed[type_] = pack_spans([
+                [s - start, e - start]
+                for s, e in spans[bisect_left(spans, [start]):]
+                if e <= end])
+        return TypeToSpans(packed)
 
 
 def parse_pm_pf_tl(
@@ -287,3 +645,405 @@ def parse_pm_pf_tl(
     for match in start_and_end_tags:
         ms, me = match.span()
         byte_array[ms:me] = blank_sensitive_chars(byte_array[ms:me])
+
+
+# Runs of two or more braces or brackets, used by the stack engine.
+DELIMITERS_SEARCH = regex_compile(rb'\{\{++|\}\}++|\[\[++|\]\]++').search
+
+
+def parse_pm_pf_tl_stack(
+    byte_array: bytearray, start: int, end: Optional[int],
+    params_append: Callable, pfs_append: Callable,
+    tls_append: Callable, wikilinks_append: Callable,
+) -> None:
+    """Find the same spans as parse_pm_pf_tl in a single pass.
+
+    Opening runs of braces and brackets are pushed onto a stack. Each closing
+    run is matched against the nearest opener using the anchored versions of
+    the patterns used by parse_pm_pf_tl, so innermost constructs are masked
+    before their parents are tried and no fixpoint iteration is needed.
+
+    Overlapping brace and bracket constructs are resolved by the order of the
+    passes in parse_pm_pf_tl, which is not modelled here. Such input is rare;
+    the region is handed over to parse_pm_pf_tl whenever it is encountered.
+    """
+    if end is None:
+        end = len(byte_array)
+    original = byte_array[start:end]
+    start_and_end_tags = list(
+        HTML_START_TAG_FINDITER(byte_array, start, end)
+    ) + list(HTML_END_TAG_FINDITER(byte_array, start, end))
+    for match in start_and_end_tags:
+        ms, me = match.span()
+        byte_array[ms:me] = blank_brackets(byte_array[ms:me])
+    spans = _stack_spans(byte_array, start, end)
+    if spans is None:
+        byte_array[start:end] = original
+        parse_pm_pf_tl(
+            byte_array, start, end,
+            params_append, pfs_append, tls_append, wikilinks_append)
+        return
+    for append, type_spans in zip(
+        (params_append, pfs_append, tls_append, wikilinks_append), spans
+    ):
+        for span in type_spans:
+            append(span)
+    for match in start_and_end_tags:
+        ms, me = match.span()
+        byte_array[ms:me] = blank_sensitive_chars(byte_array[ms:me])
+
+
+class _Node:
+
+    """A construct found by _stack_spans."""
+
+    __slots__ = (
+        'start', 'end', 'kind', 'time', 'clear', 'last', 'hidden', 'children',
+        'subtree')
+
+    def __init__(
+        self, start: int, end: int, kind: int, time: int, clear: int,
+        last: int, children: List['_Node'],
+    ) -> None:
+        self.start = start
+        self.end = end
+        self.kind = kind
+        # When parse_pm_pf_tl masks this node, 3 * round + phase.
+        self.time = time
+        # When there is no unmasked {{ or }} left inside this node.
+        self.clear = clear
+        # When the last change inside this node happens.
+        self.last = last
+        # Masked by an enclosing template before being found.
+        self.hidden = False
+        self.children = children
+        # This node and the nodes inside it, sorted by time. The children are
+        # always created first, so this is only computed once per node.
+        subtree = [node for child in children for node in child.subtree]
+        subtree.append(self)
+        subtree.sort(key=_node_time)
+        self.subtree = subtree
+
+
+_PARAM, _PARSER_FUNCTION, _TEMPLATE, _INVALID, _WIKILINK = range(5)
+
+
+def _pf_tl_kind(match) -> int:
+    if match[1] is not None:
+        return _PARSER_FUNCTION
+    if match[2] is not None:
+        return _INVALID
+    return _TEMPLATE
+
+
+def _node_time(node: _Node) -> int:
+    return node.time
+
+
+def _late_wikilinks(children: List[_Node], time: int):
+    """Yield the wikilinks in children that are found after time."""
+    for node in children:
+        if node.last > time:
+            yield from _late_wikilinks(node.children, time)
+            if node.kind == _WIKILINK and node.time > time \
+                    and not node.hidden:
+                yield node
+
+
+def _wikilink_min_time(children: List[_Node]) -> int:
+    """Return the earliest time a wikilink with these children is found.
+
+    Inner wikilinks must be masked in an earlier round.
+    """
+    return 3 * max([1] + [
+        -(-node.time // 3) for node in children
+        if node.kind == _WIKILINK]) + 1
+
+
+def _param_masked_wikilink(
+    byte_array: bytearray, stack: List[list], r: int, me: int, end: int,
+) -> bool:
+    """Return True if the failed wikilink at r matches once | is masked."""
+    for item in reversed(stack):
+        if item[2]:
+            if item[1] < 3:
+                return False
+            break
+    else:
+        return False
+    wikilink = byte_array[r:me]
+    byte_array[r:me] = wikilink.replace(b'|', b'P')
+    match = WIKILINK_MATCH(byte_array, r, end)
+    byte_array[r:me] = wikilink
+    return match is not None
+
+
+def _stack_spans(byte_array: bytearray, start: int, end: int) -> Optional[
+    Tuple[List[List[int]], List[List[int]], List[List[int]], List[List[int]]]
+]:
+    """Return (params, pfs, tls, wikilinks) or None to fall back.
+
+    parse_pm_pf_tl works in rounds of three phases: parameters, wikilinks,
+    then parser functions and templates. A construct is only found once the
+    constructs that prevent its pattern from matching are masked, and a
+    template masks the wikilinks inside it that are not found yet. To give
+    the same result, the time at which parse_pm_pf_tl would find each
+    construct is recorded as `3 * round + phase`.
+    """
+    initial = byte_array[start:end]
+    nodes = []  # type: List[_Node]
+    root = []  # type: List[_Node]
+    last_brace_closer = byte_array.rfind(b'}}', start, end)
+    last_bracket_closer = byte_array.rfind(b']]', start, end)
+    # Each item is [position, length, is_brace, children].
+    stack = []  # type: List[list]
+
+    def pop_frames(i: int) -> None:
+        """Remove stack[i:] and keep their children in the parent."""
+        children = stack[i - 1][3] if i else root
+        for frame in stack[i:]:
+            children += frame[3]
+        del stack[i:]
+
+    def states(
+        s: int, e: int, t: int, children: List[_Node],
+        param: Optional[_Node] = None,
+    ) -> Iterator[bytearray]:
+        """Yield byte_array[s - 1:e + 2] as it is before t, t + 3, ....
+
+        Each state is built from the previous one by masking the nodes that
+        are found in between.
+        """
+        buffer = initial[s - start:e - start]
+        desc = [node for child in children for node in child.subtree]
+        if param is not None:
+            desc.append(param)
+        desc.sort(key=_node_time)
+        # The outermost masked wikilinks. Wikilinks do not cross each other,
+        # therefore these are disjoint.
+        wikilink_starts = []  # type: List[int]
+        wikilink_ends = []  # type: List[int]
+        i = 0
+        while True:
+            while i < len(desc) and desc[i].time < t:
+                node = desc[i]
+                i += 1
+                if node.hidden:
+                    continue
+                ns, ne, kind = node.start - s, node.end - s, node.kind
+                # Nodes found later than an enclosing wikilink are found while
+                # parsing its contents, i.e. before it is masked.
+                k = bisect_right(wikilink_starts, ns)
+                if k and ne <= wikilink_ends[k - 1]:
+                    continue
+                if ns < 0:  # the enclosing parameter
+                    buffer = buffer.replace(b'|', b'P')
+                elif kind == _PARAM:
+                    buffer[ns:ne] = b'PPP' + buffer[ns + 3:ne - 3].replace(
+                        b'|', b'P') + b'PPP'
+                elif kind == _WIKILINK:
+                    buffer[ns:ne] = b'_' * (ne - ns)
+                    j = bisect_left(wikilink_starts, ne, k)
+                    wikilink_starts[k:j] = [ns]
+                    wikilink_ends[k:j] = [ne]
+                elif kind == _INVALID:
+                    buffer[ns:ne] = b'_' * (ne - ns)
+                    buffer[ns + 1] = 123
+                else:
+                    buffer[ns:ne] = b'X' * (ne - ns)
+            yield byte_array[s - 1:s] + buffer + byte_array[e:min(e + 2, end)]
+            t += 3
+
+    def matches_at(
+        match_func: Callable, state: bytearray, s: int, e: int,
+        kind: Optional[int],
+    ) -> Optional[bool]:
+        """Return whether the construct at [s:e] matches in state.
+
+        Return None if something else would be matched instead.
+        """
+        offset = 1 if s else 0
+        match = match_func(state, offset)
+        if match is None:
+            return False
+        if match.end() != offset + e - s or (
+            kind is not None and _pf_tl_kind(match) != kind
+        ):
+            return None
+        return True
+
+    def ready_time(
+        match_func: Callable, s: int, e: int, t: int, children: List[_Node],
+        kind: Optional[int],
+    ) -> Optional[int]:
+        """Return the first time >= t at which the construct is found.
+
+        Return None if parse_pm_pf_tl would find something else.
+        """
+        last = max([node.last for node in children] or [-1])
+        if t > last:
+            return t
+        node_states = states(s, e, t, children)
+        while t <= last:
+            found = matches_at(match_func, next(node_states), s, e, kind)
+            if found is not False:
+                return t if found else None
+            t += 3
+        return t
+
+    pos = start
+    while True:
+        match = DELIMITERS_SEARCH(byte_array, pos, end)
+        if match is None:
+            break
+        ms, me = match.span()
+        pos = me
+        char = byte_array[ms]
+        if char == 123:  # {
+            stack.append([ms, me - ms, True, []])
+            continue
+        if char == 91:  # [
+            if me - ms == 2:  # [[[ can never start a wikilink
+                stack.append([ms, 2, False, []])
+            continue
+        is_brace = char == 125  # }
+        c = ms
+        while me - c >= 2 and stack:
+            # Find the nearest opener of the same kind.
+            i = len(stack) - 1
+            while i >= 0 and stack[i][2] is not is_brace:
+                i -= 1
+            if i < 0:
+                break
+            if i != len(stack) - 1:  # crossing constructs
+                if is_brace:
+                    if last_bracket_closer > c:
+                        return None
+                elif last_brace_closer > c:
+                    return None
+                # The other openers can never be closed, ignore them.
+                pop_frames(i + 1)
+            opener = stack[-1]
+            r, length, _, children = opener
+            if is_brace:
+                param = None
+                if length >= 3 and me - c >= 3:
+                    if length >= 4:
+                        param = PARAMS_MATCH(byte_array, r + length - 4, c + 3)
+                    if param is None:
+                        param = PARAMS_MATCH(byte_array, r + length - 3, c + 3)
+                match = PF_TL_MATCH(byte_array, r + length - 2, c + 2)
+                if match is not None:
+                    s, e = match.span()
+                    kind = _pf_tl_kind(match)
+                    if children:
+                        t = ready_time(PF_TL_MATCH, s, e, 3 * max([1] + [
+                            -(-(node.clear - 1) // 3) for node in children
+                        ]) + 2, children, kind)
+                        if t is None:
+                            return None
+                    else:
+                        t = 5
+                if param is not None:
+                    # Parameters inside parameters are found in the same
+                    # phase, other constructs in an earlier one.
+                    param_time = 3 * max([1] + [
+                        -(-node.clear // 3) for node in children]) \
+                        if children else 3
+                    if match is None or param_time < t:
+                        s, e = param.span()
+                        node = _Node(s, e, _PARAM, param_time, param_time, max(
+                            [param_time] + [node.last for node in children]),
+                            children)
+                        # Wikilinks that are not found yet will be matched
+                        # against the masked parameter.
+                        for wikilink in _late_wikilinks(children, param_time):
+                            ws, we = wikilink.start, wikilink.end
+                            t = _wikilink_min_time(wikilink.children)
+                            wikilink_states = states(
+                                ws, we, t, wikilink.children, node)
+                            while t < wikilink.time:
+                                if matches_at(
+                                    WIKILINK_MATCH, next(wikilink_states),
+                                    ws, we, None,
+                                ) is not False:
+                                    return None
+                                t += 3
+                            if not matches_at(
+                                WIKILINK_MATCH, next(wikilink_states), ws, we,
+                                None,
+                            ):
+                                return None
+                        byte_array[s:e] = b'PPP' + byte_array[
+                            s + 3:e - 3].replace(b'|', b'P') + b'PPP'
+                        match = None
+                if match is not None:
+                    if children:
+                        for wikilink in _late_wikilinks(children, t):
+                            wikilink.hidden = True
+                    node = _Node(s, e, kind, t, t, t, children)
+                    if kind == _INVALID:
+                        byte_array[s:e] = b'_' * (e - s)
+                        byte_array[s + 1] = 123
+                    else:
+                        byte_array[s:e] = b'X' * (e - s)
+                elif param is None:
+                    # Nothing below this opener can span over it.
+                    while i and stack[i - 1][2]:
+                        i -= 1
+                    pop_frames(i)
+                    break
+            else:
+                match = WIKILINK_MATCH(byte_array, r, end)
+                if match is None:
+                    if _param_masked_wikilink(byte_array, stack, r, me, end):
+                        return None
+                    while i and not stack[i - 1][2]:
+                        i -= 1
+                    pop_frames(i)
+                    break
+                s, e = match.span()
+                if children:
+                    t = ready_time(
+                        WIKILINK_MATCH, s, e, _wikilink_min_time(children),
+                        children, None)
+                    if t is None:
+                        return None
+                    node = _Node(s, e, _WIKILINK, t, min(t, max(
+                        node.clear for node in children)), t, children)
+                else:
+                    node = _Node(s, e, _WIKILINK, 4, 0, 4, children)
+                byte_array[s:e] = b'_' * (e - s)
+            nodes.append(node)
+            if s - r < 2:
+                stack.pop()
+                (stack[-1][3] if stack else root).append(node)
+            else:
+                opener[1] = s - r
+                opener[3] = [node]
+            c = e
+    params, pfs, tls, wikilinks = [], [], [], []  # type: List[List[int]]
+    appends = {
+        _PARAM: params.append, _PARSER_FUNCTION: pfs.append,
+        _TEMPLATE: tls.append, _WIKILINK: wikilinks.append}
+    for node in nodes:
+        if not node.hidden and node.kind != _INVALID:
+            appends[node.kind]([node.start, node.end])
+    return params, pfs, tls, wikilinks
+
+
+_SPAN_ENGINES = {'regex': parse_pm_pf_tl, 'stack': parse_pm_pf_tl_stack}
+_parse_pm_pf_tl = parse_pm_pf_tl
+
+
+def set_span_engine(name: str) -> None:
+    """Choose the function used by parse_to_spans for nested constructs.
+
+    :name: 'regex' (default) for parse_pm_pf_tl or 'stack' for
+        parse_pm_pf_tl_stack. Both produce the same spans.
+    """
+    global _parse_pm_pf_tl
+    try:
+        _parse_pm_pf_tl = _SPAN_ENGINES[name]
+    except KeyError:
+        raise ValueError('unknown span engine: ' + repr(name)) from None
@@ -1,10 +1,17 @@
 ﻿"""Define the Table class."""
 
 
+from array import array
 from bisect import insort_right
-from typing import List, Any, Union, Optional, TypeVar, Dict, Tuple
+from typing import (
+    List, Any, Union, Optional, TypeVar, Dict, Tuple, Iterable, Iterator,
+    Sequence)
 
 from regex import compile as regex_compile, VERBOSE
+try:
+    from numpy import array as numpy_array
+except ImportError:  # numpy is optional
+    numpy_array = None
 
 from ._cell import (
     Cell,
@@ -55,6 +62,8 @@ class Table(SubWikiTextWithAttrs):
     """Create a new Table object."""
 
     _attrs_match_cache = None, None
+    _data_attrs_cache = None, None, None
+    _nesting_level_cache = None, None
 
     @property
     def nesting_level(self) -> int:
@@ -63,7 +72,13 @@ class Table(SubWikiTextWithAttrs):
         The minimum nesting_level is 0. Being part of any Table increases
         the level by one.
         """
-        return self._nesting_level(('Table',)) - 1
+        cached_version, level = self._nesting_level_cache
+        version = self._lststr.version
+        if cached_version == version:
+            return level
+        level = self._nesting_level(('Table',)) - 1
+        self._nesting_level_cache = version, level
+        return level
 
     @property
     def _table_shadow(self) -> bytearray:
@@ -76,9 +91,8 @@ class Table(SubWikiTextWithAttrs):
             shadow[s - ss:e - ss] = b'#' * (e - s)
         return shadow
 
-    @property
-    def _match_table(self) -> List[List[Any]]:
-        """Return match_table."""
+    def _iter_match_rows(self) -> Iterator[List[Any]]:
+        """Yield the cell matches of each row of the table."""
         table_shadow = self._table_shadow
         # Remove table-start and table-end marks.
         pos = table_shadow.find(10)  # ord('\n')
@@ -89,7 +103,6 @@ class Table(SubWikiTextWithAttrs):
             pos = nlp
             lsp = _lstrip_increase(table_shadow, pos)
         # Start of the first row
-        match_table = []
         pos = _semi_caption_increase(table_shadow, pos)
         rsp = _row_separator_increase(table_shadow, pos)
         pos = -1
@@ -100,7 +113,6 @@ class Table(SubWikiTextWithAttrs):
             # Don't add a row if there are no new cells.
             if m:
                 match_row = []  # type: List[Any]
-                match_table.append(match_row)
                 while m:
                     match_row.append(m)
                     sep = m['sep']
@@ -119,8 +131,8 @@ class Table(SubWikiTextWithAttrs):
                             m = INLINE_HAEDER_CELL_MATCH(table_shadow, pos)
                     pos = _semi_caption_increase(table_shadow, pos)
                     m = NEWLINE_CELL_MATCH(table_shadow, pos)
+                yield match_row
             rsp = _row_separator_increase(table_shadow, pos)
-        return match_table
 
     def data(
         self, span: bool = True,
@@ -141,48 +153,65 @@ class Table(SubWikiTextWithAttrs):
             See https://www.mediawiki.org/wiki/Extension:Pipe_Escape for how
             wiki-tables can be inserted within templates.
         """
-        match_table = self._match_table
+        if span:
+            table_data = _apply_attr_spans(self._iter_data_rows(True, strip))
+        else:
+            table_data = [r for _, r in self._iter_data_rows(False, strip)]
+        if row is None:
+            if column is None:
+                return table_data
+            return [r[column] for r in table_data]
+        if column is None:
+            return table_data[row]
+        return table_data[row][column]
+
+    def _iter_data_rows(
+        self, span: bool, strip: bool
+    ) -> Iterator[Tuple[Optional[List[Dict[bytes, bytes]]], List[str]]]:
+        """Yield the attrs and the values of each row.
+
+        The attrs are None if span is False.
+        """
         # Note string is only used for extracting data, matching is done over
         # the shadow.
         string = self.string
-        table_data = []  # type: List[List[str]]
-        if strip:
-            for match_row in match_table:
-                row_data = []  # type: List[str]
-                table_data.append(row_data)
+        row_attrs = None  # type: Optional[List[Dict[bytes, bytes]]]
+        if span:
+            # The string is encoded once and the attrs of each cell are kept
+            # until the next edit.
+            version = self._lststr.version
+            cached_version, encoded, attrs_cache = self._data_attrs_cache
+            if cached_version != version:
+                encoded = string.encode('ascii', 'replace')
+                attrs_cache = {}
+                self._data_attrs_cache = version, encoded, attrs_cache
+            attrs_cache_get = attrs_cache.get
+        for match_row in self._iter_match_rows():
+            row_data = []  # type: List[str]
+            row_data_append = row_data.append
+            if strip:
                 for m in match_row:
                     # Spaces after the first newline can be meaningful
                     s, e = m.span('data')
-                    row_data.append(string[s:e].lstrip(' ').rstrip(WS))
-        else:
-            for match_row in match_table:
-                row_data = []
-                table_data.append(row_data)
+                    row_data_append(string[s:e].lstrip(' ').rstrip(WS))
+            else:
                 for m in match_row:
                     s, e = m.span('data')
-                    row_data.append(string[s:e])
-        if table_data:
+                    row_data_append(string[s:e])
             if span:
-                table_attrs = []  # type: List[List[Dict[str, str]]]
-                for match_row in match_table:
-                    row_attrs = []  # type: List[Dict[str, str]]
-                    table_attrs.append(row_attrs)
-                    row_attrs_append = row_attrs.append
-                    for m in match_row:
-                        s, e = m.span('attrs')
-                        captures = ATTRS_MATCH(
-                            string.encode('ascii', 'replace'), s, e).captures
-                        row_attrs_append(dict(zip(
-                            captures('attr_name'), captures('attr_value')
-                        )))
-                table_data = _apply_attr_spans(table_attrs, table_data)
-        if row is None:
-            if column is None:
-                return table_data
-            return [r[column] for r in table_data]
-        if column is None:
-            return table_data[row]
-        return table_data[row][column]
+                row_attrs = []
+                row_attrs_append = row_attrs.append
+                for m in match_row:
+                    attrs_span = m.span('attrs')
+                    # noinspection PyUnboundLocalVariable
+                    attrs = attrs_cache_get(attrs_span)
+                    if attrs is None:
+                        # noinspection PyUnboundLocalVariable
+                        captures = ATTRS_MATCH(encoded, *attrs_span).captures
+                        attrs = attrs_cache[attrs_span] = dict(zip(
+                            captures('attr_name'), captures('attr_value')))
+                    row_attrs_append(attrs)
+            yield row_attrs, row_data
 
     def cells(
         self, row: int = None, column: int = None, span: bool = True,
@@ -199,23 +228,41 @@ class Table(SubWikiTextWithAttrs):
         If only need the values inside cells, then use the ``data`` method
         instead.
         """
+        if span:
+            table_cells = _apply_attr_spans(self._iter_cell_rows(True))
+        else:
+            table_cells = [r for _, r in self._iter_cell_rows(False)]
+        if row is None:
+            if column is None:
+                return table_cells
+            return [r[column] for r in table_cells]
+        if column is None:
+            return table_cells[row]
+        return table_cells[row][column]
+
+    def _iter_cell_rows(
+        self, span: bool
+    ) -> Iterator[Tuple[Optional[List[Dict[bytes, bytes]]], List[Cell]]]:
+        """Yield the attrs and the Cell objects of each row.
+
+        The attrs are None if span is False.
+        """
         tbl_span = self._span
         ss = tbl_span[0]
-        match_table = self._match_table
         shadow = self._shadow
         type_ = id(tbl_span)
         type_to_spans = self._type_to_spans
         spans = type_to_spans.setdefault(type_, [])
-        table_cells = []  # type: List[List[Cell]]
-        table_attrs = []  # type: List[List[Dict[str, str]]]
+        # The spans are shifted in place by edits, index them on each call.
+        span_tuple_to_span_get = {(s[0], s[1]): s for s in spans}.get
+        lststr = self._lststr
+        row_attrs = None  # type: Optional[List[Dict[bytes, bytes]]]
         attrs_match = None
-        for match_row in match_table:
+        for match_row in self._iter_match_rows():
             row_cells = []  # type: List[Cell]
-            table_cells.append(row_cells)
             header = match_row[0]['sep'] == '!'
             if span:
-                row_attrs = []  # type: List[Dict[str, str]]
-                table_attrs.append(row_attrs)
+                row_attrs = []
                 row_attrs_append = row_attrs.append
             for m in match_row:
                 ms, me = m.span()
@@ -231,14 +278,17 @@ class Table(SubWikiTextWithAttrs):
                     row_attrs_append(dict(zip(
                         captures('attr_name'), captures('attr_value')
                     )))
-                old_span = next((s for s in spans if s == cell_span), None)
-                if old_span is None:
-                    insort_right(spans, cell_span)
-                else:
+                old_span = span_tuple_to_span_get((ss + ms, ss + me))
+                if old_span is not None:
                     cell_span = old_span
+                elif not spans or spans[-1] < cell_span:
+                    # Cells are found in order, appending is the usual case.
+                    spans.append(cell_span)
+                else:
+                    insort_right(spans, cell_span)
                 row_cells.append(
                     Cell(
-                        self._lststr,
+                        lststr,
                         header,
                         type_to_spans,
                         cell_span,
@@ -247,15 +297,92 @@ class Table(SubWikiTextWithAttrs):
                         attrs_match,
                     )
                 )
-        if table_cells and span:
-            table_cells = _apply_attr_spans(table_attrs, table_cells)
-        if row is None:
-            if column is None:
-                return table_cells
-            return [r[column] for r in table_cells]
-        if column is None:
-            return table_cells[row]
-        return table_cells[row][column]
+            type_to_spans.hold_child_spans(type_, tbl_span, row_cells)
+            yield row_attrs, row_cells
+
+    def iter_rows(
+        self, span: bool = True, strip: bool = True, cells: bool = False
+    ) -> Iterator[Union[List[str], List[Cell]]]:
+        """Yield the rows of the table one at a time.
+
+        Each row is a list of values like the rows of ``data``, or a list of
+        Cell objects like the rows of ``cells`` if cells is True.
+
+        Only the rows that are still covered by rowspans are kept in memory,
+        so large tables don't need to be loaded at once. Unlike ``data`` and
+        ``cells``, a row is not padded with None to the width of the rows
+        that come after it.
+
+        :param span: If true, calculate rows according to rowspans and colspans
+            attributes. Otherwise ignore them.
+        :param strip: strip data values. Ignored if cells is True.
+        :param cells: Yield lists of Cell objects instead of values.
+        """
+        if cells:
+            attrs_and_rows = self._iter_cell_rows(span)
+        else:
+            attrs_and_rows = self._iter_data_rows(span, strip)
+        if span:
+            return _iter_attr_spans(attrs_and_rows)
+        return (r for _, r in attrs_and_rows)
+
+    def columns(
+        self, span: bool = True, strip: bool = True
+    ) -> List[List[Optional[str]]]:
+        """Return a list containing lists of column values.
+
+        This is the transpose of ``data(span, strip)``, but the columns are
+        filled while the rows are matched, without building the rows first.
+        """
+        columns = []  # type: List[List[Optional[str]]]
+        for y, row in enumerate(self.iter_rows(span, strip)):
+            if len(row) > len(columns):
+                # Previous rows were shorter.
+                columns.extend(
+                    [None] * y for _ in range(len(row) - len(columns)))
+            for column, value in zip(columns, row):
+                column.append(value)
+            for column in columns[len(row):]:
+                column.append(None)
+        return columns
+
+    def to_columns(
+        self, header_row: Optional[int] = 0,
+        span: bool = True,
+        strip: bool = True,
+        numeric: bool = False,
+    ) -> Dict[Union[str, int], Sequence]:
+        """Return a dict mapping the column names to their values.
+
+        :param header_row: The row that contains the column names. The
+            values are taken from the rows after it. If None, all of the rows
+            are values and the column indices are used as names.
+        :param span: If true, calculate rows according to rowspans and colspans
+            attributes. Otherwise ignore them.
+        :param strip: strip data values
+        :param numeric: Convert each column that only contains numbers (or
+            empty cells) to floats at once. Converted columns are NumPy
+            arrays if NumPy is installed, otherwise ``array('d')`` objects.
+            Empty cells become NaN. Other columns are left as lists.
+
+        Column indices are also used as names for the columns whose name is
+        empty, missing, or repeated.
+        """
+        columns = self.columns(span, strip)
+        result = {}  # type: Dict[Union[str, int], Sequence]
+        for i, column in enumerate(columns):
+            if header_row is None:
+                name = i  # type: Union[str, int]
+                values = column  # type: Sequence
+            else:
+                name = column[header_row]
+                if not name or name in result:
+                    name = i
+                values = column[header_row + 1:]
+            if numeric:
+                values = _to_floats(values)
+            result[name] = values
+        return result
 
     @property
     def caption(self) -> Optional[str]:
@@ -283,13 +410,13 @@ class Table(SubWikiTextWithAttrs):
 
     @property
     def _attrs_match(self) -> Any:
-        cache_match, cache_string = self._attrs_match_cache
-        string = self.string
-        if cache_string == string:
+        cache_match, cache_version = self._attrs_match_cache
+        version = self._lststr.version
+        if cache_version == version:
             return cache_match
         shadow = self._shadow
         attrs_match = ATTRS_MATCH(shadow, 2, shadow.find(10))  # ord('\n')
-        self._attrs_match_cache = attrs_match, string
+        self._attrs_match_cache = attrs_match, version
         return attrs_match
 
     @property
@@ -316,43 +443,60 @@ class Table(SubWikiTextWithAttrs):
 
 
 def _apply_attr_spans(
-    table_attrs: List[List[Dict[str, str]]], table_data: List[List[T]]
-) -> List[List[T]]:
-    """Apply row and column spans and return table_data."""
+    attrs_and_rows: Iterable[Tuple[List[Dict[bytes, bytes]], List[T]]]
+) -> List[List[Optional[T]]]:
+    """Apply row and column spans and return the table."""
+    table = list(_iter_attr_spans(attrs_and_rows))
+    if table:
+        # Rows yielded before the table grew wider are shorter.
+        xwidth = max(len(r) for r in table)
+        for r in table:
+            if xwidth > len(r):
+                r.extend([None] * (xwidth - len(r)))
+    return table
+
+
+def _iter_attr_spans(
+    attrs_and_rows: Iterable[Tuple[List[Dict[bytes, bytes]], List[T]]]
+) -> Iterator[List[Optional[T]]]:
+    """Apply row and column spans and yield each row once it is complete.
+
+    A row is complete as soon as its own cells are processed because later
+    cells can only span downwards. Instead of the rows below the current
+    row, only the cells that span into them are kept, so the memory does not
+    depend on the declared rowspans. colspan and rowspan values are clamped
+    to the limits set by set_table_span_limits, and so is the number of
+    slots in the rows that only hold the cells spanning into them.
+    """
+    max_colspan = _max_colspan
+    max_rowspan = _max_rowspan
+    max_cells = _max_cells
+    # The number of slots in the yielded rows
+    cells = 0
     # The following code is based on the table forming algorithm described
     # at http://www.w3.org/TR/html5/tabular-data.html#processing-model-1
     # Numbered comments indicate the step in that algorithm.
     # 1
     xwidth = 0
-    # 2
-    yheight = 0
-    # 4
-    # The xwidth and yheight variables give the table's dimensions.
+    # 2, 4
+    # The xwidth gives the table's width. Instead of yheight, the cells that
+    # span below ycurrent are kept as [cell, cellx, width, rows_left].
     # The table is initially empty.
-    table = []  # type: List[List[Optional[T]]]
-    # Table.data won't call this function if table_data is empty.
-    # 5
-    # if not table_data:
-    #     return table_data
-    # 10
-    ycurrent = 0
+    spanning_cells = []  # type: List[List[Any]]
     # 11
     downward_growing_cells = []  # type: List[Tuple[Optional[T], int, int]]
     # 13, 18
     # Algorithm for processing rows
-    for attrs_row, row in zip(table_attrs, table_data):
+    for attrs_row, row in attrs_and_rows:
         # 13.1 ycurrent is never greater than yheight
-        if yheight == ycurrent:
-            yheight += 1
-            table.append([None] * xwidth)
+        current_row = [None] * xwidth  # type: List[Optional[T]]
+        spanning_cells = _fill_spanning_cells(current_row, spanning_cells)
         # 13.2
         xcurrent = 0
         # 13.3
         # The algorithm for growing downward-growing cells
         for cell, cellx, width in downward_growing_cells:
-            r = table[ycurrent]
-            for x in range(cellx, cellx + width):
-                r[x] = cell
+            current_row[cellx:cellx + width] = [cell] * width
         # 13.4 will be handled by the following for-loop.
         # 13.5, 13.16
         for attrs, current_cell in zip(attrs_row, row):
@@ -360,25 +504,26 @@ def _apply_attr_spans(
             attrs_get = attrs.get
             while (
                 xcurrent < xwidth and
-                table[ycurrent][xcurrent] is not None
+                current_row[xcurrent] is not None
             ):
                 xcurrent += 1
             # 13.7
             if xcurrent == xwidth:
                 # xcurrent is never greater than xwidth
                 xwidth += 1
-                for r in table:
-                    if xwidth > len(r):
-                        r.extend([None] * (xwidth - len(r)))
+                current_row.append(None)
             # 13.8
-            colspan = int(attrs_get(b'colspan', 1))
-            if colspan == 0:
+            colspan = min(int(attrs_get(b'colspan', 1)), max_colspan)
+            if colspan <= 0:
                 # Note: colspan="0" tells the browser to span the cell to
                 # the last column of the column group (colgroup)
                 # http://www.w3schools.com/TAGS/att_td_colspan.asp
+                # Browsers also ignore negative values.
                 colspan = 1
             # 13.9
-            rowspan = int(attrs_get(b'rowspan', 1))
+            rowspan = min(int(attrs_get(b'rowspan', 1)), max_rowspan)
+            if rowspan < 0:
+                rowspan = 1
             # 13.10
             if rowspan == 0:
                 # Note: rowspan="0" tells the browser to span the cell to the
@@ -390,24 +535,17 @@ def _apply_attr_spans(
                 cell_grows_downward = False
             # 13.11
             if xwidth < xcurrent + colspan:
+                current_row.extend([None] * (xcurrent + colspan - xwidth))
                 xwidth = xcurrent + colspan
-                for r in table:
-                    if xwidth > len(r):
-                        r.extend([None] * (xwidth - len(r)))
-            # 13.12
-            if yheight < ycurrent + rowspan:
-                yheight = ycurrent + rowspan
-                while len(table) < yheight:
-                    table.append([None] * xwidth)
-            # 13.13
-            for y in range(ycurrent, ycurrent + rowspan):
-                r = table[y]
-                for x in range(xcurrent, xcurrent + colspan):
-                    # If any of the slots involved already had a cell
-                    # covering them, then this is a table model error.
-                    # Those slots now have two cells overlapping.
-                    r[x] = current_cell
-                    # Skipping algorithm for assigning header cells
+            # 13.12, 13.13
+            # If any of the slots involved already had a cell covering them,
+            # then this is a table model error. Those slots now have two
+            # cells overlapping.
+            # Skipping algorithm for assigning header cells
+            current_row[xcurrent:xcurrent + colspan] = [current_cell] * colspan
+            if rowspan > 1:
+                spanning_cells.append(
+                    [current_cell, xcurrent, colspan, rowspan - 1])
             # 13.14
             if cell_grows_downward:
                 downward_growing_cells.append(
@@ -416,24 +554,84 @@ def _apply_attr_spans(
             # 13.15
             xcurrent += colspan
         # 13.16
-        ycurrent += 1
+        cells += len(current_row)
+        yield current_row
     # 14
     # The algorithm for ending a row group
     # 14.1
-    while ycurrent < yheight:
+    while spanning_cells:
+        cells += xwidth
+        if cells > max_cells:
+            # The remaining rows only hold the spanning cells, drop them.
+            return
+        current_row = [None] * xwidth
+        spanning_cells = _fill_spanning_cells(current_row, spanning_cells)
         # 14.1.1
         # Run the algorithm for growing downward-growing cells.
         for cell, cellx, width in downward_growing_cells:
-            for x in range(cellx, cellx + width):
-                table[ycurrent][x] = cell
+            current_row[cellx:cellx + width] = [cell] * width
         # 14.2.2
-        ycurrent += 1
+        yield current_row
     # 14.2
     # downward_growing_cells = []
     # 20 If there exists a row or column in the table containing only
     # slots that do not have a cell anchored to them,
     # then this is a table model error.
-    return table
+
+
+def _fill_spanning_cells(
+    row: list, spanning_cells: List[List[Any]]
+) -> List[List[Any]]:
+    """Put the spanning cells in row and return the ones that go further."""
+    remaining_cells = []
+    for spanning_cell in spanning_cells:
+        cell, cellx, width, rows_left = spanning_cell
+        row[cellx:cellx + width] = [cell] * width
+        if rows_left > 1:
+            spanning_cell[3] = rows_left - 1
+            remaining_cells.append(spanning_cell)
+    return remaining_cells
+
+
+# Browsers clamp colspan and rowspan to these values, see
+# https://html.spec.whatwg.org/multipage/tables.html
+_max_colspan = 1000
+_max_rowspan = 65534
+# Even with the above limits a single cell could span 65534000 slots.
+_max_cells = 1000000
+
+
+def set_table_span_limits(
+    colspan: int = 1000, rowspan: int = 65534, cells: int = 1000000
+) -> None:
+    """Set the maximum colspan and rowspan used for arranging table cells.
+
+    Larger values are clamped. The defaults are the limits of browsers.
+    Lower them to bound the size of the tables returned by ``Table.data``
+    and ``Table.cells`` for malformed or vandalized attributes.
+
+    The rows after the last row of the table that only hold the cells
+    spanning into them are not added once the table would have more than
+    `cells` slots.
+    """
+    global _max_colspan, _max_rowspan, _max_cells
+    if colspan < 1 or rowspan < 1 or cells < 1:
+        raise ValueError('span limits should be positive')
+    _max_colspan = colspan
+    _max_rowspan = rowspan
+    _max_cells = cells
+
+
+def _to_floats(values: List[Optional[str]]) -> Sequence:
+    """Return values as an array of floats or unchanged if not possible."""
+    # Empty cells are converted to NaN.
+    values_or_nan = [v or 'nan' for v in values]
+    try:
+        if numpy_array is not None:
+            return numpy_array(values_or_nan, dtype=float)
+        return array('d', map(float, values_or_nan))
+    except ValueError:
+        return values
 
 
 def _lstrip_increase(shadow: bytearray, pos: int) -> int:
@@ -9,6 +9,7 @@ For more info see:
 
 """
 
+from bisect import bisect_left
 from typing import Dict, Optional, Any
 
 from regex import compile as regex_compile, VERBOSE, DOTALL
@@ -140,12 +141,12 @@ class Tag(SubWikiTextWithAttrs):
     @property
     def _match(self) -> Any:
         """Return the match object for the current tag. Cache the result."""
-        cached_match, cached_string = self._match_cache
-        string = self.string
-        if cached_string == string:
+        cached_match, cached_version = self._match_cache
+        version = self._lststr.version
+        if cached_version == version:
             return cached_match
         match = TAG_FULLMATCH(self._shadow)
-        self._match_cache = match, string
+        self._match_cache = match, version
         return match
 
     _attrs_match = _match
@@ -199,5 +200,11 @@ class Tag(SubWikiTextWithAttrs):
         se = self._span[0]
         s, e = self._match.span('contents')
         type_to_spans = self._type_to_spans
-        span = type_to_spans.setdefault('SubWikiText', [se + s, se + e])
+        spans = type_to_spans.setdefault('SubWikiText', [])
+        span = [se + s, se + e]
+        i = bisect_left(spans, span)
+        if i < len(spans) and spans[i] == span:
+            span = spans[i]
+        else:
+            spans.insert(i, span)
         return SubWikiText(self._lststr, type_to_spans, span, 'SubWikiText')
@@ -1,13 +1,18 @@
 """Define the Template class."""
 
 
-from typing import List, Optional, TypeVar, Iterable, Dict, Tuple
+from functools import lru_cache
+from sys import intern
+from typing import (
+    Dict, Iterable, List, Mapping, Optional, Sequence, Tuple, TypeVar)
 from warnings import warn
 
 from regex import compile as regex_compile, REVERSE
 
 from ._argument import Argument
-from ._parser_function import SubWikiTextWithArgs
+# noinspection PyProtectedMember
+from ._parser_function import (
+    SubWikiTextWithArgs, _arg_matches_and_positions)
 from ._spans import COMMENT_PATTERN
 from ._wikitext import WS
 
@@ -21,6 +26,10 @@ TL_NAME_ARGS_FULLMATCH = regex_compile(
 STARTING_WS_MATCH = regex_compile(r'\s*+').match
 ENDING_WS_MATCH = regex_compile(r'(?>\n[ \t]*)*+', REVERSE).match
 SPACE_AFTER_SEARCH = regex_compile(r'\s*+(?=\|)').search
+# Characters that may change how the arguments of a template are split
+SPECIAL_CHAR_SEARCH = regex_compile(r'[|={}\[\]<>]').search
+
+NORMAL_NAME_CACHE_SIZE = 8192
 
 T = TypeVar('T')
 
@@ -34,6 +43,8 @@ class Template(SubWikiTextWithArgs):
 
     _name_args_matcher = TL_NAME_ARGS_FULLMATCH
     _first_arg_sep = 124
+    # See _args_index.
+    _args_index_cache = None  # type: Optional[list]
 
     def normal_name(
         self,
@@ -54,6 +65,8 @@ class Template(SubWikiTextWithArgs):
         - Use uppercase for the first letter if `capitalize`.
         - Remove #anchor.
 
+        The results are cached, see the `normal_name` function.
+
         :param rm_namespaces: is used to provide additional localized
             namespaces for the template namespace. They will be removed from
             the result. Default is ('Template',).
@@ -67,7 +80,7 @@ class Template(SubWikiTextWithArgs):
         Example:
             >>> Template(
             ...     '{{ eN : tEmPlAtE : <!-- c --> t_1 # b | a }}'
-            ... ).normal_name(code='en')
+            ... ).normal_name(code='en', capitalize=True)
             'T 1'
         """
         if capital_links:
@@ -78,37 +91,7 @@ class Template(SubWikiTextWithArgs):
             warn('`positional_code` argument is deprecated,'
                  ' use `code` instead', DeprecationWarning)
             code = _code
-        # Remove comments
-        name = COMMENT_SUB('', self.name).strip(WS)
-        # Remove code
-        if code:
-            head, sep, tail = name.partition(':')
-            if not head and sep:
-                name = tail.strip(' ')
-                head, sep, tail = name.partition(':')
-            if code.lower() == head.strip(' ').lower():
-                name = tail.strip(' ')
-        # Remove namespace
-        head, sep, tail = name.partition(':')
-        if not head and sep:
-            name = tail.strip(' ')
-            head, sep, tail = name.partition(':')
-        if head:
-            ns = head.strip(' ').lower()
-            for namespace in rm_namespaces:
-                if namespace.lower() == ns:
-                    name = tail.strip(' ')
-                    break
-        # Use space instead of underscore
-        name = name.replace('_', ' ')
-        if capitalize:
-            # Use uppercase for the first letter
-            n0 = name[0]
-            if n0.islower():
-                name = n0.upper() + name[1:]
-        # Remove #anchor
-        name, sep, tail = name.partition('#')
-        return ' '.join(name.split())
+        return normal_name(self.name, rm_namespaces, code, capitalize)
 
     def rm_first_of_dup_args(self) -> None:
         """Eliminate duplicate arguments by removing the first occurrences.
@@ -119,13 +102,14 @@ class Template(SubWikiTextWithArgs):
 
         Also see `rm_dup_args_safe` function.
         """
-        names = set()  # type: set
-        for a in reversed(self.arguments):
-            name = a.name.strip(WS)
-            if name in names:
-                del a[:len(a.string)]
-            else:
-                names.add(name)
+        with self.batch():
+            names = set()  # type: set
+            for a in reversed(self.arguments):
+                name = a.name.strip(WS)
+                if name in names:
+                    del a[:len(a.string)]
+                else:
+                    names.add(name)
 
     def rm_dup_args_safe(self, tag: str = None) -> None:
         """Remove duplicate arguments in a safe manner.
@@ -148,42 +132,47 @@ class Template(SubWikiTextWithArgs):
         """
         name_to_lastarg_vals = {} \
             # type: Dict[str, Tuple[Argument, List[str]]]
-        # Removing positional args affects their name. By reversing the list
-        # we avoid encountering those kind of args.
-        for arg in reversed(self.arguments):
-            name = arg.name.strip(WS)
-            if arg.positional:
-                # Value of keyword arguments is automatically stripped by MW.
-                val = arg.value
-            else:
-                # But it's not OK to strip whitespace in positional arguments.
-                val = arg.value.strip(WS)
-            if name in name_to_lastarg_vals:
-                # This is a duplicate argument.
-                if not val:
-                    # This duplicate argument is empty. It's safe to remove it.
-                    del arg[0:len(arg.string)]
+        with self.batch():
+            # Removing positional args affects their name. By reversing the
+            # list we avoid encountering those kind of args.
+            for arg in reversed(self.arguments):
+                name = arg.name.strip(WS)
+                if arg.positional:
+                    # Value of keyword arguments is automatically stripped by
+                    # MW.
+                    val = arg.value
                 else:
-                    # Try to remove any of the detected duplicates of this
-                    # that are empty or their value equals to this one.
-                    lastarg, dup_vals = name_to_lastarg_vals[name]
-                    if val in dup_vals:
+                    # But it's not OK to strip whitespace in positional
+                    # arguments.
+                    val = arg.value.strip(WS)
+                if name in name_to_lastarg_vals:
+                    # This is a duplicate argument.
+                    if not val:
+                        # This duplicate argument is empty. It's safe to
+                        # remove it.
                         del arg[0:len(arg.string)]
-                    elif '' in dup_vals:
-                        # This happens only if the last occurrence of name has
-                        # been an empty string; other empty values will
-                        # be removed as they are seen.
-                        # In other words index of the empty argument in
-                        # dup_vals is always 0.
-                        del lastarg[0:len(lastarg.string)]
-                        dup_vals.pop(0)
                     else:
-                        # It was not possible to remove any of the duplicates.
-                        dup_vals.append(val)
-                        if tag:
-                            arg.value += tag
-            else:
-                name_to_lastarg_vals[name] = (arg, [val])
+                        # Try to remove any of the detected duplicates of this
+                        # that are empty or their value equals to this one.
+                        lastarg, dup_vals = name_to_lastarg_vals[name]
+                        if val in dup_vals:
+                            del arg[0:len(arg.string)]
+                        elif '' in dup_vals:
+                            # This happens only if the last occurrence of name
+                            # has been an empty string; other empty values
+                            # will be removed as they are seen.
+                            # In other words index of the empty argument in
+                            # dup_vals is always 0.
+                            del lastarg[0:len(lastarg.string)]
+                            dup_vals.pop(0)
+                        else:
+                            # It was not possible to remove any of the
+                            # duplicates.
+                            dup_vals.append(val)
+                            if tag:
+                                arg.value += tag
+                else:
+                    name_to_lastarg_vals[name] = (arg, [val])
 
     def set_arg(
         self, name: str,
@@ -204,8 +193,7 @@ class Template(SubWikiTextWithArgs):
           argument. Ignore `preserve_spacing` if positional is True.
           If it's None, do what seems more appropriate.
         """
-        args = list(reversed(self.arguments))
-        arg = get_arg(name, args)
+        arg = self.get_arg(name)
         # Updating an existing argument.
         if arg:
             if positional:
@@ -217,28 +205,14 @@ class Template(SubWikiTextWithArgs):
                 arg.value = value
             return
         # Adding a new argument
+        args = self.arguments
         if not name and positional is None:
             positional = True
         # Calculate the whitespace needed before arg-name and after arg-value.
         if not positional and preserve_spacing and args:
-            before_names = []
-            name_lengths = []
-            before_values = []
-            after_values = []
-            for arg in args:
-                aname = arg.name
-                name_len = len(aname)
-                name_lengths.append(name_len)
-                before_names.append(STARTING_WS_MATCH(aname)[0])
-                arg_value = arg.value
-                before_values.append(STARTING_WS_MATCH(arg_value)[0])
-                after_values.append(ENDING_WS_MATCH(arg_value)[0])
-            pre_name_ws_mode = mode(before_names)
-            name_length_mode = mode(name_lengths)
-            post_value_ws_mode = mode(
-                [SPACE_AFTER_SEARCH(self.string)[0]] + after_values[1:]
-            )
-            pre_value_ws_mode = mode(before_values)
+            spacing = _spacing(
+                [_arg_spacing(a.name, a.value) for a in args],
+                SPACE_AFTER_SEARCH(self.string)[0])
         else:
             preserve_spacing = False
         # Calculate the string that needs to be added to the Template.
@@ -248,23 +222,19 @@ class Template(SubWikiTextWithArgs):
         else:
             if preserve_spacing:
                 # noinspection PyUnboundLocalVariable
-                addstring = (
-                    '|' + (pre_name_ws_mode + name.strip(WS)).
-                    ljust(name_length_mode) +
-                    '=' + pre_value_ws_mode + value + post_value_ws_mode
-                )
+                addstring = _keyword_arg_string(name, value, spacing)
             else:
                 addstring = '|' + name + '=' + value
         # Place the addstring in the right position.
         if before:
-            arg = get_arg(before, args)
+            arg = self.get_arg(before)
             arg.insert(0, addstring)
         elif after:
-            arg = get_arg(after, args)
+            arg = self.get_arg(after)
             arg.insert(len(arg.string), addstring)
         else:
             if args and not positional:
-                arg = args[0]
+                arg = args[-1]
                 arg_string = arg.string
                 if preserve_spacing:
                     # Insert after the last argument.
@@ -272,8 +242,8 @@ class Template(SubWikiTextWithArgs):
                     # want to change the the whitespace before final braces.
                     # noinspection PyUnboundLocalVariable
                     arg[0:len(arg_string)] = (
-                        arg.string.rstrip(WS) + post_value_ws_mode +
-                        addstring.rstrip(WS) + after_values[0]
+                        arg.string.rstrip(WS) + spacing[3] +
+                        addstring.rstrip(WS) + spacing[4]
                     )
                 else:
                     arg.insert(len(arg_string), addstring)
@@ -282,12 +252,174 @@ class Template(SubWikiTextWithArgs):
                 # positional AND is to be added at the end of the template.
                 self.insert(-2, addstring)
 
+    def set_args(
+        self, mapping: Mapping[str, str], preserve_spacing: bool = True
+    ) -> None:
+        """Set the value of each name in mapping. Add the missing arguments.
+
+        The result is the same as calling `set_arg(name, value,
+        preserve_spacing=preserve_spacing)` for each item in order. If no
+        name or value contains any of `|={}[]<>`, the arguments are read
+        once and all the changes are applied in a single edit.
+        """
+        items = mapping.items()
+        if any(
+            SPECIAL_CHAR_SEARCH(name) or SPECIAL_CHAR_SEARCH(value)
+            for name, value in items
+        ):
+            # The new text may change how the arguments are split.
+            for name, value in items:
+                self.set_arg(name, value, preserve_spacing=preserve_spacing)
+            return
+        args = self.arguments
+        old_values = [a.value for a in args]
+        # The [name, value, positional] of each argument, replaying the
+        # set_arg calls on them.
+        records = [
+            [a.name, value, a.positional]
+            for a, value in zip(args, old_values)]
+        spacings = [_arg_spacing(n, v) for n, v, _ in records]
+        name_to_index = {r[0].strip(WS): i for i, r in enumerate(records)}
+        position = sum(r[2] for r in records)
+        # The first pipe of the template, even if it is the first new one.
+        space_after_name = SPACE_AFTER_SEARCH(self.string[:-2] + '|')[0]
+        for name, value in items:
+            i = name_to_index.get(name.strip(WS))
+            if i is not None:
+                record = records[i]
+                if preserve_spacing:
+                    val = record[1]
+                    value = val.replace(val.strip(WS), value)
+                record[1] = value
+                spacings[i] = _arg_spacing(record[0], value)
+                continue
+            if not name:
+                position += 1
+                name = str(position)
+                records.append([name, value, True])
+            elif preserve_spacing and records:
+                spacing = _spacing(spacings, space_after_name)
+                last = records[-1]
+                last[1] = last[1].rstrip(WS) + spacing[3]
+                spacings[-1] = _arg_spacing(last[0], last[1])
+                addstring = _keyword_arg_string(name, value, spacing)
+                name, _, value = (
+                    addstring[1:].rstrip(WS) + spacing[4]).partition('=')
+                records.append([name, value, False])
+            else:
+                records.append([name, value, False])
+            name_to_index[name.strip(WS)] = len(records) - 1
+            spacings.append(_arg_spacing(name, value))
+        # The last argument and the new ones are written as one replacement,
+        # so the batch edits never overlap.
+        tail_start = len(args) - 1 if args else 0
+        tail = ''.join([
+            '|' + v if p else '|' + n + '=' + v
+            for n, v, p in records[tail_start:]])
+        with self.batch():
+            for arg, old_value, record in zip(
+                args[:tail_start], old_values, records
+            ):
+                if record[1] != old_value:
+                    arg.value = record[1]
+            if args:
+                if tail != args[-1].string:
+                    args[-1][:] = tail
+            elif tail:
+                self.insert(-2, tail)
+
+    def _args_index(self) -> list:
+        """Return the index of the arguments of self.
+
+        The index is [version, string, shadow, split_spans, matches,
+        positions, name_to_indices, unindexed, added_spans], see
+        _arg_matches_and_positions for matches and positions. It does not
+        keep any argument alive. It is kept until self.string changes; edits
+        outside of self only shift its span. name_to_indices is filled
+        lazily, see _arg_indices. added_spans is the list of argument spans
+        in type_to_spans and the result of _add_arg_spans, or None.
+        """
+        lststr = self._lststr
+        version = lststr.version
+        index = self._args_index_cache
+        if index is not None:
+            if index[0] == version:
+                return index
+            ss, se = self._span
+            if lststr.slice(ss, se) == index[1]:
+                index[0] = version
+                return index
+        ss, se = self._span
+        shadow = self._shadow
+        split_spans = self._name_args_matcher(shadow, 2, -2).spans('arg')
+        matches, positions = _arg_matches_and_positions(shadow, split_spans)
+        index = self._args_index_cache = [
+            version, lststr.slice(ss, se), shadow, split_spans, matches,
+            positions, {}, len(split_spans), None]
+        return index
+
+    def _arg_indices(self, name: str, all_: bool = False) -> List[int]:
+        """Return the indices of the arguments named `name`, last one first.
+
+        The names of the arguments are indexed from the last argument and
+        only as far as needed to find the last one with the given name, or
+        all of them if `all_` is True.
+        """
+        index = self._args_index()
+        string, _, split_spans, matches, positions, name_to_indices, i = \
+            index[1:8]
+        if not split_spans:
+            return []
+        name = name.strip(WS)
+        indices = name_to_indices.get(name)
+        if i and (all_ or not indices):
+            while i:
+                i -= 1
+                position = positions[i]
+                if position:
+                    arg_name = str(position)
+                else:
+                    s = split_spans[i][0]
+                    pre_eq_start, pre_eq_end = matches[i].span('pre_eq')
+                    arg_name = string[
+                        s + pre_eq_start:s + pre_eq_end].strip(WS)
+                if arg_name in name_to_indices:
+                    name_to_indices[arg_name].append(i)
+                else:
+                    name_to_indices[arg_name] = [i]
+                if arg_name == name and not all_:
+                    break
+            index[7] = i
+            indices = name_to_indices.get(name)
+        return indices or []
+
+    def _indexed_args(self, indices: List[int]) -> List[Argument]:
+        """Return the arguments of self at the given indices."""
+        index = self._args_index()
+        _, _, shadow, split_spans, matches, positions, _, _, added_spans = \
+            index
+        span = self._span
+        ss = span[0]
+        arg_spans = self._type_to_spans.get(id(span))
+        # The spans may have been released or closed by an edit.
+        if added_spans is None or added_spans[0] is not arg_spans or any(
+            added_spans[1][i] != [ss + s for s in split_spans[i]]
+            for i in indices
+        ):
+            spans = self._add_arg_spans(split_spans)
+            index[8] = added_spans = self._type_to_spans[id(span)], spans
+        return self._new_arguments(
+            shadow, split_spans, added_spans[1], matches, positions, indices)
+
     def get_arg(self, name: str) -> Optional[Argument]:
         """Return the last argument with the given name.
 
         Return None if no argument with that name is found.
         """
-        return get_arg(name, reversed(self.arguments))
+        indices = self._arg_indices(name)
+        if not indices:
+            return None
+        return self._indexed_args(indices[:1])[0]
 
     def has_arg(self, name: str, value: str = None) -> bool:
         """Return true if the is an arg named `name`.
@@ -298,27 +430,119 @@ class Template(SubWikiTextWithArgs):
             better to get_arg directly and then check if the returned value
             is None.
         """
-        for arg in reversed(self.arguments):
-            if arg.name.strip(WS) == name.strip(WS):
-                if value:
-                    if arg.positional:
-                        if arg.value == value:
-                            return True
-                        return False
-                    if arg.value.strip(WS) == value.strip(WS):
-                        return True
-                    return False
-                return True
-        return False
+        arg = self.get_arg(name)
+        if arg is None:
+            return False
+        if value:
+            if arg.positional:
+                return arg.value == value
+            return arg.value.strip(WS) == value.strip(WS)
+        return True
 
     def del_arg(self, name: str) -> None:
         """Delete all arguments with the given then."""
-        for arg in reversed(self.arguments):
-            if arg.name.strip(WS) == name.strip(WS):
+        indices = self._arg_indices(name, True)
+        if not indices:
+            return
+        with self.batch():
+            for arg in self._indexed_args(indices):
                 del arg[:]
 
 
-def mode(list_: List[T]) -> T:
+def normal_name(
+    name: str, rm_namespaces: Iterable[str] = ('Template',),
+    code: str = None, capitalize=False
+) -> str:
+    """Return the normal form of the given template name.
+
+    See `Template.normal_name` for the steps and parameters. Templates with
+    the same raw name are common, so the results are kept in an LRU cache
+    of NORMAL_NAME_CACHE_SIZE entries and are interned.
+    """
+    if type(rm_namespaces) is not tuple:
+        rm_namespaces = tuple(rm_namespaces)
+    return _normal_name(name, rm_namespaces, code, capitalize)
+
+
+@lru_cache(maxsize=NORMAL_NAME_CACHE_SIZE)
+def _normal_name(
+    name: str, rm_namespaces: Tuple[str, ...], code: Optional[str],
+    capitalize: bool,
+) -> str:
+    """Compute the result of normal_name. rm_namespaces must be hashable."""
+    # Remove comments
+    name = COMMENT_SUB('', name).strip(WS)
+    # Remove code
+    if code:
+        head, sep, tail = name.partition(':')
+        if not head and sep:
+            name = tail.strip(' ')
+            head, sep, tail = name.partition(':')
+        if code.lower() == head.strip(' ').lower():
+            name = tail.strip(' ')
+    # Remove namespace
+    head, sep, tail = name.partition(':')
+    if not head and sep:
+        name = tail.strip(' ')
+        head, sep, tail = name.partition(':')
+    if head:
+        ns = head.strip(' ').lower()
+        for namespace in rm_namespaces:
+            if namespace.lower() == ns:
+                name = tail.strip(' ')
+                break
+    # Use space instead of underscore
+    name = name.replace('_', ' ')
+    if capitalize:
+        # Use uppercase for the first letter
+        n0 = name[0]
+        if n0.islower():
+            name = n0.upper() + name[1:]
+    # Remove #anchor
+    name, sep, tail = name.partition('#')
+    return intern(' '.join(name.split()))
+
+
+def _keyword_arg_string(
+    name: str, value: str, spacing: Tuple[str, int, str, str, str]
+) -> str:
+    """Return the string of a new keyword argument with the given spacing."""
+    pre_name_ws, name_length, pre_value_ws, post_value_ws = spacing[:4]
+    return (
+        '|' + (pre_name_ws + name.strip(WS)).ljust(name_length) +
+        '=' + pre_value_ws + value + post_value_ws)
+
+
+def _arg_spacing(name: str, value: str) -> Tuple[str, int, str, str]:
+    """Return the spacing of an argument with the given name and value.
+
+    Return the whitespace before the name, the length of the name, and the
+    whitespace before and after the value.
+    """
+    return (
+        STARTING_WS_MATCH(name)[0], len(name), STARTING_WS_MATCH(value)[0],
+        ENDING_WS_MATCH(value)[0])
+
+
+def _spacing(
+    arg_spacings: List[Tuple[str, int, str, str]], space_after_name: str
+) -> Tuple[str, int, str, str, str]:
+    """Return the common spacing of the arguments for adding a new one.
+
+    arg_spacings are the _arg_spacing of the arguments in order.
+    space_after_name is the whitespace before the first pipe of the
+    template. Return the most common whitespace before names, length of
+    names, whitespace before values, whitespace after values, and the
+    whitespace after the last value. Ties go to the earliest argument.
+    """
+    before_names, name_lengths, before_values, after_values = zip(
+        *arg_spacings)
+    return (
+        mode(before_names), mode(name_lengths), mode(before_values),
+        mode((space_after_name,) + after_values[:-1]), after_values[-1])
+
+
+def mode(list_: Sequence[T]) -> T:
     """Return the most common item in the list.
 
     Return the first one if there are more than one most common items.
@@ -333,19 +557,7 @@ def mode(list_: List[T]) -> T:
     ...
     ValueError: max() arg is an empty sequence
     """
-    return max(set(list_), key=list_.count)
-
-
-def get_arg(name: str, args: Iterable[Argument]) -> Optional[Argument]:
-    """Return the first argument in the args that has the given name.
-
-    Return None if no such argument is found.
-
-    As the computation of self.arguments is a little costly, this
-    function was created so that other methods that have already computed
-    the arguments use it instead of calling self.get_arg directly.
-    """
-    for arg in args:
-        if arg.name.strip(WS) == name.strip(WS):
-            return arg
-    return None
+    counts = {}  # type: Dict[T, int]
+    for item in list_:
+        counts[item] = counts.get(item, 0) + 1
+    return max(list_, key=counts.__getitem__)
@@ -0,0 +1,168 @@
+"""Define the text buffers that hold the string shared by WikiText objects.
+
+The `version` of a buffer is increased on every edit. Objects use it to
+check their cached matches and shadows.
+"""
+
+from bisect import bisect_right
+from itertools import accumulate
+from typing import Callable, Dict
+
+
+# The pieces are joined into a single string after this many edits.
+MAX_PIECES = 1024
+# The pieces around an edit are merged with it if they are shorter.
+MIN_PIECE_LENGTH = 256
+
+
+class StringBuffer(list):
+
+    """Keep the whole string as the only item of a list.
+
+    Every edit rebuilds the whole string.
+    """
+
+    __slots__ = 'version',
+
+    def __init__(self, string: str) -> None:
+        super().__init__((string,))
+        self.version = 0
+
+    def __setitem__(self, index: int, string: str) -> None:
+        super().__setitem__(index, string)
+        self.version += 1
+
+    def replace(self, start: int, stop: int, value: str) -> None:
+        """Replace self[0][start:stop] with value."""
+        string = self[0]
+        self[0] = string[:start] + value + string[stop:]
+
+    def slice(self, start: int, stop: int) -> str:
+        """Return self[0][start:stop]."""
+        return self[0][start:stop]
+
+
+class PieceTable:
+
+    """Keep the string as a list of pieces.
+
+    `self[0]` joins the pieces and caches the result as the only piece.
+    `replace` only copies the pieces that contain start and stop, and
+    `slice` only joins the pieces that it overlaps.
+    """
+
+    __slots__ = '_pieces', '_starts', '_string', 'version'
+
+    def __init__(self, string: str) -> None:
+        self._pieces = [string]
+        self._starts = [0]
+        self._string = string
+        self.version = 0
+
+    def __len__(self) -> int:
+        return 1
+
+    def __getitem__(self, index: int) -> str:
+        if index != 0 and index != -1:
+            raise IndexError('text buffer index out of range')
+        string = self._string
+        if string is None:
+            string = self._string = ''.join(self._pieces)
+            self._pieces = [string]
+            self._starts = [0]
+        return string
+
+    def __setitem__(self, index: int, string: str) -> None:
+        if index != 0 and index != -1:
+            raise IndexError('text buffer index out of range')
+        self._pieces = [string]
+        self._starts = [0]
+        self._string = string
+        self.version += 1
+
+    def replace(self, start: int, stop: int, value: str) -> None:
+        """Replace self[0][start:stop] with value."""
+        pieces = self._pieces
+        starts = self._starts
+        if not 0 <= start <= stop <= starts[-1] + len(pieces[-1]):
+            # Slice the whole string, like StringBuffer.
+            string = self[0]
+            self[0] = string[:start] + value + string[stop:]
+            return
+        self.version += 1
+        i = bisect_right(starts, start) - 1
+        j = bisect_right(starts, stop) - 1
+        head = pieces[i][:start - starts[i]]
+        tail = pieces[j][stop - starts[j]:]
+        # Merging short pieces keeps repeated small edits from creating
+        # many pieces whose starts are recalculated on every edit.
+        if not head and i and len(pieces[i - 1]) < MIN_PIECE_LENGTH:
+            i -= 1
+            head = pieces[i]
+        if not tail and j + 1 < len(pieces) and len(
+            pieces[j + 1]
+        ) < MIN_PIECE_LENGTH:
+            j += 1
+            tail = pieces[j]
+        if len(head) < MIN_PIECE_LENGTH:
+            value = head + value
+            head = ''
+        if len(tail) < MIN_PIECE_LENGTH:
+            value += tail
+            tail = ''
+        pieces[i:j + 1] = [p for p in (head, value, tail) if p] or ['']
+        if len(pieces) > MAX_PIECES:
+            self._string = ''.join(pieces)
+            self._pieces = [self._string]
+            self._starts = [0]
+            return
+        self._string = None
+        if i < len(pieces):
+            # Starts before i are not changed.
+            starts[i:] = accumulate(
+                [starts[i]] + [len(p) for p in pieces[i:-1]])
+        else:
+            del starts[i:]
+
+    def slice(self, start: int, stop: int) -> str:
+        """Return self[0][start:stop] without joining all the pieces."""
+        string = self._string
+        if string is not None:
+            return string[start:stop]
+        if start < 0 or stop < 0:
+            return self[0][start:stop]
+        if stop <= start:
+            return ''
+        pieces = self._pieces
+        starts = self._starts
+        i = bisect_right(starts, start) - 1
+        j = bisect_right(starts, stop) - 1
+        if i == j:
+            return pieces[i][start - starts[i]:stop - starts[i]]
+        return (
+            pieces[i][start - starts[i]:] + ''.join(pieces[i + 1:j])
+            + pieces[j][:stop - starts[j]])
+
+
+_TEXT_BUFFERS = {
+    'piece_table': PieceTable, 'string': StringBuffer,
+}  # type: Dict[str, Callable]
+_text_buffer = PieceTable
+
+
+def new_text_buffer(string: str):
+    """Return a new text buffer of the chosen type for string."""
+    return _text_buffer(string)
+
+
+def set_text_buffer(name: str) -> None:
+    """Choose the text buffer used for newly parsed strings.
+
+    :name: 'piece_table' (default) for PieceTable or 'string' for
+        StringBuffer.
+    """
+    global _text_buffer
+    try:
+        _text_buffer = _TEXT_BUFFERS[name]
+    except KeyError:
+        raise ValueError('unknown text buffer: ' + repr(name)) from None
@@ -1,10 +1,11 @@
 """Define the WikiList class."""
 
 
-from typing import List, Union, Tuple, Dict, MutableSequence, Match
+from typing import Any, List, Union, Tuple, Dict, MutableSequence, Match
 
-from regex import escape, fullmatch, MULTILINE
+from regex import escape, MULTILINE
 
+from ._patterns import add_pattern_kind, compiled_pattern
 from ._wikitext import SubWikiText
 
 
@@ -23,6 +24,7 @@ LIST_PATTERN_FORMAT = (
     rb'(?>\n|\Z)' + SUBLIST_PATTERN +
     rb')'
     rb')++')
+add_pattern_kind('list', LIST_PATTERN_FORMAT, MULTILINE)
 
 
 class WikiList(SubWikiText):
@@ -37,32 +39,37 @@ class WikiList(SubWikiText):
         _type_to_spans: Dict[str, List[List[int]]] = None,
         _span: List[int] = None,
         _type: str = None,
+        _list_node_cache: Tuple[int, Any] = (None, None),
     ) -> None:
         super().__init__(string, _type_to_spans, _span, _type)
         self.pattern = pattern
-        if _match:
-            self._match_cache = _match, self.string
-        else:
-            self._match_cache = fullmatch(
-                LIST_PATTERN_FORMAT.replace(b'{pattern}', pattern.encode()),
-                self._shadow,
-                MULTILINE,
-            ), self.string
+        # The match is found on the first access if not given.
+        self._match_cache = _match, self._lststr.version if _match else None
+        self._list_node_cache = _list_node_cache
 
     @property
     def _match(self):
         """Return the match object for the current list."""
-        cache_match, cache_string = self._match_cache
-        string = self.string
-        if cache_string == string:
+        cache_match, cache_version = self._match_cache
+        version = self._lststr.version
+        if cache_version == version:
             return cache_match
-        cache_match = fullmatch(
-            LIST_PATTERN_FORMAT.replace(b'{pattern}', self.pattern.encode()),
-            self._shadow,
-            MULTILINE)
-        self._match_cache = cache_match, string
+        cache_match = compiled_pattern(
+            'list', self.pattern.encode()).fullmatch(self._shadow)
+        self._match_cache = cache_match, version
         return cache_match
 
+    @property
+    def _list_tree(self) -> List[Any]:
+        """Return [self's node] if self was found in the list tree of a parent.
+
+        The sublists can then be looked up without scanning self again.
+        """
+        cached_version, node = self._list_node_cache
+        if cached_version == self._lststr.version:
+            return [node]
+        return super()._list_tree
+
     @property
     def items(self) -> List[str]:
         """Return items as a list of strings.
@@ -144,6 +151,7 @@ class WikiList(SubWikiText):
         """Convert to another list type by replacing starting pattern."""
         match = self._match
         ms = match.start()
-        for s, e in reversed(match.spans('pattern')):
-            self[s - ms:e - ms] = newstart
+        with self.batch():
+            for s, e in reversed(match.spans('pattern')):
+                self[s - ms:e - ms] = newstart
         self.pattern = escape(newstart)
@@ -5,14 +5,16 @@
 # Todo: Consider using separate strings for each node.
 
 from bisect import bisect_left, bisect_right, insort_right
-from copy import deepcopy
+from contextlib import contextmanager
+from functools import lru_cache
 from itertools import islice
-from operator import attrgetter
+from operator import attrgetter, itemgetter
 from typing import (
-    Dict, Generator, Iterable, List, MutableSequence, Optional, Tuple, Union)
+    Any, Callable, Dict, Generator, Iterable, List, MutableSequence, Optional,
+    Tuple, Union)
 from warnings import warn
 
-from regex import VERBOSE, DOTALL, MULTILINE, IGNORECASE, search, finditer
+from regex import VERBOSE, DOTALL, MULTILINE, IGNORECASE
 from regex import compile as regex_compile
 from wcwidth import wcswidth
 
@@ -20,18 +22,38 @@ from wcwidth import wcswidth
 from ._config import (
     _tag_extensions, _HTML_TAG_NAME, _bare_external_link_schemes,
     regex_pattern)
+from ._patterns import add_pattern_kind, compiled_pattern
+from ._text_buffer import new_text_buffer
 from ._spans import (
+    COMMENT_DELIMITERS_FINDITER,
+    DELIMITER_CHARS_SEARCH,
     START_TAG_PATTERN,
     END_TAG_PATTERN,
+    TAG_NAME_END_SEARCH,
+    UNPARSABLE_TAG_MATCH,
+    TypeToSpans,
+    find_loose_delimiters,
+    parse_to_packed_spans_and_loose,
     parse_to_spans,
     INVALID_EXTLINK_CHARS,
     BARE_EXTERNAL_LINK,
-    EXTERNAL_LINK_URL_TAIL)
+    EXTERNAL_LINK_URL_TAIL,
+    HTML_START_TAG_FINDITER,
+    HTML_END_TAG_FINDITER,
+    blank_brackets,
+    blank_sensitive_chars)
 
 
 NAME_CAPTURING_HTML_START_TAG_FINDITER = regex_compile(
     START_TAG_PATTERN.replace(
         b'{name}', rb'(?<name>' + _HTML_TAG_NAME + rb')', 1)).finditer
+NAME_CAPTURING_HTML_END_TAG_FINDITER = regex_compile(
+    END_TAG_PATTERN.replace(
+        b'{name}', rb'(?<name>' + _HTML_TAG_NAME + rb')', 1)).finditer
+add_pattern_kind('start_tag', START_TAG_PATTERN.replace(
+    b'{name}', rb'(?P<name>{pattern})'))
+add_pattern_kind('end_tag', END_TAG_PATTERN.replace(
+    b'{name}', rb'(?P<name>{pattern})'))
 # External links
 BRACKET_EXTERNAL_LINK_SCHEMES = regex_pattern(
     _bare_external_link_schemes | {'//'}).encode()
@@ -47,7 +69,8 @@ INVALID_EXT_CHARS_SUB = regex_compile(
 ).sub
 
 # Sections
-SECTION_HEADING = rb'^(?<equals>={1,6})[^\n]+?(?P=equals)[ \t]*+$'
+SECTION_HEADING = \
+    rb'^(?<equals>={1,6})(?<title>[^\n]+?)(?P=equals)[ \t]*+$'
 SECTIONS_FULLMATCH = regex_compile(
     rb'(?<section>(?<equals>).*?)'  # lead section
     rb'(?<section>'
@@ -58,25 +81,32 @@ SECTIONS_FULLMATCH = regex_compile(
 ).fullmatch
 
 # Tables
-TABLE_FINDITER = regex_compile(
+# The lines that start or end a table. Table-starts can be indented by spaces
+# or colons. The whitespace before a table-end can span several lines.
+TABLE_DELIMITER_FINDITER = regex_compile(
     rb"""
-    # Table-start
-    # Always starts on a new line with optional leading spaces or indentation.
     ^
-    # Group the leading spaces or colons so that we can ignore them later.
-    ([ :]*+)
-    {\| # Table contents
-    (?:
-        # Any character, as long as it is not indicating another table-start
-        (?!^\ *+\{\|).
-    )*?
-    # Table-end
-    \n\s*+
-    (?> \|} | \Z )
+    (?>
+        [ :]*+(?<start>{\|)
+        |
+        \s*+(?<end>\|})
+    )
     """,
-    DOTALL | MULTILINE | VERBOSE
+    MULTILINE | VERBOSE
 ).finditer
 
+# Lists
+# The lines that start with a list prefix.
+LIST_LINE_FINDITER = regex_compile(
+    rb'^(?<prefix>[:;#*]++).*+(?>\n|\Z)', MULTILINE).finditer
+# `;` and `:` belong to the same list.
+LIST_PREFIX_CLASSES = bytes.maketrans(b';', b':')
+# The pattern of each character of a translated list prefix. Concatenations
+# of these patterns can be looked up in WikiText._list_tree.
+LIST_PATTERN_PIECES = {ord('#'): r'\#', ord('*'): r'\*', ord(':'): '[:;]'}
+TREE_LIST_PATTERN_FULLMATCH = regex_compile(
+    r'(?:\\\#|\\\*|\[:;\])++').fullmatch
+
 # Types which are detected by parse_to_spans
 SPAN_PARSER_TYPES = {
     'Template', 'ParserFunction', 'WikiLink', 'Comment', 'Parameter',
@@ -84,6 +114,25 @@ SPAN_PARSER_TYPES = {
 
 WS = '\r\n\t '
 
+# Text that can not contain, start, or end any span or split an argument.
+PLAIN_TEXT_FULLMATCH = regex_compile(r'[^\x00-\x1f{}\[\]<>|=:]*+').fullmatch
+# The delimiters of some of the SPAN_PARSER_TYPES, see _keeps_own_span.
+NODE_DELIMITERS = {
+    'Template': ('{{', '}}'), 'ParserFunction': ('{{', '}}'),
+    'Parameter': ('{{{', '}}}'), 'WikiLink': ('[[', ']]'),
+    'Comment': ('<!--', '-->')}
+# Comments and extension tags are found in the whole string before any other
+# span (see SPAN_STAGES), edits that touch these delimiters are not bounded.
+TAG_DELIMITERS_FINDITER = regex_compile(
+    r'<!--|-->|</?' + regex_pattern(_tag_extensions) + r'\b',
+    IGNORECASE).finditer
+HTML_TAG_CHARS_SEARCH = regex_compile(r'[<>\[\]]').search
+# See _isolated_parse.
+REGION_CACHE_SIZE = 1024
+REGION_CACHE_MAX_LENGTH = 256
+# The start of a template whose name is still empty, see WikiText._reparse.
+INVALID_NAME_END_SEARCH = regex_compile(r'\{\{[\s_]*+\Z').search
+
 
 class WikiText:
 
@@ -98,6 +147,8 @@ class WikiText:
         self,
         string: Union[MutableSequence[str], str],
         _type_to_spans: Dict[str, List[List[int]]] = None,
+        *,
+        lazy: bool = False
     ) -> None:
         """Initialize the object.
 
@@ -108,19 +159,29 @@ class WikiText:
         :param _type_to_spans: If the lststr is already parsed, pass its
             _type_to_spans property as _type_to_spans to avoid parsing it
             again.
+        :param lazy: Do not parse the string until a type of span is needed,
+            then only run the parsing stages required for finding that type.
+            For example accessing `comments` won't look for templates.
         """
         if _type_to_spans is not None:
             self._type_to_spans = _type_to_spans
             self._lststr = string  # type: MutableSequence[str]
             return
-        self._lststr = [string]
+        self._lststr = new_text_buffer(string)
         span = self._span = [0, len(string)]
         byte_array = bytearray(string, 'ascii', 'replace')
         _type = self._type
         if _type not in SPAN_PARSER_TYPES:
-            type_to_spans = self._type_to_spans = parse_to_spans(byte_array)
+            if lazy:
+                type_to_spans = self._type_to_spans = TypeToSpans(
+                    byte_array=byte_array)
+            else:
+                packed, loose = parse_to_packed_spans_and_loose(byte_array)
+                type_to_spans = self._type_to_spans = TypeToSpans(packed)
+                type_to_spans._loose = loose
+                self._shadow_cache = 0, byte_array
             type_to_spans[_type] = [span]
-            self._shadow_cache = string, byte_array
+            type_to_spans._root = span
         else:
             # In SPAN_PARSER_TYPES, we can't pass the original byte_array to
             # parser to generate the shadow because it will replace the whole
@@ -130,9 +191,12 @@ class WikiText:
             head = byte_array[:2]
             tail = byte_array[-2:]
             byte_array[-2:] = byte_array[:2] = b'__'
-            type_to_spans = parse_to_spans(byte_array)
-            self._shadow_cache = string, byte_array
+            packed, loose = parse_to_packed_spans_and_loose(byte_array)
+            type_to_spans = TypeToSpans(packed)
+            type_to_spans._loose = loose
+            self._shadow_cache = 0, byte_array
             type_to_spans[_type].insert(0, span)
+            type_to_spans._root = span
             self._type_to_spans = type_to_spans
             byte_array[:2] = head
             byte_array[-2:] = tail
@@ -178,13 +242,19 @@ class WikiText:
         """
         if stop is False:
             if start >= 0:
-                return self._lststr[0][self._span[0] + start]
+                index = self._span[0] + start
+                char = self._lststr.slice(index, index + 1)
+                if char:
+                    return char
+                return self._lststr[0][index]
             return self._lststr[0][self._span[1] + start]
         s, e = self._span
-        return self._lststr[0][
-            s if start is None else (s + start if start >= 0 else e + start):
-            e if stop is None else (s + stop if stop >= 0 else e + stop):
-            step]
+        start = (
+            s if start is None else (s + start if start >= 0 else e + start))
+        stop = e if stop is None else (s + stop if stop >= 0 else e + stop)
+        if step is None:
+            return self._lststr.slice(start, stop)
+        return self._lststr[0][start:stop:step]
 
     def __getitem__(self, key: Union[slice, int]) -> str:
         """Return self.string[key]."""
@@ -235,10 +305,14 @@ class WikiText:
         will improve.
         """
         start, stop = self._check_index(key)
+        edits = getattr(self._type_to_spans, '_edits', None)
+        if edits is not None:
+            edits.append((start, stop, value, 'set', self))
+            return
         # Update lststr
         lststr = self._lststr
-        lststr0 = lststr[0]
-        lststr[0] = lststr0[:start] + value + lststr0[stop:]
+        removed = lststr.slice(start, stop)
+        lststr.replace(start, stop, value)
         # Set the length of all subspans to zero because
         # they are all being replaced.
         self._close_subspans(start, stop)
@@ -251,12 +325,51 @@ class WikiText:
                 rmstart=stop + len_change,  # new stop
                 rmstop=stop)  # old stop
         # Add the newly added spans contained in the value.
+        self._reparse(removed, start, stop, start + len(value))
+
+    def _set_plain_text(self, start: int, stop: int, value: str) -> bool:
+        """Set self[start:stop] to value if both texts are plain.
+
+        This is a fast path for the setters of argument and parameter names
+        and values. start and stop are relative to self. The removed text and
+        value must match PLAIN_TEXT_FULLMATCH, and the caller must make sure
+        that the characters around them can not form a delimiter with them.
+        Then no span can be inside the removed text and there is nothing to
+        reparse, so only the lengths of the spans are updated. If the update
+        is done, also update the shadow of self and return True. Otherwise
+        return False without changing anything.
+        """
+        if getattr(self._type_to_spans, '_edits', None) is not None:
+            return False  # batch
+        if not PLAIN_TEXT_FULLMATCH(value):
+            return False
+        ss = self._span[0]
+        lststr = self._lststr
+        if not PLAIN_TEXT_FULLMATCH(lststr.slice(ss + start, ss + stop)):
+            return False
+        shadow = self._shadow
         type_to_spans = self._type_to_spans
-        for type_, spans in parse_to_spans(
-            bytearray(value, 'ascii', 'replace')
-        ).items():
-            for s, e in spans:
-                insort_right(type_to_spans[type_], [s + start, e + start])
+        memo = type_to_spans._shadow_memo
+        version = lststr.version
+        lststr.replace(ss + start, ss + stop, value)
+        len_change = len(value) + start - stop
+        if len_change > 0:
+            self._insert_update(ss + start, len_change)
+        elif len_change < 0:
+            self._shrink_update(ss + stop + len_change, ss + stop)
+        byte_value = value.encode('ascii', 'replace')
+        new_version = lststr.version
+        self._shadow_cache = new_version, (
+            shadow[:start] + byte_value + shadow[stop:])
+        if memo is not None and memo[1] == version and (
+            id(memo[0]) == self._type
+        ):  # also update the shadow of the parent of self
+            parent_span, _, parent_shadow = memo
+            offset = ss - parent_span[0]
+            type_to_spans._shadow_memo = parent_span, new_version, (
+                parent_shadow[:offset + start] + byte_value
+                + parent_shadow[offset + stop:])
+        return True
 
     def __delitem__(self, key: Union[slice, int]) -> None:
         """Remove the specified range or character from self.string.
@@ -266,12 +379,17 @@ class WikiText:
         possibility of insertion into the wrong spans.
         """
         start, stop = self._check_index(key)
+        edits = getattr(self._type_to_spans, '_edits', None)
+        if edits is not None:
+            edits.append((start, stop, '', 'del', self))
+            return
         lststr = self._lststr
-        lststr0 = lststr[0]
+        removed = lststr.slice(start, stop)
         # Update lststr
-        lststr[0] = lststr0[:start] + lststr0[stop:]
+        lststr.replace(start, stop, '')
         # Update spans
         self._shrink_update(start, stop)
+        self._reparse(removed, start, stop, start)
 
     # Todo: def __add__(self, other) and __radd__(self, other)
 
@@ -283,8 +401,6 @@ class WikiText:
         of the key being an slice, or the need to shrink any of the sub-spans.
         """
         ss, se = self._span
-        lststr = self._lststr
-        lststr0 = lststr[0]
         if index < 0:
             index += se - ss
             if index < 0:
@@ -292,20 +408,47 @@ class WikiText:
         elif index > se - ss:  # Note that it is not >=. Index can be new.
             index = se - ss
         index += ss
+        edits = getattr(self._type_to_spans, '_edits', None)
+        if edits is not None:
+            edits.append((index, index, string, 'insert', self))
+            return
         # Update lststr
-        lststr[0] = lststr0[:index] + string + lststr0[index:]
+        self._lststr.replace(index, index, string)
         string_len = len(string)
         # Update spans
         self._insert_update(
             index=index,
             length=string_len)
         # Remember newly added spans by the string.
+        self._reparse('', index, index, index + string_len)
+
+    @contextmanager
+    def batch(self) -> Generator[None, None, None]:
+        """Apply the edits that are made inside the with block at once.
+
+        Inside the block the string and the spans do not change, so every
+        edit is made with the offsets of the text before the block. When
+        the block exits, the string is rebuilt once and the spans are
+        updated in one pass. Edits are applied from the last one to the
+        first one and must not overlap. If the block raises an exception,
+        none of its edits are applied.
+
+        Usage:
+            with parsed.batch():
+                for template in parsed.templates:
+                    template.name = 'x'
+        """
         type_to_spans = self._type_to_spans
-        for type_, spans in parse_to_spans(
-            bytearray(string, 'ascii', 'replace')
-        ).items():
-            for s, e in spans:
-                insort_right(type_to_spans[type_], [index + s, index + e])
+        if type_to_spans._edits is not None:  # nested batch
+            yield
+            return
+        edits = type_to_spans._edits = []
+        try:
+            yield
+        finally:
+            type_to_spans._edits = None
+        if edits:
+            _apply_edits(self._lststr, type_to_spans, edits)
 
     @property
     def span(self) -> tuple:
@@ -320,7 +463,7 @@ class WikiText:
             emptying any object that points to the old string.
         """
         start, end = self._span
-        return self._lststr[0][start:end]
+        return self._lststr.slice(start, end)
 
     @string.setter
     def string(self, newstring: str) -> None:
@@ -337,15 +480,7 @@ class WikiText:
     def _close_subspans(self, start: int, stop: int) -> None:
         """Close all sub-spans of (start, stop)."""
         ss, se = self._span
-        for spans in self._type_to_spans.values():
-            b = bisect_left(spans, [start])
-            for i, (s, e) in enumerate(
-                spans[b:bisect_right(spans, [stop], b)]
-            ):
-                if e <= stop:
-                    if ss != s or se != e:
-                        spans.pop(i + b)[:] = -1, -1
-                        b -= 1
+        _update_spans(self._type_to_spans, _close_spans, start, stop, ss, se)
 
     def _shrink_update(self, rmstart: int, rmstop: int) -> None:
         """Update self._type_to_spans according to the removed span.
@@ -355,69 +490,133 @@ class WikiText:
         _insert_update before the _shrink_update as this function
         can cause data loss in self._type_to_spans.
         """
-        # Note: The following algorithm won't work correctly if spans
-        # are not sorted.
-        # Note: No span should be removed from _type_to_spans.
-        for spans in self._type_to_spans.values():
-            i = len(spans) - 1
-            while i >= 0:
-                s, e = span = spans[i]
-                if rmstop <= s:
-                    # rmstart <= rmstop <= s <= e
-                    rmlength = rmstop - rmstart
-                    span[:] = s - rmlength, e - rmlength
-                    i -= 1
-                    continue
-                break  # pragma: no cover
-            else:
-                continue  # pragma: no cover
-            while True:
-                if rmstart <= s:
-                    if rmstop < e:
-                        # rmstart < s <= rmstop < e
-                        span[:] = rmstart, e + rmstart - rmstop
-                        i -= 1
-                        if i < 0:
-                            break
-                        s, e = span = spans[i]
-                        continue
-                    # rmstart <= s <= e < rmstop
-                    spans.pop(i)[:] = -1, -1
-                    i -= 1
-                    if i < 0:
-                        break
-                    s, e = span = spans[i]
-                    continue
-                break  # pragma: no cover
-            while i >= 0:
-                if e <= rmstart:
-                    # s <= e <= rmstart <= rmstop
-                    i -= 1
-                    if i < 0:
-                        break
-                    s, e = span = spans[i]
-                    continue
-                # s <= rmstart <= rmstop <= e
-                span[1] -= rmstop - rmstart
-                i -= 1
-                if i < 0:
-                    break
-                s, e = span = spans[i]
-                continue
+        type_to_spans = self._type_to_spans
+        _update_spans(
+            type_to_spans, _shrink_spans, rmstart, rmstop,
+            getattr(type_to_spans, '_root', None))
 
     def _insert_update(self, index: int, length: int) -> None:
         """Update self._type_to_spans according to the added length."""
         self_span = ss, se = self._span
-        for spans in self._type_to_spans.values():
-            for span in spans:
-                s0, s1 = span
-                if index < s1 or s1 == index == se:
-                    span[1] += length
-                    # index is before s, or at s but not on self_span
-                    if index < s0 or s0 == index != ss or (
-                        s0 == index and span is not self_span
-                    ):
-                        span[0] += length
+        _update_spans(
+            self._type_to_spans, _insert_spans, index, length, self_span, ss,
+            se)
+
+    def _reparse(
+        self, removed: str, start: int, stop: int, end: int
+    ) -> None:
+        """Update the spans of SPAN_PARSER_TYPES after an edit.
+
+        The edit has replaced `removed`, which was at [start:stop], with
+        self._lststr[0][start:end]. Edits that do not touch any delimiter
+        are ignored if they can not create or remove a span, see _is_inert.
+        Otherwise the smallest stable region around the edit is reparsed
+        and its spans replace the old ones. The candidate regions are the
+        edited text (extended to cover the spans that it overlaps), the
+        spans that contain it, the top-level region around it, and finally
+        the whole string.
+        """
+        lststr = self._lststr
+        type_to_spans = self._type_to_spans
+        # Only look at the text around the edit; the whole string may not
+        # be joined yet. See _text_buffer.PieceTable.
+        lo = max(start - 20, 0)
+        window = lststr.slice(lo, end + 20)
+        old_window = window[:start - lo] + removed + window[end - lo:]
+        touched = (
+            _touches_delimiter(old_window, start - lo, stop - lo)
+            or _touches_delimiter(window, start - lo, end - lo)
+            or INVALID_NAME_END_SEARCH(window, 0, start - lo) is not None)
+        if touched and (
+            _touches_tag_delimiter(old_window, start - lo, stop - lo)
+            or _touches_tag_delimiter(window, start - lo, end - lo)
+            or (('>' in removed or '>' in window[start - lo:end - lo])
+                and _has_loose_tag_before(lststr, type_to_spans, start))
+        ):
+            containers = None
+        else:
+            a, b, containers, edged = _edit_region(
+                type_to_spans, start, end, True)
+            # _insert_spans extends some spans over the text that is inserted
+            # at their edges.
+            if not (touched or edged) and _is_inert(
+                lststr, type_to_spans, containers, start, end
+            ):
+                return
+        region = None
+        # The edited text is not stable if it is inside a parameter or in
+        # the name of its innermost container.
+        if (
+            containers
+            and containers[0][0] in ('Template', 'ParserFunction', 'WikiLink')
+            and all(c[0] != 'Parameter' for c in containers)
+            and _has_own_delimiters(lststr, containers[0][1])
+            and _after_first_pipe(lststr, type_to_spans, containers[0][1], a)
+            and not _may_pair_around(lststr, containers[0][1], a, b)
+        ):
+            region_spans = _stable_region_spans(
+                lststr, removed, start, end, a, b)
+            if region_spans is not None:
+                region = a, b, region_spans, None
+        if region is None and containers is not None:
+            for i, (type_, (s, e)) in enumerate(containers):
+                if type_ == 'Parameter' or any(
+                    c[0] == 'Parameter' for c in containers[i + 1:]
+                ):
+                    continue
+                region_spans = _stable_region_spans(
+                    lststr, removed, start, end, s, e,
+                    type_ in ('Comment', 'ExtensionTag'))
+                if region_spans is not None and [0, e - s] in region_spans[
+                    type_
+                ]:
+                    region = s, e, region_spans, None
+                    break
+            else:
+                if containers:
+                    a, b = containers[-1][1]
+                region = _top_region(
+                    lststr, type_to_spans, removed, start, end, a, b)
+        loose = None
+        if region is None:
+            string = lststr[0]
+            byte_array = bytearray(string, 'ascii', 'replace')
+            region_spans = parse_to_spans(byte_array)
+            region = 0, len(string), region_spans, None
+            loose = find_loose_delimiters(
+                bytearray(string, 'ascii', 'replace'), region_spans)
+        a, b, region_spans, region_loose = region
+        self_span = self._span
+        keep_self = _keeps_own_span(
+            lststr, self._type, self_span, a, b, region_spans)
+        if region_loose is not None:
+            for spans, new_spans in zip(type_to_spans._loose, region_loose):
+                spans[bisect_left(spans, [a]):bisect_left(spans, [b])] = [
+                    [s + a, e + a] for s, e in new_spans]
+        for type_, new_spans in region_spans.items():
+            spans = type_to_spans[type_]
+            i = bisect_left(spans, [a])
+            j = bisect_right(spans, [b])
+            if i == j and not new_spans:
+                continue
+            old_spans = spans[i:j]
+            old_span_pop = {(s[0], s[1]): s for s in old_spans}.pop
+            merged_spans = []  # type: List[List[int]]
+            merged_spans_append = merged_spans.append
+            for s, e in new_spans:
+                s += a
+                e += a
+                merged_spans_append(old_span_pop((s, e), None) or [s, e])
+            for span in old_spans:
+                if old_span_pop((span[0], span[1]), None) is None:
+                    continue
+                if span[1] > b or (span is self_span and keep_self):
+                    insort_right(merged_spans, span)
+                else:
+                    span[:] = -1, -1
+            spans[i:j] = merged_spans
+        if loose is not None and isinstance(type_to_spans, TypeToSpans):
+            type_to_spans._loose = loose
 
     def _nesting_level(self, parent_types) -> int:
         ss, se = self._span
@@ -445,18 +644,28 @@ class WikiText:
         This function is called upon extracting tables or extracting the data
         inside them.
         """
-        ss, se = self._span
-        string = self._lststr[0][ss:se]
-        cached_string, shadow = getattr(
+        lststr = self._lststr
+        cached_version, shadow = getattr(
             self, '_shadow_cache', (None, None))
-        if cached_string == string:
+        version = lststr.version
+        if cached_version == version:
+            return shadow
+        span = self._span
+        memo = self._type_to_spans._shadow_memo
+        if memo is not None and memo[0] is span and memo[1] == version:
+            shadow = memo[2]
+            self._shadow_cache = version, shadow
+            return shadow
+        ss, se = span
+        string = lststr.slice(ss, se)
+        shadow = _spans_shadow(
+            string, self._type, self._span, self._type_to_spans)
+        if shadow is not None:
+            self._shadow_cache = version, shadow
             return shadow
-        # In the old method the existing spans were used to create the shadow.
-        # But it was slow because there can be thousands of spans and iterating
-        # over them to find the relevant sub-spans could take a significant
-        # amount of time. The new method tries to parse the self.string which
-        # is usually much more faster because there are usually far less
-        # sub-spans for individual objects.
+        # The spans are not enough when self is inside an extension tag, when
+        # they cross each other, or when lazy parsing has not found them yet.
+        # Parse self.string in those cases.
         shadow = bytearray(string, 'ascii', 'replace')
         if self._type in SPAN_PARSER_TYPES:
             head = shadow[:2]
@@ -467,7 +676,7 @@ class WikiText:
             shadow[-2:] = tail
         else:
             parse_to_spans(shadow)
-        self._shadow_cache = string, shadow
+        self._shadow_cache = version, shadow
         return shadow
 
     @property
@@ -478,7 +687,7 @@ class WikiText:
         'ParserFunction', 'Parameter') only invalid characters are replaced.
         """
         ss, se = self._span
-        string = self._lststr[0][ss:se]
+        string = self._lststr.slice(ss, se)
         byte_array = bytearray(string, 'ascii', 'replace')
         subspans = self._subspans
         for type_ in 'Template', 'ParserFunction', 'Parameter':
@@ -489,20 +698,13 @@ class WikiText:
             byte_array[s:e] = (e - s) * b'_'
         return byte_array
 
-    def _pp_type_to_spans(self) -> Dict[str, List[List[int]]]:
+    def _pp_type_to_spans(self) -> TypeToSpans:
         """Create the arguments for the parse function used in pformat method.
 
         Only return sub-spans and change the them to fit the new scope, i.e
         self.string.
         """
-        ss, se = self._span
-        if ss == 0 and se == len(self._lststr[0]):
-            return deepcopy(self._type_to_spans)
-        return {
-            type_: [
-                [s - ss, e - ss] for s, e in spans[bisect_left(spans, [ss]):]
-                if e <= se
-            ] for type_, spans in self._type_to_spans.items()}
+        return self._type_to_spans.subspans_copy(*self._span)
 
     def pprint(self, indent: str = '    ', remove_comments=False):
         """Deprecated, use self.pformat instead."""
@@ -523,12 +725,13 @@ class WikiText:
         ws = WS
         # Do not try to do inplace pformat. It will overwrite on some spans.
         string = self.string
-        parsed = WikiText([string], self._pp_type_to_spans())
+        parsed = WikiText(new_text_buffer(string), self._pp_type_to_spans())
         # Since _type_to_spans arg of WikiText has been used, parsed._span
         # is not set yet.
         span = [0, len(string)]
         parsed._span = span
         parsed._type_to_spans['WikiText'] = [span]
+        parsed._type_to_spans._root = span
         if remove_comments:
             for c in parsed.comments:
                 del c[:]
@@ -798,28 +1001,15 @@ class WikiText:
         sections_append = sections.append
         type_to_spans = self._type_to_spans
         lststr = self._lststr
-        ss, se = _span = self._span
+        ss = self._span[0]
         type_spans = type_to_spans.setdefault('Section', [])
-        full_match = SECTIONS_FULLMATCH(self._shadow)
-        section_spans = full_match.spans('section')
-        levels = [len(eq) for eq in full_match.captures('equals')]
         span_tuple_to_span = {(s[0], s[1]): s for s in type_spans}.get
-        for current_index, (current_level, (s, e)) in enumerate(
-            zip(levels, section_spans), 1
-        ):
-            if level is not None and current_level != level:
+        for node in self._section_tree:
+            if level is not None and node.level != level:
                 continue
-            if include_subsections:
-                # Add text of the current_section to any parent section.
-                # Note that section 0 is not a parent for any subsection.
-                for section_index, section_level in enumerate(
-                    levels[current_index:], current_index
-                ):
-                    if current_level and section_level > current_level:
-                        e = section_spans[section_index][1]
-                    else:
-                        break
-            s, e = ss + s, ss + e
+            s = ss + node.start
+            e = ss + (
+                node.subsections_end if include_subsections else node.end)
             old_span = span_tuple_to_span((s, e))
             if old_span is None:
                 span = [s, e]
@@ -829,6 +1019,56 @@ class WikiText:
             sections_append(Section(lststr, type_to_spans, span, 'Section'))
         return sections
 
+    @property
+    def _section_tree(self) -> List['_SectionNode']:
+        """Return the sections of self in order, starting with the lead.
+
+        The result is cached until the next edit.
+        """
+        cached_version, nodes = getattr(
+            self, '_section_tree_cache', (None, None))
+        version = self._lststr.version
+        if cached_version == version:
+            return nodes
+        full_match = SECTIONS_FULLMATCH(self._shadow)
+        (lead_start, lead_end), *section_spans = full_match.spans('section')
+        lead = _SectionNode(0, lead_start, lead_end, None, None, None)
+        nodes = [lead]
+        nodes_append = nodes.append
+        # The sections that may still have subsections.
+        parents = []  # type: List[_SectionNode]
+        for (s, e), (es, ee), (ts, te) in zip(
+            section_spans,
+            full_match.spans('equals')[1:],
+            full_match.spans('title'),
+        ):
+            level = ee - es
+            while parents and parents[-1].level >= level:
+                # Sections are adjacent, the parent ends where s starts.
+                parents.pop().subsections_end = s
+            parent = parents[-1] if parents else None
+            node = _SectionNode(level, s, e, ts, te, parent)
+            if parent is not None:
+                parent.children.append(node)
+            nodes_append(node)
+            parents.append(node)
+        end = nodes[-1].end
+        for node in parents:
+            node.subsections_end = end
+        self._section_tree_cache = version, nodes
+        return nodes
+
+    def toc(self) -> List[Tuple[int, str]]:
+        """Return the (level, title) of each section heading in order.
+
+        This is the outline of self without creating any Section objects.
+        The lead section is not included.
+        """
+        string = self.string
+        return [
+            (node.level, string[node.title_start:node.title_end])
+            for node in self._section_tree[1:]]
+
     @property
     def tables(self) -> List['Table']:
         """Return a list of all tables."""
@@ -838,35 +1078,29 @@ class WikiText:
         """Return tables. Include nested tables if `recursive` is `True`."""
         type_to_spans = self._type_to_spans
         lststr = self._lststr
-        shadow = self._shadow[:]
-        ss, se = self._span
+        ss = self._span[0]
         spans = type_to_spans.setdefault('Table', [])
-        spans_append = spans.append
-        skip_self_span = self._type == 'Table'
         span_tuple_to_span_get = {(s[0], s[1]): s for s in spans}.get
-        return_spans = []
-        return_spans_append = return_spans.append
-        m = True
-        while m:
-            m = False
-            for m in TABLE_FINDITER(shadow, skip_self_span):
-                ms, me = m.span()
-                # Ignore leading whitespace using len(m[1]).
-                s, e = ss + ms + len(m[1]), ss + me
-                old_span = span_tuple_to_span_get((s, e))
-                if old_span is None:
-                    span = [s, e]
-                    spans_append(span)
-                    return_spans_append(span)
-                else:
-                    return_spans_append(old_span)
-                shadow[ms:me] = b'_' * (me - ms)
-        return_spans.sort()
-        spans.sort()
-        if not recursive:
-            return_spans = _outer_spans(return_spans)
-        return [
-            Table(lststr, type_to_spans, sp, 'Table') for sp in return_spans]
+        # The nesting levels found in the root are the levels of the tables.
+        version = lststr.version if self._type == 'WikiText' else None
+        tables = []
+        tables_append = tables.append
+        new_spans = False
+        for s, e, level in _table_spans(self._shadow, self._type == 'Table'):
+            s, e = ss + s, ss + e
+            span = span_tuple_to_span_get((s, e))
+            if span is None:
+                span = [s, e]
+                spans.append(span)
+                new_spans = True
+            if recursive or not level:
+                table = Table(lststr, type_to_spans, span, 'Table')
+                if version is not None:
+                    table._nesting_level_cache = version, level
+                tables_append(table)
+        if new_spans:
+            spans.sort()
+        return tables
 
     @property
     def _lists_shadow_ss(self) -> Tuple[bytearray, int]:
@@ -912,27 +1146,87 @@ class WikiText:
         lststr = self._lststr
         type_to_spans = self._type_to_spans
         spans = type_to_spans.setdefault('WikiList', [])
-        span_tuple_to_span_get = {(s[0], s[1]): s for s in spans}.get
-        shadow, ss = self._lists_shadow_ss
-        for pattern in \
-                (r'\#', r'\*', '[:;]') if pattern is None else (pattern,):
-            for m in finditer(
-                LIST_PATTERN_FORMAT.replace(b'{pattern}', pattern.encode()),
-                shadow, MULTILINE
+
+        def get_span(s: int, e: int) -> List[int]:
+            span = [s, e]
+            i = bisect_left(spans, span)
+            if i < len(spans) and spans[i] == span:
+                return spans[i]
+            spans.insert(i, span)
+            return span
+
+        if pattern is None or TREE_LIST_PATTERN_FULLMATCH(pattern):
+            list_tree = self._list_tree
+            version = lststr.version
+            for node in (
+                list_tree if pattern is None
+                else _list_nodes(list_tree, pattern)
             ):
-                ms, me = m.span()
-                s, e = ss + ms, ss + me
-                old_span = span_tuple_to_span_get((s, e))
-                if old_span is None:
-                    span = [s, e]
-                    insort_right(spans, span)
-                else:
-                    span = old_span
                 lists_append(WikiList(
-                    lststr, pattern, m, type_to_spans, span, 'WikiList'))
-        lists.sort(key=attrgetter('_span'))
+                    lststr, node.pattern, None, type_to_spans,
+                    get_span(node.start, node.end), 'WikiList',
+                    (version, node)))
+            return lists
+        shadow, ss = self._lists_shadow_ss
+        for m in compiled_pattern('list', pattern.encode()).finditer(shadow):
+            ms, me = m.span()
+            lists_append(WikiList(
+                lststr, pattern, m, type_to_spans, get_span(ss + ms, ss + me),
+                'WikiList'))
         return lists
 
+    @property
+    def _list_tree(self) -> List['_ListNode']:
+        """Return the top-level lists of self with their sublists.
+
+        Each list is a run of consecutive lines whose prefix matches the
+        pattern of the list. The result is cached until the next edit.
+        """
+        cached_version, roots = getattr(
+            self, '_list_tree_cache', (None, None))
+        version = self._lststr.version
+        if cached_version == version:
+            return roots
+        shadow, ss = self._lists_shadow_ss
+        roots = []  # type: List[_ListNode]
+        # The lists that the current line can continue, one for each level.
+        open_nodes = []  # type: List[_ListNode]
+        prefix = b''  # the prefix of the last line, with ; replaced by :
+        last_end = None
+        for m in LIST_LINE_FINDITER(shadow):
+            s, e = m.span()
+            last_prefix = prefix
+            prefix = shadow[s:m.end('prefix')].translate(LIST_PREFIX_CLASSES)
+            if s != last_end:
+                common = 0
+            elif prefix == last_prefix:
+                last_end = e
+                continue
+            else:
+                common = 0
+                for a, b in zip(prefix, last_prefix):
+                    if a != b:
+                        break
+                    common += 1
+            for node in open_nodes[common:]:
+                node.end = ss + last_end
+            del open_nodes[common:]
+            for byte in prefix[common:]:
+                if open_nodes:
+                    parent = open_nodes[-1]
+                    node = _ListNode(
+                        parent.pattern + LIST_PATTERN_PIECES[byte], ss + s)
+                    parent.children.append(node)
+                else:
+                    node = _ListNode(LIST_PATTERN_PIECES[byte], ss + s)
+                    roots.append(node)
+                open_nodes.append(node)
+            last_end = e
+        for node in open_nodes:
+            node.end = ss + last_end
+        self._list_tree_cache = version, roots
+        return roots
+
     def tags(self, name=None) -> List['Tag']:
         """Deprecated, use self.get_tags instead."""
         warn(
@@ -959,52 +1253,27 @@ class WikiText:
                 Tag(lststr, type_to_spans, span, 'ExtensionTag')
                 for span in type_to_spans['ExtensionTag']]
         tags_append = tags.append
-        # Get the left-most start tag, match it to right-most end tag
-        # and so on.
         ss = self._span[0]
         shadow = self._shadow
         if name:
             # There is a name but it is not in TAG_EXTENSIONS.
-            reversed_start_matches = reversed([m for m in regex_compile(
-                START_TAG_PATTERN.replace(
-                    rb'{name}', rb'(?P<name>' + name.encode() + rb')')
-            ).finditer(shadow)])
-            end_search = regex_compile(END_TAG_PATTERN.replace(
-                b'{name}', name.encode())).search
+            encoded_name = name.encode()
+            start_matches = compiled_pattern(
+                'start_tag', encoded_name).finditer(shadow)
+            end_matches = compiled_pattern(
+                'end_tag', encoded_name).finditer(shadow, overlapped=True)
         else:
-            reversed_start_matches = reversed(
-                [m for m in NAME_CAPTURING_HTML_START_TAG_FINDITER(shadow)])
-        shadow_copy = shadow[:]
+            start_matches = NAME_CAPTURING_HTML_START_TAG_FINDITER(shadow)
+            # End tags may contain other end tags, e.g. `</i </b>>`.
+            end_matches = NAME_CAPTURING_HTML_END_TAG_FINDITER(
+                shadow, overlapped=True)
         spans = type_to_spans.setdefault('Tag', [])
         span_tuple_to_span_get = {(s[0], s[1]): s for s in spans}.get
         spans_append = spans.append
-        for start_match in reversed_start_matches:
-            if start_match['self_closing']:
-                # Don't look for the end tag
-                s, e = start_match.span()
-                span = [ss + s, ss + e]
-            else:
-                # look for the end-tag
-                start_start, start_end = start_match.span()
-                if name:
-                    # the end_search is already available
-                    # noinspection PyUnboundLocalVariable
-                    end_match = end_search(shadow_copy, start_end)
-                else:
-                    # build end_search according to start tag name
-                    end_match = search(
-                        END_TAG_PATTERN.replace(
-                            b'{name}', start_match['name']),
-                        shadow_copy, pos=start_end)
-                if end_match:
-                    s, e = end_match.span()
-                    shadow_copy[s:e] = b'_' * (e - s)
-                    span = [ss + start_start, ss + e]
-                else:
-                    # Assume start-only tag.
-                    span = [ss + start_start, ss + start_end]
-            old_span = span_tuple_to_span_get((span[0], span[1]))
+        for s, e in _tag_spans(start_matches, end_matches):
+            old_span = span_tuple_to_span_get((ss + s, ss + e))
             if old_span is None:
+                span = [ss + s, ss + e]
                 spans_append(span)
             else:
                 span = old_span
@@ -1023,6 +1292,89 @@ class WikiText:
         return []
 
 
+def _tag_spans(
+    start_matches: Iterable[Any], end_matches: Iterable[Any]
+) -> List[Tuple[int, int]]:
+    """Pair the start and end tags and return the span of each tag.
+
+    Each end tag closes the last open start tag with the same name. A start
+    tag is open from its end so that an end tag in its attributes does not
+    close it. Start tags that are left open are start-only tags.
+    """
+    # (position, is_end, match); positions of events of the same kind are
+    # distinct, so the matches are never compared.
+    events = [(m.end(), False, m) for m in start_matches]
+    events += [(m.start(), True, m) for m in end_matches]
+    # Both lists are already sorted, sort only merges them.
+    events.sort()
+    open_tags = {}  # type: Dict[bytes, List[Any]]
+    spans = []  # type: List[Tuple[int, int]]
+    spans_append = spans.append
+    for _, is_end, m in events:
+        if is_end:
+            stack = open_tags.get(m['name'])
+            if stack:
+                spans_append((stack.pop().start(), m.end()))
+        elif m['self_closing']:
+            spans_append(m.span())
+        else:
+            open_tags.setdefault(m['name'], []).append(m)
+    for stack in open_tags.values():
+        spans += [m.span() for m in stack]
+    return spans
+
+
+def _list_nodes(nodes: List['_ListNode'], pattern: str) -> List['_ListNode']:
+    """Return the lists with the given pattern in nodes and their sublists."""
+    result = []  # type: List[_ListNode]
+    for node in nodes:
+        node_pattern = node.pattern
+        if node_pattern == pattern:
+            result.append(node)
+        elif pattern.startswith(node_pattern):
+            result += _list_nodes(node.children, pattern)
+    return result
+
+
+class _ListNode:
+
+    """A list of WikiText._list_tree."""
+
+    __slots__ = 'pattern', 'start', 'end', 'children'
+
+    def __init__(self, pattern: str, start: int) -> None:
+        self.pattern = pattern
+        self.start = start
+        self.end = None  # type: Optional[int]
+        self.children = []  # type: List[_ListNode]
+
+
+class _SectionNode:
+
+    """A section of WikiText._section_tree.
+
+    start and end are relative to the node that owns the tree. end excludes
+    the subsections while subsections_end includes them.
+    """
+
+    __slots__ = (
+        'level', 'start', 'end', 'subsections_end', 'title_start',
+        'title_end', 'parent', 'children')
+
+    def __init__(
+        self, level: int, start: int, end: int, title_start: Optional[int],
+        title_end: Optional[int], parent: Optional['_SectionNode'],
+    ) -> None:
+        self.level = level
+        self.start = start
+        self.end = end
+        self.subsections_end = end
+        self.title_start = title_start
+        self.title_end = title_end
+        self.parent = parent
+        self.children = []  # type: List[_SectionNode]
+
+
 class SubWikiText(WikiText):
     """Define a class to be inherited by some subclasses of WikiText.
 
@@ -1107,15 +1459,783 @@ class SubWikiText(WikiText):
         return None
 
 
-def _outer_spans(sorted_spans: List[List[int]]) -> Iterable[List[int]]:
-    """Yield the outermost intervals."""
-    for i, span in enumerate(sorted_spans):
-        se = span[1]
-        for ps, pe in islice(sorted_spans, None, i):
-            if se < pe:
+def _update_spans(
+    type_to_spans: Dict[str, List[List[int]]], func: Callable, *args
+) -> None:
+    """Call func(spans_lists, *args) on the spans of all types.
+
+    See TypeToSpans.update_spans.
+    """
+    if isinstance(type_to_spans, TypeToSpans):
+        type_to_spans.update_spans(func, *args)
+        return
+    func(type_to_spans.values(), *args)
+
+
+def _close_spans(
+    spans_lists: Iterable[List[List[int]]], start: int, stop: int,
+    ss: int, se: int,
+) -> None:
+    """Close the spans within (start, stop) except [ss, se]."""
+    for spans in spans_lists:
+        b = bisect_left(spans, [start])
+        for i, (s, e) in enumerate(
+            spans[b:bisect_right(spans, [stop], b)]
+        ):
+            if e <= stop:
+                if ss != s or se != e:
+                    spans.pop(i + b)[:] = -1, -1
+                    b -= 1
+
+
+def _shrink_spans(
+    spans_lists: Iterable[List[List[int]]], rmstart: int, rmstop: int,
+    root: List[int] = None,
+) -> None:
+    """Update the spans according to the removed [rmstart, rmstop).
+
+    The root span is emptied instead of being closed.
+    """
+    # Note: The following algorithm won't work correctly if spans
+    # are not sorted.
+    # Note: No span should be removed from _type_to_spans.
+    rmlength = rmstop - rmstart
+    for spans in spans_lists:
+        # Spans that start after rmstop are only shifted.
+        i = bisect_left(spans, [rmstop])
+        for span in spans[i:]:
+            span[0] -= rmlength
+            span[1] -= rmlength
+        i -= 1
+        if i < 0:
+            continue
+        s, e = span = spans[i]
+        while True:
+            if rmstart <= s:
+                if rmstop < e:
+                    # rmstart < s <= rmstop < e
+                    span[:] = rmstart, e - rmlength
+                    i -= 1
+                    if i < 0:
+                        break
+                    s, e = span = spans[i]
+                    continue
+                # rmstart <= s <= e <= rmstop
+                if span is root:
+                    span[:] = rmstart, rmstart
+                else:
+                    spans.pop(i)[:] = -1, -1
+                i -= 1
+                if i < 0:
+                    break
+                s, e = span = spans[i]
+                continue
+            break  # pragma: no cover
+        while i >= 0:
+            if e <= rmstart:
+                # s <= e <= rmstart <= rmstop
+                i -= 1
+                if i < 0:
+                    break
+                s, e = span = spans[i]
+                continue
+            if rmstop <= e:
+                # s <= rmstart <= rmstop <= e
+                span[1] -= rmlength
+            else:
+                # s <= rmstart < e < rmstop
+                span[1] = rmstart
+            i -= 1
+            if i < 0:
                 break
-        else:  # none of the previous spans included span
-            yield span
+            s, e = span = spans[i]
+            continue
+
+
+def _insert_spans(
+    spans_lists: Iterable[List[List[int]]], index: int, length: int,
+    self_span: List[int], ss: int, se: int,
+) -> None:
+    """Update the spans according to length characters added at index.
+
+    self_span is the span of the object that the insertion was made on and
+    [ss, se] is its value before the insertion.
+    """
+    for spans in spans_lists:
+        for span in spans:
+            s0, s1 = span
+            # Spans that end at the end of self are extended unless
+            # they are inside self.
+            if index < s1 or (s1 == index == se and s0 <= ss):
+                span[1] += length
+                # index is before s, or at s but not on self_span nor
+                # on any span that contains self_span
+                if index < s0 or s0 == index != ss or (
+                    s0 == index and span is not self_span and s1 <= se
+                ):
+                    span[0] += length
+
+
+def _apply_edits(
+    lststr: MutableSequence[str], type_to_spans: 'TypeToSpans', edits: list
+) -> None:
+    """Apply the edits recorded by WikiText.batch.
+
+    The result is the same as applying the edits one by one, starting from
+    the last one.
+    """
+    # sort is stable; edits at the same position keep their order.
+    edits.sort(key=itemgetter(0, 1))
+    starts = []  # type: List[int]
+    stops = []  # type: List[int]
+    offsets = [0]  # the total length change of the edits before each edit
+    string = lststr[0]
+    parts = []  # type: List[str]
+    pos = 0
+    for start, stop, value, _, _ in edits:
+        if start < pos:
+            raise ValueError('the edits of a batch must not overlap')
+        parts += string[pos:start], value
+        pos = stop
+        starts.append(start)
+        stops.append(stop)
+        offsets.append(offsets[-1] + len(value) - stop + start)
+    parts.append(string[pos:])
+    root = type_to_spans._root
+    # The span of each editing object, as it is when the edit is applied.
+    rules = [None] * len(edits)  # type: list
+    for k in range(len(edits) - 1, -1, -1):
+        start, stop, value, kind, obj = edits[k]
+        self_span = obj._span
+        ss_se = _batch_span(
+            self_span, rules, starts, stops, offsets, k + 1, root
+        ) or (-1, -1)
+        rules[k] = (start, stop, len(value), kind, self_span) + ss_se
+    lststr[0] = ''.join(parts)
+    _update_spans(
+        type_to_spans, _batch_spans, rules, starts, stops, offsets, root)
+    for k, (start, stop, value, kind, obj) in enumerate(edits):
+        new_start = start + offsets[k]
+        obj._reparse(
+            string[start:stop], new_start, new_start + stop - start,
+            new_start + len(value))
+
+
+def _batch_spans(
+    spans_lists: Iterable[List[List[int]]], rules: list,
+    starts: List[int], stops: List[int], offsets: List[int],
+    root: List[int] = None,
+) -> None:
+    """Update the spans according to the edits of a batch."""
+    for spans in spans_lists:
+        closed = False
+        for span in spans:
+            new_span = _batch_span(
+                span, rules, starts, stops, offsets, 0, root)
+            if new_span is None:
+                span[:] = -1, -1
+                closed = True
+            else:
+                span[:] = new_span
+        if closed:
+            spans[:] = [span for span in spans if span[1] != -1]
+
+
+def _batch_span(
+    span: List[int], rules: list, starts: List[int], stops: List[int],
+    offsets: List[int], low: int, root: List[int] = None,
+) -> Optional[Tuple[int, int]]:
+    """Return span after the edits[low:] of a batch or None if it's closed.
+
+    Only the edits that touch the span are applied one by one, the ones
+    that are before it only shift it. The root span is emptied instead of
+    being closed.
+    """
+    s, e = span
+    k = bisect_right(starts, e, low) - 1
+    while k >= low:
+        if stops[k] < s:
+            shift = offsets[k + 1] - offsets[low]
+            return s + shift, e + shift
+        start, stop, length, kind, self_span, ss, se = rules[k]
+        if kind == 'insert':
+            s, e = _inserted_span(
+                span, s, e, start, length, self_span, ss, se)
+        elif kind == 'del':
+            new_span = _shrunk_span(s, e, start, stop)
+            if new_span is None:
+                if span is not root:
+                    return None
+                new_span = start, start
+            s, e = new_span
+        else:  # 'set'
+            if start <= s < stop and e <= stop and (s != ss or e != se):
+                return None
+            length -= stop - start
+            if length > 0:
+                s, e = _inserted_span(
+                    span, s, e, start, length, self_span, ss, se)
+            elif length < 0:
+                new_span = _shrunk_span(s, e, stop + length, stop)
+                if new_span is None:
+                    if span is not root:
+                        return None
+                    new_span = stop + length, stop + length
+                s, e = new_span
+        k -= 1
+    return s, e
+
+
+def _inserted_span(
+    span: List[int], s: int, e: int, index: int, length: int,
+    self_span: List[int], ss: int, se: int,
+) -> Tuple[int, int]:
+    """Return [s, e] after an insertion. See _insert_spans."""
+    if index < e or (e == index == se and s <= ss):
+        if index < s or s == index != ss or (
+            s == index and span is not self_span and e <= se
+        ):
+            s += length
+        e += length
+    return s, e
+
+
+def _shrunk_span(
+    s: int, e: int, rmstart: int, rmstop: int
+) -> Optional[Tuple[int, int]]:
+    """Return [s, e] after a removal or None if closed. See _shrink_spans."""
+    if rmstop <= s:
+        rmlength = rmstop - rmstart
+        return s - rmlength, e - rmlength
+    if rmstart <= s:
+        if rmstop < e:
+            return rmstart, e - rmstop + rmstart
+        return None
+    if e <= rmstart:
+        return s, e
+    if rmstop <= e:
+        return s, e - rmstop + rmstart
+    return s, rmstart
+
+
+def _edit_region(
+    type_to_spans: Dict[str, List[List[int]]], a: int, b: int,
+    touching: bool = False,
+) -> Tuple[int, int, List[Tuple[str, List[int]]], bool]:
+    """Extend [a, b] over the spans that overlap it.
+
+    If touching is True, the spans that only touch the initial [a, b] are
+    also included. Return the extended region, the (type_, span) of the
+    spans that strictly contain it, innermost first, and whether any span
+    starts at a or ends at b while covering the initial [a, b].
+    """
+    adjacent = int(touching)
+    edged = False
+    grown = True
+    while grown:
+        grown = False
+        containers = []  # type: List[Tuple[str, List[int]]]
+        for type_ in SPAN_PARSER_TYPES:
+            spans = type_to_spans[type_]
+            for span in islice(spans, bisect_right(spans, [b + adjacent])):
+                s, e = span
+                if e < a + 1 - adjacent or (a <= s and e <= b):
+                    continue
+                if s < a and b < e:
+                    containers.append((type_, span))
+                    continue
+                if adjacent and a < b and (s == a or e == b):
+                    edged = True
+                if s < a:
+                    a = s
+                if e > b:
+                    b = e
+                grown = True
+        adjacent = 0
+    containers.sort(key=_container_length)
+    return a, b, containers, edged
+
+
+def _container_length(container: Tuple[str, List[int]]) -> int:
+    s, e = container[1]
+    return e - s
+
+
+def _is_inert(
+    lststr: MutableSequence[str], type_to_spans: Dict[str, List[List[int]]],
+    containers: List[Tuple[str, List[int]]], start: int, end: int,
+) -> bool:
+    """Return True if an edit that touches no delimiter can not change spans.
+
+    Such an edit can still create or remove spans if it is in the name of a
+    template, parser function, or wikilink (the text of a parameter is part
+    of the name of its parent), in a parsable extension tag, or between an
+    opener and a closer that may pair up after the edit.
+    """
+    for type_, span in containers:
+        if type_ == 'Parameter':
+            continue
+        if type_ == 'Comment':
+            return True
+        s, e = span
+        if type_ == 'ExtensionTag':
+            head = lststr.slice(s, start)
+            return UNPARSABLE_TAG_MATCH(
+                bytearray(head[:32], 'ascii', 'replace')
+            ) is not None and '>' in head and '<' in lststr.slice(end, e)
+        return (
+            _has_own_delimiters(lststr, span)
+            and _after_first_pipe(lststr, type_to_spans, span, start)
+            and not _may_pair_around(lststr, span, start, end))
+    loose = getattr(type_to_spans, '_loose', None)
+    if loose is None:
+        return False
+    openers, closers = loose
+    return not bisect_left(openers, [start]) or bisect_left(
+        closers, [end]) == len(closers)
+
+
+def _may_pair_around(
+    lststr: MutableSequence[str], span: List[int], start: int, end: int
+) -> bool:
+    """Return True if span has an opener before start and a closer after end.
+
+    The loose delimiters inside spans are not tracked, therefore any of
+    these pairs is assumed to be loose.
+    """
+    s, e = span
+    head = lststr.slice(s + 2, start)
+    tail = lststr.slice(end, e - 2)
+    return ('[[' in head and ']]' in tail) or ('{{' in head and '}}' in tail)
+
+
+def _region_windows(
+    lststr: MutableSequence[str], removed: str, start: int, end: int,
+    a: int, b: int,
+) -> Optional[Tuple[str, str]]:
+    """Return the new and old texts of [a:b] if its edges are stable.
+
+    The edit has replaced `removed` with lststr[0][start:end], which is
+    inside [a:b]. Return None if any of the edges, before or after the edit,
+    splits a delimiter.
+    """
+    lo = max(a - 20, 0)
+    window = lststr.slice(lo, b + 4)
+    old_window = window[:start - lo] + removed + window[end - lo:]
+    a -= lo
+    b -= lo
+    old_b = b - (len(window) - len(old_window))
+    # _touches_delimiter looks at most 20 chars before and 3 chars after an
+    # edge. The old and new windows are the same there if it is far enough
+    # from the edit.
+    if (
+        _touches_delimiter(window, a, a)
+        or _touches_delimiter(window, b, b)
+        or (a + 3 > start - lo and _touches_delimiter(old_window, a, a))
+        or (b - 20 < end - lo and _touches_delimiter(
+            old_window, old_b, old_b))
+    ):
+        return None
+    return window[a:b], old_window[a:old_b]
+
+
+def _may_cross_html_tag(
+    lststr: MutableSequence[str], a: int, text: str
+) -> bool:
+    """Return True if an HTML tag may cross the edges of text, at [a:].
+
+    The brackets inside HTML tags are ignored by the parser, therefore text
+    can not be parsed on its own if it may start a tag that ends after it,
+    or contain the brackets or the end of a tag that starts before it.
+    """
+    if text.rfind('<') > text.rfind('>'):
+        return True
+    if HTML_TAG_CHARS_SEARCH(text) is None:
+        return False
+    # Look for the last `<` or `>` before a.
+    end = a
+    size = 64
+    while end > 0:
+        start = max(end - size, 0)
+        chunk = lststr.slice(start, end)
+        lt = chunk.rfind('<')
+        gt = chunk.rfind('>')
+        if lt != gt:
+            return lt > gt
+        end = start
+        size *= 2
+    return False
+
+
+def _has_own_delimiters(lststr: MutableSequence[str], span: List[int]) -> bool:
+    """Return True if the delimiters of span are not part of longer runs.
+
+    Otherwise, the contents of span can change the parent of its delimiters,
+    e.g. `{{{a|}b}}}` has a template, but `{{{a|b}}}` is a parameter.
+    """
+    s, e = span
+    head = lststr.slice(max(s - 1, 0), s + 1)
+    tail = lststr.slice(e - 1, e + 1)
+    return (
+        (len(head) < 2 or head[0] != head[1])
+        and (len(tail) < 2 or tail[0] != tail[1]))
+
+
+def _stable_region_spans(
+    lststr: MutableSequence[str], removed: str, start: int, end: int,
+    a: int, b: int, masked: bool = False,
+) -> Optional[Dict[str, List[List[int]]]]:
+    """Return the spans of lststr[0][a:b] if it is a stable region.
+
+    A region is stable if its edges do not split any delimiter and if both
+    the old and new texts have no unmatched delimiters and the same nesting
+    height. The contents of comments and extension tags are masked before
+    any other span is parsed; if the region is one of them (`masked`), only
+    its edges are checked. Return None if the region is not stable.
+    """
+    texts = _region_windows(lststr, removed, start, end, a, b)
+    if texts is None:
+        return None
+    if masked:
+        return parse_to_spans(bytearray(texts[0], 'ascii', 'replace'))
+    if _may_cross_html_tag(lststr, a, texts[0]) or _may_cross_html_tag(
+        lststr, a, texts[1]
+    ):
+        return None
+    new = _isolated_parse(texts[0])
+    if new is None:
+        return None
+    old = _isolated_parse(texts[1])
+    if old is None or old[1] != new[1]:
+        return None
+    return new[0]
+
+
+def _top_region(
+    lststr: MutableSequence[str], type_to_spans: Dict[str, List[List[int]]],
+    removed: str, start: int, end: int, a: int, b: int,
+) -> Optional[Tuple[int, int, Dict[str, List[List[int]]], list]]:
+    """Return (a, b, spans, loose_delimiters) of a top-level region.
+
+    [a:b] is not inside any span. It is extended to the loose delimiters
+    around it as long as they may pair up with each other or with the loose
+    delimiters inside it. Return None if the loose delimiters are not known
+    or if the extended region is not stable.
+    """
+    loose = getattr(type_to_spans, '_loose', None)
+    if loose is None:
+        return None
+    openers, closers = loose
+    while True:
+        for spans in loose:
+            i = bisect_left(spans, [a])
+            if i and spans[i - 1][1] > a:
+                a = spans[i - 1][0]
+            i = bisect_left(spans, [b])
+            if i and spans[i - 1][1] > b:
+                b = spans[i - 1][1]
+        a, b, containers, _ = _edit_region(type_to_spans, a, b)
+        if containers:
+            return None
+        texts = _region_windows(lststr, removed, start, end, a, b)
+        if texts is None or _may_cross_html_tag(
+            lststr, a, texts[0]
+        ) or _may_cross_html_tag(lststr, a, texts[1]):
+            return None
+        byte_array = bytearray(texts[0], 'ascii', 'replace')
+        region_spans = parse_to_spans(byte_array)
+        region_loose = new_openers, new_closers = find_loose_delimiters(
+            bytearray(texts[0], 'ascii', 'replace'), region_spans)
+        i = bisect_left(openers, [a])
+        j = bisect_left(closers, [b])
+        after = j < len(closers)
+        if i and (new_closers or after):
+            if after:
+                b = closers[j][1]
+            a = openers[i - 1][0]
+        elif new_openers and after:
+            b = closers[j][1]
+        else:
+            return a, b, region_spans, region_loose
+
+
+def _keeps_own_span(
+    lststr: MutableSequence[str], type_: str, span: List[int], a: int, b: int,
+    region_spans: Dict[str, List[List[int]]],
+) -> bool:
+    """Return True if span should be kept even if it was not found again.
+
+    A node can be edited into an invalid one, e.g. by deleting the title of
+    a wikilink, without being removed as long as its own delimiters are
+    intact and it does not clash with any of the spans found in [a:b].
+    """
+    delimiters = NODE_DELIMITERS.get(type_)
+    if delimiters is None:
+        return False
+    s, e = span
+    if not a <= s < e <= b:
+        return False
+    opener, closer = delimiters
+    if e - s < len(opener) + len(closer) or lststr.slice(
+        s, s + len(opener)
+    ) != opener or lststr.slice(e - len(closer), e) != closer:
+        return False
+    s -= a
+    e -= a
+    for spans in region_spans.values():
+        for ns, ne in spans:
+            if ns == s or ns < s < ne < e or s < ns < e < ne:
+                return False
+    return True
+
+
+def _touches_tag_delimiter(string: str, start: int, stop: int) -> bool:
+    """Return True if string[start:stop] touches a comment or tag delimiter.
+
+    Unlike _touches_delimiter, delimiters that end at start or begin at stop
+    also count.
+    """
+    for m in TAG_DELIMITERS_FINDITER(string, max(start - 20, 0), stop + 20):
+        if m.start() <= stop and m.end() >= start:
+            return True
+    return False
+
+
+def _has_loose_tag_before(
+    lststr: MutableSequence[str], type_to_spans: Dict[str, List[List[int]]],
+    index: int,
+) -> bool:
+    """Return True if a loose `<tag` opener may end after index.
+
+    A `>` that is added or removed after it may complete or break the tag.
+    """
+    loose = getattr(type_to_spans, '_loose', None)
+    if loose is None:
+        return True
+    openers = loose[0]
+    for i in range(bisect_left(openers, [index]) - 1, -1, -1):
+        s, e = openers[i]
+        if lststr.slice(s, s + 2) not in ('{{', '[[', '<!'):
+            return '>' not in lststr.slice(e, index)
+    return False
+
+
+def _touches_delimiter(string: str, start: int, stop: int) -> bool:
+    """Return True if string[start:stop] or its edges touch a delimiter.
+
+    An edge touches a delimiter if it is between two identical brackets,
+    before a `>`, or inside the name of a tag.
+    """
+    # All the checks below need one of these chars near [start:stop].
+    if DELIMITER_CHARS_SEARCH(string, max(start - 20, 0), stop + 3) is None:
+        return False
+    if DELIMITER_CHARS_SEARCH(string, start, stop):
+        return True
+    for m in COMMENT_DELIMITERS_FINDITER(
+        string, max(start - 3, 0), stop + 3
+    ):
+        ms, me = m.span()
+        if ms < stop and me > start and (ms < start or start != stop):
+            return True
+    for p in {start, stop}:
+        if 0 < p < len(string):
+            left, right = string[p - 1:p + 1]
+            if (left == right and left in '{}[]') or right == '>':
+                return True
+        if TAG_NAME_END_SEARCH(string, max(p - 20, 0), p):
+            return True
+    return False
+
+
+def _isolated_parse(
+    string: str
+) -> Optional[Tuple[Dict[str, List[List[int]]], int]]:
+    """Return the result of _parse_region(string).
+
+    The same short regions are often parsed again, e.g. when the same value
+    is assigned to an argument repeatedly, so their results are cached and
+    must not be modified.
+    """
+    if len(string) > REGION_CACHE_MAX_LENGTH:
+        return _parse_region(string)
+    return _cached_parse_region(string)
+
+
+def _parse_region(
+    string: str
+) -> Optional[Tuple[Dict[str, List[List[int]]], int]]:
+    """Return the spans of string and their nesting height.
+
+    Return None if string has any unmatched delimiter, even if it is inside
+    one of the spans.
+    """
+    byte_array = bytearray(string, 'ascii', 'replace')
+    type_to_spans = parse_to_spans(byte_array)
+    openers, closers = find_loose_delimiters(
+        bytearray(string, 'ascii', 'replace'), type_to_spans)
+    if openers or closers:
+        return None
+    spans = sorted(
+        type_to_spans['Parameter'] + type_to_spans['ParserFunction']
+        + type_to_spans['Template'] + type_to_spans['WikiLink'],
+        key=lambda span: (span[0], -span[1]))
+    height = 0
+    open_ends = []  # type: List[int]
+    for s, e in spans:
+        while open_ends and open_ends[-1] <= s:
+            open_ends.pop()
+        open_ends.append(e)
+        if len(open_ends) > height:
+            height = len(open_ends)
+    return type_to_spans, height
+
+
+_cached_parse_region = lru_cache(maxsize=REGION_CACHE_SIZE)(_parse_region)
+
+
+def _after_first_pipe(
+    lststr: MutableSequence[str], type_to_spans: Dict[str, List[List[int]]],
+    span: List[int], index: int,
+) -> bool:
+    """Return True if index is after the first pipe of the given span.
+
+    Pipes that are inside the sub-spans of span are ignored.
+    """
+    ss = span[0]
+    string = lststr.slice(ss, index)
+    pipe = string.find('|', 2)
+    if pipe == -1:
+        return False
+    subspans = []  # type: List[List[int]]
+    for type_ in SPAN_PARSER_TYPES:
+        spans = type_to_spans[type_]
+        subspans += spans[
+            bisect_left(spans, [ss + 1]):bisect_left(spans, [index])]
+    while pipe != -1:
+        p = ss + pipe
+        if not any(s < p < e for s, e in subspans):
+            return True
+        pipe = string.find('|', pipe + 1)
+    return False
+
+
+def _spans_shadow(
+    string: str, type_: str, self_span: List[int],
+    type_to_spans: Dict[str, List[List[int]]],
+) -> Optional[bytearray]:
+    """Build the shadow of string from the spans that are already known.
+
+    Only the sub-spans of self_span are visited and each of them is found
+    using bisect. Return None if the result might differ from parsing the
+    string again.
+    """
+    if type_ == 'Comment' or type_ == 'ExtensionTag' or getattr(
+        type_to_spans, '_byte_array', None
+    ) is not None:  # don't run the pending stages of lazy parsing
+        return None
+    ss, se = self_span
+    ext_spans = type_to_spans['ExtensionTag']
+    i = bisect_right(ext_spans, [ss, se]) - 1
+    if i >= 0 and ext_spans[i][1] >= se and ext_spans[i] is not self_span:
+        # The extension tags of a parsable tag are not in type_to_spans.
+        return None
+    subspans = []  # type: List[Tuple[int, int, str]]
+    subspans_append = subspans.append
+    for span_type in SPAN_PARSER_TYPES:
+        spans = type_to_spans[span_type]
+        for span in spans[
+            bisect_left(spans, [ss]):bisect_right(spans, [se])
+        ]:
+            s, e = span
+            if e <= se and span is not self_span:
+                subspans_append((s - ss, e - ss, span_type))
+    shadow = bytearray(string, 'ascii', 'replace')
+    if subspans:
+        subspans.sort(key=_start_and_negative_end)
+        ends = []  # type: List[int]
+        for s, e, span_type in subspans:
+            while ends and ends[-1] <= s:
+                ends.pop()
+            if ends and ends[-1] < e:
+                return None
+            ends.append(e)
+            if span_type == 'Comment':
+                shadow[s:e] = b' ' * (e - s)
+        for s, e, span_type in subspans:
+            if span_type == 'ExtensionTag':
+                shadow[s:e] = b'_' * (e - s)
+    # Follow the order of parse_to_spans (and _parse_pm_pf_tl).
+    is_span_parser_type = type_ in SPAN_PARSER_TYPES
+    if is_span_parser_type:
+        head = shadow[:2]
+        tail = shadow[-2:]
+        shadow[:2] = shadow[-2:] = b'__'
+    tags = [m.span() for m in HTML_START_TAG_FINDITER(shadow)]
+    tags += [m.span() for m in HTML_END_TAG_FINDITER(shadow)]
+    for ms, me in tags:
+        shadow[ms:me] = blank_brackets(shadow[ms:me])
+    # Inner spans are masked first.
+    subspans.sort(key=_span_length)
+    for s, e, span_type in subspans:
+        if span_type == 'Template' or span_type == 'ParserFunction':
+            shadow[s:e] = b'X' * (e - s)
+        elif span_type == 'WikiLink' or span_type == 'ExtensionTag':
+            shadow[s:e] = b'_' * (e - s)
+        elif span_type == 'Parameter':
+            shadow[s:e] = (
+                b'PPP' + shadow[s + 3:e - 3].replace(b'|', b'P') + b'PPP')
+    if b'{{' in shadow:
+        # Parsing might find new templates after masking the known ones.
+        return None
+    for ms, me in tags:
+        shadow[ms:me] = blank_sensitive_chars(shadow[ms:me])
+    if is_span_parser_type:
+        shadow[:2] = head
+        shadow[-2:] = tail
+    return shadow
+
+
+def _start_and_negative_end(
+    subspan: Tuple[int, int, str]
+) -> Tuple[int, int]:
+    return subspan[0], -subspan[1]
+
+
+def _span_length(subspan: Tuple[int, int, str]) -> int:
+    return subspan[1] - subspan[0]
+
+
+def _table_spans(
+    shadow: bytearray, pos: int
+) -> List[Tuple[int, int, int]]:
+    """Return the sorted (start, end, level) of tables in a single pass.
+
+    The open table-starts are kept in a stack and each table-end closes
+    the last one. If the shadow ends with a newline followed by whitespace,
+    the last unclosed table ends there.
+    """
+    spans = []  # type: List[Tuple[int, int]]
+    starts = []  # type: List[int]
+    for m in TABLE_DELIMITER_FINDITER(shadow, pos):
+        start = m.start('start')
+        if start != -1:
+            starts.append(start)
+        elif starts:
+            # The first line can't be a table-end, starts would be empty.
+            spans.append((starts.pop(), m.end()))
+    if starts and 10 in shadow[len(shadow.rstrip()):]:  # ord('\n')
+        spans.append((starts.pop(), len(shadow)))
+    spans.sort()
+    # The level is the number of closed tables around a table. Unclosed
+    # table-starts are not tables.
+    leveled_spans = []  # type: List[Tuple[int, int, int]]
+    ends = []  # type: List[int]
+    for s, e in spans:
+        while ends and ends[-1] <= s:
+            ends.pop()
+        leveled_spans.append((s, e, len(ends)))
+        ends.append(e)
+    return leveled_spans
 
 
 if __name__ == '__main__':
@@ -1127,6 +2247,6 @@ if __name__ == '__main__':
     from ._comment import Comment
     from ._externallink import ExternalLink
     from ._section import Section
-    from ._wikilist import WikiList, LIST_PATTERN_FORMAT
+    from ._wikilist import WikiList
     from ._table import Table
     from ._parameter import Parameter